@@ -2,40 +2,51 @@
 Description: This script counts the total number of CloudWatch log groups in an AWS account.
              It uses the AWS SDK for Python (Boto3) to interact with CloudWatch Logs and
              implements pagination to handle potentially large numbers of log groups.
+             With --regions and --accounts the log groups of multiple regions and accounts
+             are counted concurrently (cw_fanout.py).
 Author: Danny Steenman
 License: MIT
 """
 
-import boto3
+import argparse
 
+from cw_fanout import FanOut, add_fanout_arguments, format_target, print_failed_targets
+from cw_logs_api import iter_log_groups
 
-def count_log_groups():
+
+def count_log_groups(client):
     """
-    Counts the total number of CloudWatch log groups in the AWS account.
+    Counts the total number of CloudWatch log groups in an account and region.
+
+    Args:
+        client: The CloudWatch Logs client of the account and region.
 
     Returns:
         int: The total number of CloudWatch log groups.
     """
-    # Create a CloudWatch Logs client
-    client = boto3.client("logs")
-
-    # Initialize log group count
-    log_group_count = 0
-
-    # Use paginator to handle potential large number of log groups
-    paginator = client.get_paginator("describe_log_groups")
-    for page in paginator.paginate():
-        log_group_count += len(page["logGroups"])
-
-    return log_group_count
+    # Paginate through the rate limiter to handle potential large number of log groups
+    return sum(1 for _ in iter_log_groups(client))
 
 
 def main():
     """
     Main function to execute the log group counting process.
     """
-    log_group_count = count_log_groups()
-    print(f"Total number of CloudWatch log groups: {log_group_count}")
+    parser = argparse.ArgumentParser(description="Count the CloudWatch log groups.")
+    add_fanout_arguments(parser)
+    args = parser.parse_args()
+
+    fanout = FanOut.from_args(args)
+    results = fanout.run(count_log_groups)
+
+    if not fanout.is_single_target():
+        for target, log_group_count, error in results:
+            if not error:
+                print(f"{format_target(target)}: {log_group_count}")
+
+    total = sum(log_group_count for _, log_group_count, error in results if not error)
+    print(f"Total number of CloudWatch log groups: {total}")
+    print_failed_targets(results)
 
 
 if __name__ == "__main__":
@@ -5,13 +5,48 @@
 # This script deletes CloudWatch log groups based on their age. It can optionally keep log groups
 # newer than a specified time period (e.g., days, weeks, or months). The script supports a dry run
 # mode to preview deletions without making changes. It operates on all log groups in the AWS region
-# configured in your CLI.
+# configured in your CLI, or across multiple regions and accounts with --regions and --accounts (cw_fanout.py).
+# Log groups are processed as they're listed, optionally filtered by the service with --prefix or --pattern
+# and --log-group-class.
+#
+# By default the age of a log group is the time since its latest log event, looked up with a
+# describe_log_streams call per group (ordered by LastEventTime, limit 1), so old log groups that are still
+# in use are kept and young log groups that stopped receiving events are not. Groups without any events fall
+# back to their creation time. The lookups run concurrently through a rate limiter and are cached on disk
+# (~/.cache/aws-toolbox) for --cache-ttl seconds, so repeated dry runs don't make them again. A real run
+# still looks up every group it is about to delete, it never deletes based on a cached time. Use
+# --age-basis creation to use the creation time of every log group instead.
+#
+# Log groups are deleted concurrently through an adaptive rate limiter, throttled deletes are retried with
+# jitter and other errors are tallied per error code instead of aborting the run. With --checkpoint FILE an
+# aborted run resumes where it stopped, as long as it's resumed within a day with the same --keep, --age-basis
+# and filters.
 
 import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 
-import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from cw_fanout import FanOut, add_fanout_arguments, format_target, print_failed_targets
+from cw_logs_api import (
+    RateLimiter,
+    add_log_group_filter_arguments,
+    call_with_retries,
+    iter_log_groups,
+    log_group_filters,
+)
+
+DEFAULT_CACHE_TTL = 86400  # Seconds
+DEFAULT_LOOKUP_WORKERS = 8
+DEFAULT_DELETE_WORKERS = 4
+CHECKPOINT_MAX_AGE = 86400  # Seconds
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "aws-toolbox", "cw-log-group-last-events.json")
 
 
 def parse_time_period(value):
@@ -27,21 +62,209 @@ def parse_time_period(value):
         )
 
 
-def get_cloudwatch_log_groups(client):
-    log_groups = []
-    paginator = client.get_paginator("describe_log_groups")
-    for page in paginator.paginate():
-        log_groups.extend(page["logGroups"])
-    return log_groups
+class LastEventLookup:
+    """
+    Looks up the latest event time of log groups concurrently, with an on-disk cache shared by all
+    accounts and regions.
+    """
+
+    def __init__(self, cache_ttl=DEFAULT_CACHE_TTL, max_workers=DEFAULT_LOOKUP_WORKERS, cache_path=CACHE_PATH):
+        self.cache_ttl = cache_ttl
+        self.max_workers = max_workers
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.stats = {"cached": 0, "looked_up": 0, "lookup_failed": 0}
+        try:
+            with open(cache_path) as cache_file:
+                self.cache = json.load(cache_file)
+        except (OSError, ValueError):
+            self.cache = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.tmp"
+            with self.lock, open(tmp_path, "w") as cache_file:
+                json.dump(self.cache, cache_file)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Failed to write the last event cache {self.cache_path}: {e}")
+
+    def _cache_key(self, client, group):
+        return group.get("arn") or f"{client.meta.region_name}:{group['logGroupName']}"
+
+    def _cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry and time.time() - entry["fetched_at"] <= self.cache_ttl:
+            return entry
+        return None
+
+    def _look_up(self, client, limiter, group):
+        """Return the timestamp in milliseconds of the latest event of a group, or None when it has no events."""
+        try:
+            response = call_with_retries(
+                limiter,
+                client.describe_log_streams,
+                logGroupName=group["logGroupName"],
+                orderBy="LastEventTime",
+                descending=True,
+                limit=1,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ResourceNotFoundException":
+                return None
+            raise
+        streams = response.get("logStreams", [])
+        return streams[0].get("lastEventTimestamp") if streams else None
+
+    def iter_last_events(self, client, groups, verify=None):
+        """
+        Yield (group, last_event_ms) for every group, in completion order. last_event_ms is None without events.
+        Groups whose lookup fails are counted in the stats and skipped, an unknown time never makes a group idle.
+
+        A cached entry is only used when verify(group, last_event_ms) is false, e.g. for groups that will be
+        kept anyway. Groups that would be deleted based on a cached time are looked up again, since they may
+        have received new events since.
+        """
+        limiter = RateLimiter.for_operation("describe_log_streams")
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                group, key = pending.pop(future)
+                try:
+                    last_event = future.result()
+                except (ClientError, BotoCoreError) as e:
+                    # e.g. AccessDenied on one group, the rest of the account and region carries on
+                    print(f"Failed to look up the latest event of log group {group['logGroupName']}, keeping it: {e}")
+                    with self.lock:
+                        self.stats["lookup_failed"] += 1
+                    continue
+                with self.lock:
+                    self.cache[key] = {"last_event": last_event, "fetched_at": time.time()}
+                    self.stats["looked_up"] += 1
+                yield group, last_event
 
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for group in groups:
+                key = self._cache_key(client, group)
+                entry = self._cached(key)
+                if entry and not (verify and verify(group, entry["last_event"])):
+                    with self.lock:
+                        self.stats["cached"] += 1
+                    yield group, entry["last_event"]
+                    continue
 
-def process_log_groups(client, retention_period=None, dry_run=False):
-    log_groups = get_cloudwatch_log_groups(client)
+                pending[executor.submit(self._look_up, client, limiter, group)] = (group, key)
+                if len(pending) >= self.max_workers * 2:
+                    yield from collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            yield from collect(wait(pending).done)
+
+
+class Checkpoint:
+    """
+    Append-only record of the log groups that were kept, deleted or failed, per account and region.
+
+    An aborted run resumes from it: groups that were kept before are skipped without looking them up again
+    and the groups deleted before are included in the summary. The first line holds the settings the
+    decisions were made with and the start time, a checkpoint is only resumed with the same settings and
+    within CHECKPOINT_MAX_AGE. The file is removed after a complete run.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = defaultdict(dict)
+        # Compare the settings the way they are stored, e.g. tuples become lists
+        settings = json.loads(json.dumps(settings))
+        header = None
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line that was cut off when the run was aborted
+                    if "header" in entry:
+                        header = entry["header"]
+                    else:
+                        self.entries[entry["target"]][entry["name"]] = entry["status"]
+
+        if header is None and self.entries:
+            raise SystemExit(f"Checkpoint {path} has no header, remove it to start over")
+        if header is not None:
+            if header["settings"] != settings:
+                raise SystemExit(
+                    f"Checkpoint {path} was written with {header['settings']}, not {settings}. "
+                    "Run with the same settings to resume, or remove it to start over"
+                )
+            if time.time() - header["started_at"] > CHECKPOINT_MAX_AGE:
+                raise SystemExit(
+                    f"Checkpoint {path} is older than {CHECKPOINT_MAX_AGE // 3600} hours and the log groups it "
+                    "kept may have aged since, remove it to start over"
+                )
+
+        self.file = open(path, "a")
+        if header is None:
+            self.file.write(json.dumps({"header": {"settings": settings, "started_at": time.time()}}) + "\n")
+            self.file.flush()
+
+    def resumed(self, target_key, status):
+        return {name for name, entry_status in self.entries[target_key].items() if entry_status == status}
+
+    def record(self, target_key, name, status):
+        with self.lock:
+            self.file.write(json.dumps({"target": target_key, "name": name, "status": status}) + "\n")
+            self.file.flush()
+
+    def close(self, remove=False):
+        self.file.close()
+        if remove:
+            os.remove(self.path)
+
+
+def delete_log_group(client, limiter, name):
+    """Delete a log group, retrying throttling with jitter. Returns None on success or the error code."""
+    try:
+        call_with_retries(limiter, client.delete_log_group, logGroupName=name)
+        return None
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        # Deleted in the meantime, e.g. by a previous run that was aborted before recording it
+        return None if code == "ResourceNotFoundException" else code
+    except BotoCoreError as e:
+        return type(e).__name__
+
+
+def process_log_groups(
+    client,
+    retention_period=None,
+    dry_run=False,
+    label="",
+    filters=None,
+    last_events=None,
+    checkpoint=None,
+    delete_workers=DEFAULT_DELETE_WORKERS,
+    target_key=None,
+):
+    """
+    Delete the log groups of one account and region, label prefixes the output. Returns a summary dict.
+
+    The log groups are processed while they're listed, so deleting starts with the first page. With a
+    LastEventLookup the age is the time since the latest event, otherwise the time since creation. A
+    checkpoint records the groups under target_key, the account ID and region.
+    Deletes run concurrently through the rate limiter, errors are tallied per error code instead of
+    aborting the run.
+    """
     now = datetime.now()
-    total_groups = len(log_groups)
-    kept_groups = []
-    to_delete_groups = []
-    failed_deletions = []
+    total_groups = 0
+    kept_groups = 0
+    to_delete_groups = 0
+    deleted_groups = 0
+    error_codes = defaultdict(int)
+    limiter = RateLimiter.for_operation("delete_log_group")
+    checkpoint = None if dry_run else checkpoint
 
     if retention_period:
         num, unit = retention_period
@@ -52,47 +275,86 @@ def process_log_groups(client, retention_period=None, dry_run=False):
         else:  # months
             threshold = timedelta(days=num * 30)  # Approximate
 
-    for group in log_groups:
-        last_event = group.get("creationTime", 0) / 1000  # Convert to seconds
-        last_event_date = datetime.fromtimestamp(last_event)
-        age = now - last_event_date
+    groups = iter_log_groups(client, **(filters or {}))
+    if checkpoint:
+        resumed_kept = checkpoint.resumed(target_key, "kept")
+        deleted_groups = len(checkpoint.resumed(target_key, "deleted"))
+        if resumed_kept or deleted_groups:
+            print(f"{label}Resuming: {len(resumed_kept)} log groups kept and {deleted_groups} deleted before")
+        kept_groups = total_groups = len(resumed_kept)
+        to_delete_groups = deleted_groups
+        total_groups += deleted_groups
+        groups = (group for group in groups if group["logGroupName"] not in resumed_kept)
+
+    def age_of(group, last_event_millis):
+        # Groups without any events fall back to their creation time
+        last_event = (last_event_millis or group.get("creationTime", 0)) / 1000  # Convert to seconds
+        return now - datetime.fromtimestamp(last_event)
+
+    if retention_period and last_events:
+        # A real run never deletes based on a cached event time, only dry runs and kept groups use the cache
+        verify = None if dry_run else (lambda group, last_event_millis: age_of(group, last_event_millis) > threshold)
+        groups = last_events.iter_last_events(client, groups, verify)
+    else:
+        # Without a retention period every group is deleted, so there's no need to look up the events
+        groups = ((group, None) for group in groups)
+
+    pending = {}
 
-        if retention_period and age <= threshold:
-            kept_groups.append((group["logGroupName"], age))
-        else:
-            to_delete_groups.append((group["logGroupName"], age))
+    def collect(done):
+        nonlocal deleted_groups
+        for future in done:
+            name = pending.pop(future)
+            code = future.result()
+            if code:
+                print(f"{label}Failed to delete log group {name}: {code}")
+                error_codes[code] += 1
+            else:
+                deleted_groups += 1
+            if checkpoint:
+                checkpoint.record(target_key, name, "failed" if code else "deleted")
 
-    # Print kept groups
-    print("Log groups to keep:")
-    for name, age in kept_groups:
-        print(f"{'[DRY RUN] ' if dry_run else ''}Keeping log group: {name} (Age: {age})")
+    with ThreadPoolExecutor(max_workers=delete_workers) as executor:
+        for group, last_event_millis in groups:
+            name = group["logGroupName"]
+            age = age_of(group, last_event_millis)
+            total_groups += 1
 
-    # Print groups to delete
-    print("\nLog groups to delete:")
-    for name, age in to_delete_groups:
-        print(f"{'[DRY RUN] Would delete' if dry_run else 'Deleting'} log group: {name} (Age: {age})")
+            if retention_period and age <= threshold:
+                kept_groups += 1
+                print(f"{label}{'[DRY RUN] ' if dry_run else ''}Keeping log group: {name} (Age: {age})")
+                if checkpoint:
+                    checkpoint.record(target_key, name, "kept")
+                continue
 
-    print("\nSummary:")
-    print(f"Total log groups: {total_groups}")
-    print(f"Log groups kept: {len(kept_groups)}")
-    print(f"Log groups to be deleted: {len(to_delete_groups)}")
+            to_delete_groups += 1
+            print(f"{label}{'[DRY RUN] Would delete' if dry_run else 'Deleting'} log group: {name} (Age: {age})")
+            if dry_run:
+                continue
+
+            pending[executor.submit(delete_log_group, client, limiter, name)] = name
+            if len(pending) >= delete_workers * 2:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        collect(wait(pending).done)
+
+    print(f"\n{label}Summary:")
+    print(f"{label}Total log groups: {total_groups}")
+    print(f"{label}Log groups kept: {kept_groups}")
+    print(f"{label}Log groups to be deleted: {to_delete_groups}")
 
     if not dry_run:
-        for name, _ in to_delete_groups:
-            try:
-                client.delete_log_group(logGroupName=name)
-            except ClientError as e:
-                if e.response["Error"]["Code"] == "AccessDeniedException":
-                    print(f"Access denied when trying to delete log group: {name}")
-                    failed_deletions.append(name)
-                else:
-                    raise  # Re-raise the exception if it's not an AccessDeniedException
-
-        print(f"Log groups actually deleted: {len(to_delete_groups) - len(failed_deletions)}")
-        if failed_deletions:
-            print(f"Failed to delete {len(failed_deletions)} log groups due to access denial:")
-            for name in failed_deletions:
-                print(f"  - {name}")
+        print(f"{label}Log groups actually deleted: {deleted_groups}")
+        print(f"{label}Deletes: {limiter.summary()}")
+        for code, count in sorted(error_codes.items()):
+            print(f"{label}Failed to delete {count} log groups: {code}")
+
+    return {
+        "total": total_groups,
+        "kept": kept_groups,
+        "deleted": 0 if dry_run else deleted_groups,
+        "to_delete": to_delete_groups,
+        "errors": dict(error_codes),
+    }
 
 
 def main():
@@ -103,10 +365,97 @@ def main():
         help="Keep log groups newer than this period (e.g., '5 days', '2 weeks', '1 months')",
     )
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without actually deleting log groups")
+    parser.add_argument(
+        "--age-basis",
+        choices=["last-event", "creation"],
+        default="last-event",
+        help="Measure the age from the latest log event or from the creation of the log group (default: last-event)",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=DEFAULT_CACHE_TTL,
+        help=f"Seconds to reuse cached latest event times, 0 disables the cache (default: {DEFAULT_CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--lookup-workers",
+        type=int,
+        default=DEFAULT_LOOKUP_WORKERS,
+        help=f"Concurrent latest event lookups per account and region (default: {DEFAULT_LOOKUP_WORKERS})",
+    )
+    parser.add_argument(
+        "--delete-workers",
+        type=int,
+        default=DEFAULT_DELETE_WORKERS,
+        help=f"Concurrent deletes per account and region (default: {DEFAULT_DELETE_WORKERS})",
+    )
+    parser.add_argument("--checkpoint", help="Checkpoint file to resume an aborted run from")
+    add_log_group_filter_arguments(parser)
+    add_fanout_arguments(parser)
     args = parser.parse_args()
 
-    client = boto3.client("logs")
-    process_log_groups(client, args.keep, args.dry_run)
+    fanout = FanOut.from_args(args)
+    filters = log_group_filters(args)
+    last_events = LastEventLookup(args.cache_ttl, args.lookup_workers) if args.age_basis == "last-event" else None
+    checkpoint = None
+    current_account = None
+    if args.checkpoint and not args.dry_run:
+        checkpoint = Checkpoint(args.checkpoint, {"keep": args.keep, "age_basis": args.age_basis, "filters": filters})
+        # Key the checkpoint by account, so resuming with other credentials doesn't reuse this account's groups
+        current_account = fanout.base_session.client("sts").get_caller_identity()["Account"]
+    try:
+        single_target = fanout.is_single_target()
+        results = fanout.run_targets(
+            process_log_groups,
+            {
+                target: (
+                    args.keep,
+                    args.dry_run,
+                    "" if single_target else f"[{format_target(target)}] ",
+                    filters,
+                    last_events,
+                    checkpoint,
+                    args.delete_workers,
+                    f"{target.account_id or current_account}/{target.region}",
+                )
+                for target in fanout.targets()
+            },
+        )
+
+        if not single_target:
+            summaries = [summary for _, summary, error in results if not error]
+            print(f"\nSummary of {len(summaries)} account(s) and region(s):")
+            print(f"Total log groups: {sum(summary['total'] for summary in summaries)}")
+            print(f"Log groups kept: {sum(summary['kept'] for summary in summaries)}")
+            print(f"Log groups to be deleted: {sum(summary['to_delete'] for summary in summaries)}")
+            if not args.dry_run:
+                print(f"Log groups actually deleted: {sum(summary['deleted'] for summary in summaries)}")
+                error_codes = defaultdict(int)
+                for summary in summaries:
+                    for code, count in summary["errors"].items():
+                        error_codes[code] += count
+                for code, count in sorted(error_codes.items()):
+                    print(f"Failed to delete {count} log groups: {code}")
+        print_failed_targets(results)
+
+        if checkpoint:
+            # Keep the checkpoint when a target failed, so the next run can resume
+            complete = not any(error for _, _, error in results)
+            checkpoint.close(remove=complete)
+            if not complete:
+                print(f"\nRun again with --checkpoint {args.checkpoint} to resume")
+
+        if last_events and args.keep:
+            print(
+                f"\nLatest event times: {last_events.stats['looked_up']} looked up, {last_events.stats['cached']} from cache"
+            )
+        if last_events and last_events.stats["lookup_failed"]:
+            print(f"Kept {last_events.stats['lookup_failed']} log groups whose latest event time couldn't be looked up")
+
+    finally:
+        # Also keep the lookups of an aborted run
+        if last_events and args.keep:
+            last_events.save()
 
 
 if __name__ == "__main__":
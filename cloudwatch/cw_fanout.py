@@ -0,0 +1,212 @@
+"""
+Description: Shared multi-account, multi-region fan-out for the CloudWatch Logs scripts in this folder. Instead
+of one serial run per account and region, an operation is run for every (account, region) target concurrently.
+Roles are assumed once per account (with credentials that refresh themselves for long runs) and one Logs
+client is built per target. A failing target is reported without affecting the others.
+
+Key features:
+- Targets: the current account or a list of accounts (or every active account in the organization) times
+  the current region, a list of regions or all regions where CloudWatch Logs is available and that are enabled
+  for the current account
+- Assumes a role in every account on first use, sessions and clients are created once and reused
+- Runs the targets concurrently with per-target error isolation
+- Command line arguments shared by all scripts
+
+Usage (from another script in this folder):
+    from cw_fanout import FanOut, add_fanout_arguments
+
+    add_fanout_arguments(parser)
+    args = parser.parse_args()
+    for target, result, error in FanOut.from_args(args).run(count_log_groups):
+        print(target, result or error)
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+import botocore.session
+from botocore.credentials import CredentialProvider, CredentialResolver, DeferredRefreshableCredentials
+from botocore.exceptions import BotoCoreError, ClientError
+
+from cw_logs_api import get_logs_client
+
+DEFAULT_ROLE_NAME = "OrganizationAccountAccessRole"
+DEFAULT_TARGET_WORKERS = 16
+CLIENT_WORKERS = 10  # Connection pool size of each target client
+
+Target = namedtuple("Target", ["account_id", "region"])
+
+
+def format_target(target):
+    return f"{target.account_id or 'current account'}/{target.region}"
+
+
+class AssumeRoleCredentialProvider(CredentialProvider):
+    """Credential provider for a botocore session that assumes a role when the credentials are first used."""
+
+    METHOD = "sts-assume-role"
+    CANONICAL_NAME = "custom-aws-toolbox-assume-role"
+
+    def __init__(self, refresh):
+        super().__init__()
+        self.refresh = refresh
+
+    def load(self):
+        # Refreshable credentials, so runs that take longer than the role session duration keep working
+        return DeferredRefreshableCredentials(refresh_using=self.refresh, method=self.METHOD)
+
+
+class FanOut:
+    """Runs an operation for every (account, region) target concurrently."""
+
+    def __init__(self, regions=None, accounts=None, role_name=DEFAULT_ROLE_NAME, max_workers=DEFAULT_TARGET_WORKERS):
+        self.base_session = boto3.Session()
+        self.role_name = role_name
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.clients = {}
+        self.regions = self._resolve_regions(regions)
+        self.accounts = self._resolve_accounts(accounts)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.regions, args.accounts, args.role_name, args.target_workers)
+
+    def _resolve_regions(self, regions):
+        if not regions:
+            return [self.base_session.region_name]
+        if regions == ["all"]:
+            # Like ec2_region_runner.py, leave out the opt-in regions the account never opted into
+            all_regions = self.base_session.client("ec2").describe_regions(AllRegions=True)["Regions"]
+            enabled = {region["RegionName"] for region in all_regions if region.get("OptInStatus") != "not-opted-in"}
+            return [region for region in self.base_session.get_available_regions("logs") if region in enabled]
+        return regions
+
+    def _resolve_accounts(self, accounts):
+        if not accounts:
+            # The current credentials, no role is assumed
+            return [None]
+        if accounts == ["organization"]:
+            paginator = self.base_session.client("organizations").get_paginator("list_accounts")
+            return [
+                account["Id"]
+                for page in paginator.paginate()
+                for account in page["Accounts"]
+                if account["Status"] == "ACTIVE"
+            ]
+        return accounts
+
+    def targets(self):
+        return [Target(account_id, region) for account_id in self.accounts for region in self.regions]
+
+    def _assume_role_session(self, account_id):
+        role_arn = f"arn:aws:iam::{account_id}:role/{self.role_name}"
+        sts = self.base_session.client("sts")
+
+        def refresh():
+            credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName="aws-toolbox")["Credentials"]
+            return {
+                "access_key": credentials["AccessKeyId"],
+                "secret_key": credentials["SecretAccessKey"],
+                "token": credentials["SessionToken"],
+                "expiry_time": credentials["Expiration"].isoformat(),
+            }
+
+        # The role is only assumed when the first call needs the credentials, outside of the session lock
+        botocore_session = botocore.session.get_session()
+        botocore_session.register_component(
+            "credential_provider", CredentialResolver([AssumeRoleCredentialProvider(refresh)])
+        )
+        return boto3.Session(botocore_session=botocore_session)
+
+    def session_for(self, account_id):
+        if account_id is None:
+            return self.base_session
+        with self.lock:
+            # Creating sessions and clients isn't thread-safe, the AssumeRole call happens later without the lock
+            if account_id not in self.sessions:
+                self.sessions[account_id] = self._assume_role_session(account_id)
+            return self.sessions[account_id]
+
+    def client_for(self, target):
+        """Return the Logs client of a target, created on first use."""
+        session = self.session_for(target.account_id)
+        with self.lock:
+            if target not in self.clients:
+                self.clients[target] = get_logs_client(session, target.region, CLIENT_WORKERS)
+            return self.clients[target]
+
+    def _run_target(self, operation, target, args, kwargs):
+        try:
+            return operation(self.client_for(target), *args, **kwargs), None
+        except (ClientError, BotoCoreError) as e:
+            return None, str(e)
+        except Exception as e:
+            # Any other error only fails this target
+            return None, f"{type(e).__name__}: {e}"
+
+    def run(self, operation, *args, **kwargs):
+        """
+        Call operation(client, *args, **kwargs) for every target and return a list of (target, result, error)
+        sorted by target. Either result or error is None.
+        """
+        return self.run_targets(operation, {target: args for target in self.targets()}, **kwargs)
+
+    def run_targets(self, operation, target_args, **kwargs):
+        """Like run, but only for the targets in target_args, a dict of target to its positional arguments."""
+        if len(target_args) == 1:
+            # Nothing to fan out, keep the output of interactive operations in order
+            target, args = next(iter(target_args.items()))
+            return [(target, *self._run_target(operation, target, args, kwargs))]
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_target = {
+                executor.submit(self._run_target, operation, target, args, kwargs): target
+                for target, args in target_args.items()
+            }
+            for future in as_completed(future_to_target):
+                results.append((future_to_target[future], *future.result()))
+        return sorted(results, key=lambda result: (result[0].account_id or "", result[0].region))
+
+    def is_single_target(self):
+        return len(self.accounts) * len(self.regions) == 1
+
+
+def add_fanout_arguments(parser):
+    parser.add_argument(
+        "--regions",
+        nargs="+",
+        help="Regions to run in, or 'all' for every enabled region (default: the configured region)",
+    )
+    parser.add_argument(
+        "--accounts",
+        nargs="+",
+        help="Account IDs to run in by assuming --role-name, or 'organization' for every active account in the "
+        "organization (default: the current account)",
+    )
+    parser.add_argument(
+        "--role-name",
+        default=DEFAULT_ROLE_NAME,
+        help=f"Role to assume in every account (default: {DEFAULT_ROLE_NAME})",
+    )
+    parser.add_argument(
+        "--target-workers",
+        type=int,
+        default=DEFAULT_TARGET_WORKERS,
+        help=f"Number of accounts and regions processed in parallel (default: {DEFAULT_TARGET_WORKERS})",
+    )
+
+
+def print_failed_targets(results):
+    failed = [(target, error) for target, _, error in results if error]
+    if failed:
+        print(f"\nFailed for {len(failed)} target(s):")
+        for target, error in failed:
+            print(f"  {format_target(target)}: {error}")
@@ -3,44 +3,48 @@ Description: This script fetches all CloudWatch log groups in an AWS account,
              calculates their age, and displays the information in a tabulated format.
              It uses the AWS SDK for Python (Boto3) to interact with CloudWatch Logs
              and implements pagination to handle potentially large numbers of log groups.
+             With --regions and --accounts the log groups of multiple regions and accounts
+             are fetched concurrently (cw_fanout.py).
 Author: Danny Steenman
 License: MIT
 """
 
+import argparse
 from datetime import datetime
 
-import boto3
 from tabulate import tabulate
 
+from cw_fanout import FanOut, add_fanout_arguments, format_target, print_failed_targets
+from cw_logs_api import iter_log_groups
 
-def fetch_log_groups_with_creation_dates():
+
+def fetch_log_groups_with_creation_dates(client, now=None):
     """
     Fetches all CloudWatch log groups and their creation dates.
 
+    Args:
+        client: The CloudWatch Logs client of the account and region.
+        now: The time the ages are calculated from, the same for every target of a run.
+
     Returns:
         list: A list of tuples containing log group name, creation date, and age in days.
     """
-    # Create a CloudWatch Logs client
-    client = boto3.client("logs")
-
     # List to store log group names, creation dates, and age
     log_groups_info = []
+    now = now or datetime.now()
 
-    # Use paginator to handle potential large number of log groups
-    paginator = client.get_paginator("describe_log_groups")
-    for page in paginator.paginate():
-        for log_group in page["logGroups"]:
-            # Extract log group name and creation time
-            log_group_name = log_group["logGroupName"]
-            creation_time_millis = log_group.get("creationTime", 0)
-            creation_date = datetime.fromtimestamp(creation_time_millis / 1000)
+    # Paginate through the rate limiter to handle potential large number of log groups
+    for log_group in iter_log_groups(client):
+        # Extract log group name and creation time
+        log_group_name = log_group["logGroupName"]
+        creation_time_millis = log_group.get("creationTime", 0)
+        creation_date = datetime.fromtimestamp(creation_time_millis / 1000)
 
-            # Calculate the age of the log group
-            age_delta = datetime.now() - creation_date
-            age_human_readable = f"{age_delta.days} days" if age_delta.days > 0 else "less than a day"
+        # Calculate the age of the log group
+        age_delta = now - creation_date
 
-            # Append the extracted information to the list
-            log_groups_info.append((log_group_name, creation_date, age_delta.days))
+        # Append the extracted information to the list
+        log_groups_info.append((log_group_name, creation_date, age_delta.days))
 
     # Sort by age in descending order (most days to least days)
     log_groups_info.sort(key=lambda x: x[2], reverse=True)
@@ -52,17 +56,38 @@ def main():
     """
     Main function to execute the log group fetching process and display results.
     """
-    log_groups_info = fetch_log_groups_with_creation_dates()
+    parser = argparse.ArgumentParser(description="Fetch the CloudWatch log groups with their creation dates.")
+    add_fanout_arguments(parser)
+    args = parser.parse_args()
+
+    fanout = FanOut.from_args(args)
+    results = fanout.run(fetch_log_groups_with_creation_dates, datetime.now())
+
+    # Merge the log groups of all targets, sorted by age in descending order
+    log_groups_info = sorted(
+        (
+            (target, log_group_name, creation_date, age_days)
+            for target, target_info, error in results
+            if not error
+            for log_group_name, creation_date, age_days in target_info
+        ),
+        key=lambda x: x[3],
+        reverse=True,
+    )
 
     # Prepare data for tabulate
+    headers = ["Log Group", "Created On", "Age"]
     table_data = [
         (log_group_name, creation_date, f"{age_days} days" if age_days > 0 else "less than a day")
-        for log_group_name, creation_date, age_days in log_groups_info
+        for _, log_group_name, creation_date, age_days in log_groups_info
     ]
+    if not fanout.is_single_target():
+        headers.insert(0, "Target")
+        table_data = [(format_target(info[0]), *row) for info, row in zip(log_groups_info, table_data)]
 
     # Print table
-    headers = ["Log Group", "Created On", "Age"]
     print(tabulate(table_data, headers=headers, tablefmt="pretty"))
+    print_failed_targets(results)
 
 
 if __name__ == "__main__":
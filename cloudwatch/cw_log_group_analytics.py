@@ -0,0 +1,306 @@
+"""
+Description: This script reports where CloudWatch Logs storage (and storage cost) goes. It collects the stored
+             bytes, retention, log group class, age, metric filter count and optionally the subscription filter
+             count of every log group into a compact columnar table, aggregates it by name prefix, retention and
+             age bucket, ranks the top cost contributors and can export the table to CSV, JSON or Parquet.
+             Everything except the optional subscription filters comes from the describe_log_groups listing
+             itself, so even 200k log groups only take one paginated listing (cw_logs_api.py). Use --regions and
+             --accounts to analyze multiple regions and accounts at once (cw_fanout.py).
+
+Usage: python cw_log_group_analytics.py [--prefix-depth N] [--top N] [--age-buckets 7,30,90,180,365]
+                                        [--storage-price USD_PER_GB_MONTH] [--subscription-filters]
+                                        [--export FILE.csv|FILE.json|FILE.parquet]
+                                        [--prefix PREFIX | --pattern PATTERN] [--log-group-class CLASS]
+                                        [--regions REGION ... | all] [--accounts ACCOUNT_ID ... | organization]
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import time
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+from tabulate import tabulate
+
+from cw_fanout import FanOut, add_fanout_arguments, format_target, print_failed_targets
+from cw_logs_api import (
+    LOG_GROUP_CLASSES,
+    RateLimiter,
+    add_log_group_filter_arguments,
+    call_with_retries,
+    iter_log_groups,
+    log_group_filters,
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_STORAGE_PRICE = 0.03  # USD per GB-month of archived log data (us-east-1, standard class)
+DEFAULT_TOP = 20
+SUBSCRIPTION_FILTER_WORKERS = 4
+SECONDS_PER_DAY = 86400
+GB = 1024**3
+
+
+def count_subscription_filters(client, limiter, name):
+    try:
+        response = call_with_retries(limiter, client.describe_subscription_filters, logGroupName=name)
+        return len(response.get("subscriptionFilters", []))
+    except ClientError:
+        return -1
+
+
+def collect_log_groups(client, filters=None, subscription_filters=False):
+    """
+    Return one (name, stored_bytes, retention_days, class, creation_ms, metric_filters, subscription_filters)
+    tuple per log group of an account and region. Retention 0 means never expire, -1 an unknown count.
+    """
+    rows = []
+    for group in iter_log_groups(client, **(filters or {})):
+        rows.append(
+            (
+                group["logGroupName"],
+                group.get("storedBytes", 0),
+                group.get("retentionInDays", 0),
+                group.get("logGroupClass", "STANDARD"),
+                group.get("creationTime", 0),
+                group.get("metricFilterCount", 0),
+                -1,
+            )
+        )
+
+    if subscription_filters:
+        # One describe_subscription_filters call per group, through the rate limiter
+        limiter = RateLimiter.for_operation("describe_subscription_filters")
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                index = pending.pop(future)
+                rows[index] = rows[index][:6] + (future.result(),)
+
+        with ThreadPoolExecutor(max_workers=SUBSCRIPTION_FILTER_WORKERS) as executor:
+            for index, row in enumerate(rows):
+                pending[executor.submit(count_subscription_filters, client, limiter, row[0])] = index
+                if len(pending) >= SUBSCRIPTION_FILTER_WORKERS * 2:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            collect(wait(pending).done)
+
+    return rows
+
+
+def prefix_of(name, depth):
+    """Return the first depth path components of a log group name, e.g. '/aws/lambda/' for depth 2."""
+    leading = "/" if name.startswith("/") else ""
+    parts = name[len(leading) :].split("/")
+    if len(parts) <= depth:
+        return name
+    return leading + "/".join(parts[:depth]) + "/"
+
+
+class LogGroupTable:
+    """Columnar table of log groups: one compact array per field instead of a dict per log group."""
+
+    def __init__(self, now=None):
+        self.now = now or time.time()
+        self.targets = []
+        # Classes AWS adds later are appended when they're first seen
+        self.classes = list(LOG_GROUP_CLASSES)
+        self.names = []
+        self.target_ids = array("l")
+        self.stored_bytes = array("q")
+        self.retention_days = array("l")
+        self.class_ids = array("b")
+        self.creation_ms = array("q")
+        self.metric_filters = array("l")
+        self.subscription_filters = array("l")
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_target(self, target, rows):
+        target_id = len(self.targets)
+        self.targets.append(format_target(target))
+        for name, stored_bytes, retention, log_group_class, creation, metric_filters, subscription_filters in rows:
+            self.names.append(name)
+            self.target_ids.append(target_id)
+            self.stored_bytes.append(stored_bytes)
+            self.retention_days.append(retention)
+            if log_group_class not in self.classes:
+                self.classes.append(log_group_class)
+            self.class_ids.append(self.classes.index(log_group_class))
+            self.creation_ms.append(creation)
+            self.metric_filters.append(metric_filters)
+            self.subscription_filters.append(subscription_filters)
+
+    def age_days(self, index):
+        return int((self.now - self.creation_ms[index] / 1000) / SECONDS_PER_DAY)
+
+    def aggregate(self, key_func):
+        """Return a dict of key to [log group count, stored bytes]."""
+        totals = defaultdict(lambda: [0, 0])
+        for index in range(len(self)):
+            cell = totals[key_func(index)]
+            cell[0] += 1
+            cell[1] += self.stored_bytes[index]
+        return totals
+
+    def top(self, count):
+        """Return the indexes of the count log groups with the most stored bytes."""
+        return heapq.nlargest(count, range(len(self)), key=self.stored_bytes.__getitem__)
+
+    def columns(self, storage_price):
+        """Return the table as a dict of column name to list, for exporting."""
+        return {
+            "target": [self.targets[target_id] for target_id in self.target_ids],
+            "log_group": self.names,
+            "stored_bytes": self.stored_bytes.tolist(),
+            "monthly_storage_cost": [stored_bytes / GB * storage_price for stored_bytes in self.stored_bytes],
+            "retention_days": [retention or None for retention in self.retention_days],
+            "log_group_class": [self.classes[class_id] for class_id in self.class_ids],
+            "age_days": [self.age_days(index) for index in range(len(self))],
+            "metric_filters": self.metric_filters.tolist(),
+            "subscription_filters": [count if count >= 0 else None for count in self.subscription_filters],
+        }
+
+
+def age_bucket_labels(age_buckets):
+    labels = [f"<{age_buckets[0]}d"]
+    labels += [f"{younger}-{older}d" for younger, older in zip(age_buckets, age_buckets[1:])]
+    labels.append(f">{age_buckets[-1]}d")
+    return labels
+
+
+def print_aggregate(title, totals, storage_price, sort_key=None):
+    rows = sorted(totals.items(), key=sort_key or (lambda item: -item[1][1]))
+    table_data = [
+        (key, count, f"{stored_bytes / GB:.2f}", f"${stored_bytes / GB * storage_price:.2f}")
+        for key, (count, stored_bytes) in rows
+    ]
+    print(f"\n{title}")
+    print(tabulate(table_data, headers=["", "Log groups", "Stored GB", "Monthly cost"], tablefmt="pretty"))
+
+
+def print_report(table, prefix_depth, age_buckets, top, storage_price):
+    labels = age_bucket_labels(age_buckets)
+    by_prefix = table.aggregate(lambda index: prefix_of(table.names[index], prefix_depth))
+    by_retention = table.aggregate(lambda index: table.retention_days[index])
+    by_age = table.aggregate(lambda index: bisect_right(age_buckets, table.age_days(index)))
+
+    print_aggregate("Storage by prefix", by_prefix, storage_price)
+    print_aggregate(
+        "Storage by retention",
+        {f"{retention} days" if retention else "Never expire": cell for retention, cell in by_retention.items()},
+        storage_price,
+    )
+    print_aggregate(
+        "Storage by age",
+        {labels[bucket]: cell for bucket, cell in by_age.items()},
+        storage_price,
+        sort_key=lambda item: labels.index(item[0]),
+    )
+
+    table_data = [
+        (
+            table.targets[table.target_ids[index]],
+            table.names[index],
+            f"{table.stored_bytes[index] / GB:.2f}",
+            f"${table.stored_bytes[index] / GB * storage_price:.2f}",
+            table.retention_days[index] or "Never expire",
+            table.classes[table.class_ids[index]],
+            table.age_days(index),
+        )
+        for index in table.top(top)
+    ]
+    print(f"\nTop {len(table_data)} cost contributors")
+    headers = ["Target", "Log group", "Stored GB", "Monthly cost", "Retention", "Class", "Age (days)"]
+    print(tabulate(table_data, headers=headers, tablefmt="pretty"))
+
+    total_bytes = sum(table.stored_bytes)
+    print(
+        f"\nTotal: {len(table)} log groups, {total_bytes / GB:.2f} GB stored, "
+        f"${total_bytes / GB * storage_price:.2f} per month"
+    )
+
+
+def export_table(table, path, storage_price):
+    columns = table.columns(storage_price)
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise SystemExit("Exporting to Parquet requires pyarrow: pip install pyarrow")
+        pyarrow.parquet.write_table(pyarrow.Table.from_pydict(columns), path)
+    elif path.endswith(".json"):
+        with open(path, "w") as export_file:
+            json.dump([dict(zip(columns, row)) for row in zip(*columns.values())], export_file)
+    else:
+        with open(path, "w", newline="") as export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(columns)
+            writer.writerows(zip(*columns.values()))
+    print(f"Exported {len(table)} log groups to {path}")
+
+
+def parse_age_buckets(value):
+    try:
+        return sorted({int(days) for days in value.split(",")})
+    except ValueError:
+        raise argparse.ArgumentTypeError("Age buckets must be a comma separated list of days, e.g. 7,30,90")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze CloudWatch Logs storage and cost per log group.")
+    parser.add_argument("--prefix-depth", type=int, default=2, help="Name components per prefix (default: 2)")
+    parser.add_argument(
+        "--top", type=int, default=DEFAULT_TOP, help=f"Number of top cost contributors (default: {DEFAULT_TOP})"
+    )
+    parser.add_argument(
+        "--age-buckets",
+        type=parse_age_buckets,
+        default=[7, 30, 90, 180, 365],
+        help="Comma separated age bucket boundaries in days (default: 7,30,90,180,365)",
+    )
+    parser.add_argument(
+        "--storage-price",
+        type=float,
+        default=DEFAULT_STORAGE_PRICE,
+        help=f"Storage price in USD per GB-month (default: {DEFAULT_STORAGE_PRICE})",
+    )
+    parser.add_argument(
+        "--subscription-filters",
+        action="store_true",
+        help="Also count the subscription filters, this takes one API call per log group",
+    )
+    parser.add_argument("--export", help="Export the table to a .csv, .json or .parquet file")
+    add_log_group_filter_arguments(parser)
+    add_fanout_arguments(parser)
+    args = parser.parse_args()
+
+    start_time = time.monotonic()
+    fanout = FanOut.from_args(args)
+    results = fanout.run(collect_log_groups, log_group_filters(args), args.subscription_filters)
+
+    table = LogGroupTable()
+    for target, rows, error in results:
+        if not error:
+            table.add_target(target, rows)
+    print(f"Collected {len(table)} log groups in {time.monotonic() - start_time:.1f}s")
+
+    print_report(table, args.prefix_depth, args.age_buckets, args.top, args.storage_price)
+    if args.export:
+        export_table(table, args.export, args.storage_price)
+    print_failed_targets(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Description: Shared CloudWatch Logs API helpers for the scripts in this folder. CloudWatch Logs has low
+per-account, per-region TPS quotas for its control plane APIs (e.g. 5 TPS for PutRetentionPolicy), and
+bursting past them only produces ThrottlingExceptions. Calls go through a token bucket per API that starts at
+the quota, backs off when the service throttles anyway and slowly recovers, with jittered retries.
+
+Key features:
+- Token bucket rate limiter shared by all threads, tuned to the default Logs API quotas
+- Adaptive rate: halves on every throttle, recovers additively on success
+- Retries throttling and transient errors with full jitter exponential backoff
+- Counts calls, throttles and retries, so scripts can report them
+- Streaming log group enumeration with server-side name prefix, name pattern and log group class filters
+
+Usage (from another script in this folder):
+    from cw_logs_api import RateLimiter, call_with_retries, get_logs_client
+
+    client = get_logs_client()
+    limiter = RateLimiter.for_operation("put_retention_policy")
+    call_with_retries(limiter, client.put_retention_policy, logGroupName="my-group", retentionInDays=30)
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import random
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+
+# Default CloudWatch Logs TPS quotas per account and region
+LOGS_API_QUOTAS = {
+    "describe_log_groups": 10,
+    "describe_log_streams": 25,
+    "describe_metric_filters": 10,
+    "describe_subscription_filters": 10,
+    "delete_log_group": 10,
+    "put_retention_policy": 5,
+}
+DEFAULT_QUOTA = 5
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = 0.25  # Seconds
+MAX_BACKOFF = 20
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "RequestLimitExceeded"}
+TRANSIENT_ERROR_CODES = {"ServiceUnavailableException", "InternalFailure", "ServiceUnavailable"}
+LOG_GROUP_CLASSES = ["STANDARD", "INFREQUENT_ACCESS", "DELIVERY"]
+
+
+def get_logs_client(session=None, region_name=None, max_workers=10):
+    """
+    Create a Logs client for use with call_with_retries.
+
+    Retries are handled by call_with_retries, so the client doesn't retry on its own and every throttle is seen
+    (and counted) by the rate limiter.
+    """
+    config = Config(max_pool_connections=max_workers, retries={"total_max_attempts": 1, "mode": "standard"})
+    return (session or boto3).client("logs", region_name=region_name, config=config)
+
+
+class RateLimiter:
+    """Thread-safe token bucket with an adaptive rate between min_rate and max_rate calls per second."""
+
+    def __init__(self, max_rate, min_rate=None):
+        self.max_rate = max_rate
+        self.min_rate = min_rate or max_rate / 20
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "started": time.monotonic()}
+
+    @classmethod
+    def for_operation(cls, operation, max_rate=None):
+        return cls(max_rate or LOGS_API_QUOTAS.get(operation, DEFAULT_QUOTA))
+
+    def acquire(self):
+        """Block until a call may be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Allow a burst of at most one second worth of calls
+                self.tokens = min(max(self.rate, 1), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats["calls"] += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.stats["throttled"] += 1
+
+    def on_retry(self):
+        with self.lock:
+            self.stats["retries"] += 1
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.stats["started"], 1e-6)
+        return (
+            f"{self.stats['calls']} calls in {elapsed:.1f}s ({self.stats['calls'] / elapsed:.1f}/s), "
+            f"{self.stats['throttled']} throttled, {self.stats['retries']} retries"
+        )
+
+
+def call_with_retries(limiter, func, **kwargs):
+    """Call func(**kwargs) through the limiter, retrying throttling and transient errors with jittered backoff."""
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire()
+        try:
+            response = func(**kwargs)
+            limiter.on_success()
+            return response
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in THROTTLING_ERROR_CODES:
+                limiter.on_throttle()
+            elif code not in TRANSIENT_ERROR_CODES:
+                raise
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+        except (ConnectionError, ReadTimeoutError):
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+        limiter.on_retry()
+        time.sleep(random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2**attempt)))
+
+
+def paginate_with_retries(limiter, func, result_key, **kwargs):
+    """Yield the result_key entries of every page of a nextToken paginated call, each page through the limiter."""
+    while True:
+        response = call_with_retries(limiter, func, **kwargs)
+        yield from response.get(result_key, [])
+        if not response.get("nextToken"):
+            return
+        kwargs["nextToken"] = response["nextToken"]
+
+
+def iter_log_groups(client, prefix=None, pattern=None, log_group_class=None, limiter=None):
+    """
+    Yield the log groups of an account and region page by page, as soon as each page is listed.
+
+    The filters are applied by the service: prefix matches the start of the name, pattern matches anywhere
+    in the name (the two can't be combined) and log_group_class limits the results to one class.
+    """
+    if prefix and pattern:
+        raise ValueError("A log group name prefix and pattern can't be combined")
+
+    kwargs = {}
+    if prefix:
+        kwargs["logGroupNamePrefix"] = prefix
+    if pattern:
+        kwargs["logGroupNamePattern"] = pattern
+    if log_group_class:
+        kwargs["logGroupClass"] = log_group_class
+    limiter = limiter or RateLimiter.for_operation("describe_log_groups")
+    yield from paginate_with_retries(limiter, client.describe_log_groups, "logGroups", **kwargs)
+
+
+def add_log_group_filter_arguments(parser):
+    filter_group = parser.add_mutually_exclusive_group()
+    filter_group.add_argument("--prefix", help="Only include log groups whose name starts with this prefix")
+    filter_group.add_argument("--pattern", help="Only include log groups whose name contains this string")
+    parser.add_argument("--log-group-class", choices=LOG_GROUP_CLASSES, help="Only include log groups of this class")
+
+
+def log_group_filters(args):
+    """Return the iter_log_groups keyword arguments for the filter arguments."""
+    return {"prefix": args.prefix, "pattern": args.pattern, "log_group_class": args.log_group_class}
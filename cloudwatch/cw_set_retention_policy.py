@@ -2,62 +2,75 @@
 #
 #  License: MIT
 #
-# This script sets CloudWatch Logs Retention Policy for log groups in the configured AWS region.
+# This script sets CloudWatch Logs Retention Policy for log groups in the configured AWS region, or across
+# multiple regions and accounts with --regions and --accounts (cw_fanout.py).
 # It can set a specific retention period for all log groups or print a summary of current retention periods.
 #
 # Features:
 # - Set retention from 1 day to 10 years
 # - Print retention count summary
 # - Detailed logging and verification of updates
+# - Concurrent updates through a token bucket rate limiter tuned to the CloudWatch Logs API quotas (cw_logs_api.py),
+#   backing off and retrying with jitter when the API throttles
+# - All updates are verified with a single re-listing at the end, with throughput and throttle counts reported
+# - Log groups are listed as a stream with server-side --prefix/--pattern and --log-group-class filters, with --yes
+#   the updates start as soon as the first page of log groups arrives
 #
 # Usage:
-# 1. Set retention: python script_name.py --retention <days>
+# 1. Set retention: python script_name.py --retention <days> [--workers N] [--rate TPS] [--yes]
 # 2. Print retention counts: python script_name.py --print-retention-counts
+# Both accept [--prefix PREFIX | --pattern PATTERN] [--log-group-class CLASS] [--regions REGION ... | all] [--accounts ACCOUNT_ID ... | organization] [--role-name ROLE]
 
 
 import argparse
 import sys
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-import boto3
 import botocore
 
-cloudwatch = boto3.client("logs")
+from cw_fanout import FanOut, add_fanout_arguments, format_target, print_failed_targets
+from cw_logs_api import (
+    LOGS_API_QUOTAS,
+    RateLimiter,
+    add_log_group_filter_arguments,
+    call_with_retries,
+    iter_log_groups,
+    log_group_filters,
+)
 
+DEFAULT_WORKERS = 10
 
-def get_cloudwatch_log_groups():
-    kwargs = {"limit": 50}
-    cloudwatch_log_groups = []
 
-    while True:  # Paginate
-        response = cloudwatch.describe_log_groups(**kwargs)
-        cloudwatch_log_groups += [log_group for log_group in response["logGroups"]]
-        if "nextToken" in response:
-            kwargs["nextToken"] = response["nextToken"]
-        else:
-            break
+def iter_groups_to_update(cloudwatch, retention, filters):
+    """Yield the log groups of one account and region that don't have the retention yet, while they're listed."""
+    for group in iter_log_groups(cloudwatch, **filters):
+        if group.get("retentionInDays") != retention:
+            yield group
 
-    return cloudwatch_log_groups
 
+def get_groups_to_update(cloudwatch, retention, filters):
+    return list(iter_groups_to_update(cloudwatch, retention, filters))
 
-def update_log_group_retention(group, retention):
+
+def update_log_group_retention(cloudwatch, group, retention, limiter):
+    """Set the retention of a single log group, returns None on success or the error message."""
     try:
-        if "retentionInDays" not in group or group["retentionInDays"] != retention:
-            cloudwatch.put_retention_policy(logGroupName=group["logGroupName"], retentionInDays=retention)
+        call_with_retries(
+            limiter, cloudwatch.put_retention_policy, logGroupName=group["logGroupName"], retentionInDays=retention
+        )
+        return None
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        return str(e)
 
-            # Verify the update
-            updated_group = cloudwatch.describe_log_groups(logGroupNamePrefix=group["logGroupName"])["logGroups"][0]
-            if updated_group.get("retentionInDays") == retention:
-                return f"Successfully updated retention for: {group['logGroupName']}"
-            else:
-                return f"Failed to update retention for: {group['logGroupName']}. Current retention: {updated_group.get('retentionInDays')}"
-        else:
-            return (
-                f"CloudWatch Loggroup: {group['logGroupName']} already has the specified retention of {retention} days."
-            )
-    except botocore.exceptions.ClientError as e:
-        return f"Error updating {group['logGroupName']}: {e}"
+
+def verify_retention(cloudwatch, group_names, retention, filters):
+    """Re-list the log groups once and return the names (of group_names) that don't have the retention yet."""
+    remaining = set(group_names)
+    for group in iter_log_groups(cloudwatch, **filters):
+        if group.get("retentionInDays") == retention:
+            remaining.discard(group["logGroupName"])
+    return remaining
 
 
 def count_retention_periods(cloudwatch_log_groups):
@@ -68,11 +81,91 @@ def count_retention_periods(cloudwatch_log_groups):
     return retention_counts
 
 
+def count_target_retention_periods(cloudwatch, filters):
+    return count_retention_periods(iter_log_groups(cloudwatch, **filters))
+
+
+def update_target_retention(cloudwatch, groups, retention, filters, workers=DEFAULT_WORKERS, rate=None):
+    """
+    Update the retention of the groups (any iterable) of one account and region and return a summary.
+
+    Updates are submitted while the groups are still being listed, with at most workers * 2 of them pending.
+    """
+    limiter = RateLimiter.for_operation("put_retention_policy", rate)
+    updated_groups = []
+    errors = []
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            group_name = pending.pop(future)
+            error = future.result()
+            if error:
+                errors.append((group_name, error))
+            else:
+                updated_groups.append(group_name)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for group in groups:
+            future = executor.submit(update_log_group_retention, cloudwatch, group, retention, limiter)
+            pending[future] = group["logGroupName"]
+            if len(pending) >= workers * 2:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        collect(wait(pending).done)
+
+    # Verify all updates with one re-listing instead of a describe call per log group
+    unverified = verify_retention(cloudwatch, updated_groups, retention, filters)
+    return {
+        "attempted": len(updated_groups) + len(errors),
+        "updated": len(updated_groups) - len(unverified),
+        "errors": errors,
+        "unverified": sorted(unverified),
+        "summary": limiter.summary(),
+    }
+
+
+def stream_target_retention(cloudwatch, retention, filters, workers=DEFAULT_WORKERS, rate=None):
+    """Update the retention of one account and region without confirmation, starting with the first page."""
+    groups = iter_groups_to_update(cloudwatch, retention, filters)
+    return update_target_retention(cloudwatch, groups, retention, filters, workers, rate)
+
+
+def print_update_results(fanout, results, listings=()):
+    updated_count = 0
+    failed_count = 0
+    attempted_count = 0
+    for target, result, error in results:
+        if error:
+            continue
+        label = "" if fanout.is_single_target() else f"{format_target(target)}: "
+        for group_name, group_error in result["errors"]:
+            print(f"{label}Error updating {group_name}: {group_error}")
+        for group_name in result["unverified"]:
+            print(f"{label}Failed to verify the retention of: {group_name}")
+        print(f"{label}Updates: {result['summary']}")
+        attempted_count += result["attempted"]
+        updated_count += result["updated"]
+        failed_count += len(result["errors"]) + len(result["unverified"])
+
+    print(f"\nAttempted to update {attempted_count} log groups.")
+    print(f"Successfully updated: {updated_count}")
+    print(f"Failed to update: {failed_count}")
+    print_failed_targets(list(listings) + results)
+
+    if failed_count > 0:
+        print("\nSome updates failed. Please check the output above for details.")
+
+
 def cloudwatch_set_retention(args):
-    cloudwatch_log_groups = get_cloudwatch_log_groups()
+    fanout = FanOut.from_args(args)
+    filters = log_group_filters(args)
 
     if args.print_retention_counts:
-        retention_counts = count_retention_periods(cloudwatch_log_groups)
+        results = fanout.run(count_target_retention_periods, filters)
+        retention_counts = defaultdict(int)
+        for _, target_counts, error in results:
+            for retention_period, count in (target_counts or {}).items():
+                retention_counts[retention_period] += count
         print("Retention periods and log group counts:")
 
         # Separate 'Not set' from other retention periods
@@ -88,49 +181,45 @@ def cloudwatch_set_retention(args):
         # Print the rest of the sorted items
         for retention_period, count in sorted_items:
             print(f"Retention: {retention_period} days, Count: {count}")
+        print_failed_targets(results)
         return
 
     retention = vars(args)["retention"]
-    groups_to_update = [
-        group
-        for group in cloudwatch_log_groups
-        if "retentionInDays" not in group or group["retentionInDays"] != retention
-    ]
+    if args.yes:
+        # No confirmation needed, so every target starts updating as soon as its first page is listed
+        print_update_results(fanout, fanout.run(stream_target_retention, retention, filters, args.workers, args.rate))
+        return
+
+    listings = fanout.run(get_groups_to_update, retention, filters)
+    groups_by_target = {target: groups for target, groups, error in listings if groups}
+    groups_to_update = [group for target_groups in groups_by_target.values() for group in target_groups]
 
     if not groups_to_update:
         print(f"All log groups already have the specified retention of {retention} days.")
+        print_failed_targets(listings)
         return
 
     print(f"Log groups that need to be updated to {retention} days retention:")
-    for group in groups_to_update:
-        current_retention = group.get("retentionInDays", "Not set")
-        print(f"  {group['logGroupName']} (current retention: {current_retention})")
+    for target, target_groups in groups_by_target.items():
+        if not fanout.is_single_target():
+            print(f"{format_target(target)}:")
+        for group in target_groups:
+            current_retention = group.get("retentionInDays", "Not set")
+            print(f"  {group['logGroupName']} (current retention: {current_retention})")
 
     if input("\nDo you want to proceed with the update? (y/n): ").lower() != "y":
         print("Update cancelled.")
         return
 
-    updated_count = 0
-    failed_count = 0
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_group = {
-            executor.submit(update_log_group_retention, group, retention): group for group in groups_to_update
-        }
-        for future in as_completed(future_to_group):
-            result = future.result()
-            print(result)
-            if "Successfully updated" in result:
-                updated_count += 1
-            else:
-                failed_count += 1
-
-    print(f"\nAttempted to update {len(groups_to_update)} log groups.")
-    print(f"Successfully updated: {updated_count}")
-    print(f"Failed to update: {failed_count}")
-
-    if failed_count > 0:
-        print("\nSome updates failed. Please check the output above for details.")
+    # The Logs API quotas are per account and region, so every target gets its own rate limiter
+    results = fanout.run_targets(
+        update_target_retention,
+        {
+            target: (target_groups, retention, filters, args.workers, args.rate)
+            for target, target_groups in groups_by_target.items()
+        },
+    )
+    print_update_results(fanout, results, listings)
 
 
 if __name__ == "__main__":
@@ -164,6 +253,26 @@ if __name__ == "__main__":
     parser.add_argument(
         "--print-retention-counts", action="store_true", help="Print the number of log groups for each retention period"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Concurrent update threads per account and region (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help=f"Maximum put_retention_policy calls per second per account and region (default: {LOGS_API_QUOTAS['put_retention_policy']}, "
+        "the default quota)",
+    )
+
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="Update without confirmation, starting as soon as the first log groups are listed",
+    )
+    add_log_group_filter_arguments(parser)
+    add_fanout_arguments(parser)
 
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
@@ -173,5 +282,7 @@ if __name__ == "__main__":
 
     if args.print_retention_counts and args.retention is not None:
         parser.error("--print-retention-counts cannot be used with --retention argument")
+    if not args.print_retention_counts and args.retention is None:
+        parser.error("one of --retention or --print-retention-counts is required")
 
     cloudwatch_set_retention(args)
@@ -0,0 +1,201 @@
+"""
+Description: Shared deletion executor for the EC2 cleanup scripts in this folder. Instead of deleting resources
+one at a time, deletes run on a bounded worker pool. EC2 meters mutating API calls per account and region with
+a token bucket (a burst of 50 calls, refilled at 5 calls per second by default), so all workers draw from one
+matching client-side token bucket that backs off when EC2 answers with RequestLimitExceeded anyway.
+
+Key features:
+- Bounded worker pool sharing one EC2 client, resources are submitted as they are produced
+- Token bucket tuned to the default EC2 mutating API rate limits, adjustable for raised quotas
+- Adaptive rate: halves on every throttle, recovers additively on success
+- Retries RequestLimitExceeded and transient errors with full jitter exponential backoff
+- One result per resource (deleted or the error code and message), a resource that is already gone counts
+  as deleted when the delete call itself reports it as not found
+
+Usage (from another script in this folder):
+    from ec2_delete_executor import DeleteExecutor
+
+    executor = DeleteExecutor()
+
+    def delete_snapshot(snapshot_id):
+        executor.call("delete_snapshot", already_deleted_code="InvalidSnapshot.NotFound", SnapshotId=snapshot_id)
+
+    for result in executor.run(delete_snapshot, snapshot_ids):
+        print(result.resource_id, result.error_code or "deleted")
+    print(executor.summary())
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+
+# Default EC2 API request rate limits for mutating actions, per account and region
+MUTATING_BUCKET_SIZE = 50
+MUTATING_REFILL_RATE = 5  # Calls per second
+DEFAULT_DELETE_WORKERS = 8
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = 0.5  # Seconds
+MAX_BACKOFF = 30
+THROTTLING_ERROR_CODES = {"RequestLimitExceeded", "Throttling", "ThrottlingException"}
+TRANSIENT_ERROR_CODES = {"InternalError", "Unavailable", "ServiceUnavailable"}
+
+DeleteResult = namedtuple("DeleteResult", ["resource_id", "error_code", "error_message"])
+
+
+class TokenBucket:
+    """Thread-safe token bucket holding up to capacity calls, refilled at an adaptive rate per second."""
+
+    def __init__(self, rate=MUTATING_REFILL_RATE, capacity=MUTATING_BUCKET_SIZE):
+        self.max_rate = rate
+        self.min_rate = rate / 20
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "started": time.monotonic()}
+
+    def acquire(self):
+        """Block until a call may be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats["calls"] += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self):
+        with self.lock:
+            # EC2's own bucket is empty, so drain ours as well
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.stats["throttled"] += 1
+
+    def on_retry(self):
+        with self.lock:
+            self.stats["retries"] += 1
+
+
+class DeleteExecutor:
+    """Runs delete tasks on a bounded worker pool, with every EC2 call going through one token bucket."""
+
+    def __init__(
+        self,
+        session=None,
+        region_name=None,
+        max_workers=DEFAULT_DELETE_WORKERS,
+        rate=MUTATING_REFILL_RATE,
+        burst=MUTATING_BUCKET_SIZE,
+    ):
+        self.max_workers = max_workers
+        # Retries are handled by call, so every throttle is seen (and counted) by the token bucket
+        config = Config(max_pool_connections=max_workers, retries={"total_max_attempts": 1, "mode": "standard"})
+        self.client = (session or boto3).client("ec2", region_name=region_name, config=config)
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.Lock()
+        self.counts = {"deleted": 0, "failed": 0}
+
+    def call(self, operation, already_deleted_code=None, **kwargs):
+        """
+        Call an EC2 operation through the token bucket, retrying throttling and transient errors.
+
+        already_deleted_code is the error code of the resource this call deletes not existing (e.g.
+        InvalidSnapshot.NotFound for delete_snapshot). That resource is already gone, so None is returned
+        instead of raising. Not found errors about any other resource still raise.
+        """
+        func = getattr(self.client, operation)
+        for attempt in range(MAX_ATTEMPTS):
+            self.bucket.acquire()
+            try:
+                response = func(**kwargs)
+                self.bucket.on_success()
+                return response
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                if already_deleted_code and code == already_deleted_code:
+                    self.bucket.on_success()
+                    return None
+                if code in THROTTLING_ERROR_CODES:
+                    self.bucket.on_throttle()
+                elif code not in TRANSIENT_ERROR_CODES:
+                    raise
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+            except (ConnectionError, ReadTimeoutError):
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+            self.bucket.on_retry()
+            time.sleep(random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2**attempt)))
+
+    def _run_task(self, task, resource_id):
+        try:
+            task(resource_id)
+            result = DeleteResult(resource_id, None, None)
+        except ClientError as e:
+            error = e.response["Error"]
+            result = DeleteResult(resource_id, error["Code"], error.get("Message", ""))
+        except Exception as e:
+            # A failing task never takes down the worker pool, it's reported like any other failed delete
+            result = DeleteResult(resource_id, type(e).__name__, str(e))
+        with self.lock:
+            self.counts["failed" if result.error_code else "deleted"] += 1
+        return result
+
+    def run(self, task, resource_ids):
+        """
+        Call task(resource_id) for every resource ID on the worker pool and yield a DeleteResult per resource
+        as soon as it's done. resource_ids may be a generator, at most twice the number of workers are pending.
+        """
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for resource_id in resource_ids:
+                pending.add(executor.submit(self._run_task, task, resource_id))
+                if len(pending) >= self.max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in wait(pending).done:
+                yield future.result()
+
+    def summary(self):
+        stats = self.bucket.stats
+        elapsed = max(time.monotonic() - stats["started"], 1e-6)
+        return (
+            f"{self.counts['deleted']} deleted, {self.counts['failed']} failed, {stats['calls']} calls in "
+            f"{elapsed:.1f}s ({stats['calls'] / elapsed:.1f}/s), {stats['throttled']} throttled, "
+            f"{stats['retries']} retries"
+        )
+
+
+def add_delete_executor_arguments(parser):
+    parser.add_argument(
+        "--delete-workers",
+        type=int,
+        default=DEFAULT_DELETE_WORKERS,
+        help=f"Number of parallel delete threads (default: {DEFAULT_DELETE_WORKERS})",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=MUTATING_REFILL_RATE,
+        help=f"Maximum sustained delete calls per second, raise it for raised EC2 API quotas "
+        f"(default: {MUTATING_REFILL_RATE})",
+    )
@@ -9,12 +9,16 @@ Key features:
 - Supports dry run mode for safe execution
 - Provides detailed logging of all operations, including list of orphaned snapshot IDs
 - Uses boto3 to interact with AWS EC2 service
+- Fetches the snapshot, AMI and volume inventories concurrently, one paginated sweep each, so the number of
+  API calls grows with the number of pages instead of the number of snapshots
 - Implements error handling for robustness
 - Allows setting a retention period for snapshots
 - Ensures snapshots associated with AMIs are not deleted
+- Deletes snapshots in parallel within the EC2 API rate limits (ec2_delete_executor.py)
 
 Usage:
 python ec2_delete_orphaned_snapshots.py [--dry-run] [--retention-days DAYS] [--profile PROFILE_NAME]
+                                        [--delete-workers N] [--rate CALLS_PER_SECOND]
 
 Author: [Your Name]
 License: MIT
@@ -22,10 +26,22 @@ License: MIT
 
 import argparse
 import logging
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from ec2_delete_executor import (
+    DEFAULT_DELETE_WORKERS,
+    MUTATING_REFILL_RATE,
+    DeleteExecutor,
+    add_delete_executor_arguments,
+)
+
+VOLUMES_PAGE_SIZE = 500  # The maximum MaxResults of describe_volumes
+
+logger = logging.getLogger(__name__)
 
 
 def setup_logging():
@@ -54,75 +70,90 @@ def get_owned_snapshots(ec2_client):
         return []
 
 
-def is_volume_exists(ec2_client, volume_id):
-    try:
-        ec2_client.describe_volumes(VolumeIds=[volume_id])
-        return True
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "InvalidVolume.NotFound":
-            return False
-        logger.error(f"Error checking volume {volume_id}: {e}")
-        return True  # Assume volume exists in case of other errors
+def get_live_volume_ids(ec2_client):
+    """
+    Return the IDs of every volume in the region from one paginated describe_volumes sweep.
 
+    Unlike the owned snapshots this inventory doesn't fall back to an empty result on errors: without the volumes
+    every snapshot would look orphaned.
+    """
+    volume_ids = set()
+    paginator = ec2_client.get_paginator("describe_volumes")
+    for page in paginator.paginate(PaginationConfig={"PageSize": VOLUMES_PAGE_SIZE}):
+        volume_ids.update(volume["VolumeId"] for volume in page["Volumes"])
+    logger.info(f"Live volumes: {len(volume_ids)}")
+    return volume_ids
 
-def get_snapshots_used_by_amis(ec2_client):
-    try:
-        used_snapshots = set()
-        paginator = ec2_client.get_paginator("describe_images")
-        for page in paginator.paginate(Owners=["self"]):
-            for image in page["Images"]:
-                for block_device in image.get("BlockDeviceMappings", []):
-                    if "Ebs" in block_device and "SnapshotId" in block_device["Ebs"]:
-                        used_snapshots.add(block_device["Ebs"]["SnapshotId"])
-        logger.info(f"Snapshots used by AMIs: {len(used_snapshots)}")
-        logger.info(f"Snapshot IDs used by AMIs: {list(used_snapshots)}")
-        return used_snapshots
-    except ClientError as e:
-        logger.error(f"Failed to retrieve snapshots used by AMIs: {e}")
-        return set()
 
+def get_inventories(ec2_client):
+    """Fetch the owned snapshots, the snapshots used by AMIs and the live volume IDs concurrently."""
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        owned_snapshots = executor.submit(get_owned_snapshots, ec2_client)
+        snapshots_used_by_amis = executor.submit(get_snapshots_used_by_amis, ec2_client)
+        live_volume_ids = executor.submit(get_live_volume_ids, ec2_client)
+        return owned_snapshots.result(), snapshots_used_by_amis.result(), live_volume_ids.result()
 
-def delete_snapshot(ec2_client, snapshot_id, dry_run=False):
-    try:
-        if not dry_run:
-            ec2_client.delete_snapshot(SnapshotId=snapshot_id)
-            logger.info(f"Deleted snapshot: {snapshot_id}")
-        else:
-            logger.info(f"Would delete snapshot: {snapshot_id}")
-        return True
-    except ClientError as e:
-        logger.error(f"Failed to delete snapshot {snapshot_id}: {e}")
-        return False
+
+def find_orphaned_snapshots(owned_snapshots, snapshots_used_by_amis, live_volume_ids):
+    return [
+        snapshot
+        for snapshot in owned_snapshots
+        if "VolumeId" in snapshot
+        and snapshot["VolumeId"] not in live_volume_ids
+        and snapshot["SnapshotId"] not in snapshots_used_by_amis
+    ]
 
 
-def delete_orphaned_snapshots(ec2_client, orphaned_snapshots, dry_run=False):
+def get_snapshots_used_by_amis(ec2_client):
+    """
+    Return the IDs of the snapshots used by owned AMIs. Errors are raised like in get_live_volume_ids: without
+    the AMIs every snapshot backing one would look orphaned.
+    """
+    used_snapshots = set()
+    paginator = ec2_client.get_paginator("describe_images")
+    for page in paginator.paginate(Owners=["self"]):
+        for image in page["Images"]:
+            for block_device in image.get("BlockDeviceMappings", []):
+                if "Ebs" in block_device and "SnapshotId" in block_device["Ebs"]:
+                    used_snapshots.add(block_device["Ebs"]["SnapshotId"])
+    logger.info(f"Snapshots used by AMIs: {len(used_snapshots)}")
+    logger.info(f"Snapshot IDs used by AMIs: {list(used_snapshots)}")
+    return used_snapshots
+
+
+def delete_snapshot(executor, snapshot_id):
+    executor.call("delete_snapshot", already_deleted_code="InvalidSnapshot.NotFound", SnapshotId=snapshot_id)
+
+
+def delete_orphaned_snapshots(executor, orphaned_snapshots):
     deleted_count = 0
-    for snapshot in orphaned_snapshots:
-        if delete_snapshot(ec2_client, snapshot["SnapshotId"], dry_run):
+    snapshot_ids = (snapshot["SnapshotId"] for snapshot in orphaned_snapshots)
+    for result in executor.run(lambda snapshot_id: delete_snapshot(executor, snapshot_id), snapshot_ids):
+        if result.error_code:
+            logger.error(f"Failed to delete snapshot {result.resource_id}: {result.error_code}: {result.error_message}")
+        else:
+            logger.info(f"Deleted snapshot: {result.resource_id}")
             deleted_count += 1
+    logger.info(f"Delete calls: {executor.summary()}")
     return deleted_count
 
 
-def main(dry_run=False, retention_days=None):
+def main(dry_run=False, retention_days=None, delete_workers=DEFAULT_DELETE_WORKERS, rate=MUTATING_REFILL_RATE):
     ec2_client = get_ec2_client()
 
-    owned_snapshots = get_owned_snapshots(ec2_client)
-    snapshots_used_by_amis = get_snapshots_used_by_amis(ec2_client)
+    try:
+        owned_snapshots, snapshots_used_by_amis, live_volume_ids = get_inventories(ec2_client)
+    except (ClientError, BotoCoreError) as e:
+        logger.error(f"Failed to retrieve the volumes or the snapshots used by AMIs, not deleting any snapshots: {e}")
+        return
 
-    # Find orphaned snapshots
-    orphaned_snapshots = [
-        snapshot
-        for snapshot in owned_snapshots
-        if "VolumeId" in snapshot
-        and not is_volume_exists(ec2_client, snapshot["VolumeId"])
-        and snapshot["SnapshotId"] not in snapshots_used_by_amis
-    ]
+    orphaned_snapshots = find_orphaned_snapshots(owned_snapshots, snapshots_used_by_amis, live_volume_ids)
     logger.info(f"Orphaned snapshots: {len(orphaned_snapshots)}")
     logger.info(f"Orphaned snapshot IDs: {[snapshot['SnapshotId'] for snapshot in orphaned_snapshots]}")
 
     if retention_days is not None:
         # Filter snapshots based on retention period
-        cutoff_date = datetime.now(orphaned_snapshots[0]["StartTime"].tzinfo) - timedelta(days=retention_days)
+        cutoff_date = datetime.now(timezone.utc) - timedelta(days=retention_days)
         orphaned_snapshots = [snapshot for snapshot in orphaned_snapshots if snapshot["StartTime"] < cutoff_date]
         logger.info(f"Orphaned snapshots older than {retention_days} days: {len(orphaned_snapshots)}")
         logger.info(
@@ -139,7 +170,8 @@ def main(dry_run=False, retention_days=None):
             f"Snapshot IDs that would be deleted: {[snapshot['SnapshotId'] for snapshot in orphaned_snapshots]}"
         )
     else:
-        deleted_count = delete_orphaned_snapshots(ec2_client, orphaned_snapshots, dry_run)
+        executor = DeleteExecutor(max_workers=delete_workers, rate=rate)
+        deleted_count = delete_orphaned_snapshots(executor, orphaned_snapshots)
         logger.info(f"Deleted {deleted_count} orphaned snapshot(s).")
 
     # Summary
@@ -156,9 +188,15 @@ if __name__ == "__main__":
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without actually deleting snapshots")
     parser.add_argument("--retention-days", type=int, help="Number of days to retain snapshots before deletion")
     parser.add_argument("--profile", help="AWS CLI profile name")
+    add_delete_executor_arguments(parser)
     args = parser.parse_args()
 
     if args.profile:
         boto3.setup_default_session(profile_name=args.profile)
 
-    main(dry_run=args.dry_run, retention_days=args.retention_days)
+    main(
+        dry_run=args.dry_run,
+        retention_days=args.retention_days,
+        delete_workers=args.delete_workers,
+        rate=args.rate,
+    )
@@ -1,27 +1,246 @@
-#  https://github.com/dannysteenman/aws-toolbox
-#
-#  License: MIT
-#
-# This script deletes all unattached EBS volumes in all AWS Regions
+"""
+Description: This script finds and optionally deletes all unattached EBS volumes in all AWS Regions. It runs as a
+staged pipeline: the available volumes of every region are collected concurrently, the time each volume was
+detached is looked up, a monthly cost estimate is calculated from the size and volume type, a report shows how
+many GB and dollars deleting them would save, and only then the volumes are deleted in parallel.
 
-import boto3
+Key features:
+- Collects the volumes of all regions concurrently (ec2_region_runner.py) with a server-side status=available
+  filter, so attached volumes are never transferred
+- Looks up when every volume was detached from the DetachVolume events in CloudTrail (the last 90 days), and
+  can keep volumes that have been idle for less than a number of days or whose idle time is unknown
+- Volumes that were created with CreateVolume and never attached are idle since their creation time
+- Estimates the monthly cost per volume from its size, type, provisioned IOPS and throughput
+- Supports dry run mode to only report what would be deleted
+- Deletes in parallel within the EC2 API rate limits of every region (ec2_delete_executor.py)
 
-ec2 = boto3.client("ec2")
+Usage:
+python ec2_delete_unattached_volumes.py [--dry-run] [--min-idle-days DAYS] [--regions REGION ...]
+                                        [--delete-workers N] [--rate CALLS_PER_SECOND]
 
-count = 0
-for region in ec2.describe_regions()["Regions"]:
-    region_name = region["RegionName"]
+Author: Danny Steenman
+License: MIT
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from ec2_delete_executor import (
+    DEFAULT_DELETE_WORKERS,
+    MUTATING_REFILL_RATE,
+    DeleteExecutor,
+    add_delete_executor_arguments,
+)
+from ec2_region_runner import STATUS_OK, RegionRunner, print_region_results
+
+# Monthly EBS prices in us-east-1, other regions are priced similarly
+VOLUME_GB_PRICES = {
+    "gp2": 0.10,
+    "gp3": 0.08,
+    "io1": 0.125,
+    "io2": 0.125,
+    "st1": 0.045,
+    "sc1": 0.015,
+    "standard": 0.05,
+}
+PROVISIONED_IOPS_PRICE = 0.065  # io1 and io2, per IOPS-month
+GP3_IOPS_PRICE = 0.005  # Per IOPS-month above the included IOPS
+GP3_INCLUDED_IOPS = 3000
+GP3_THROUGHPUT_PRICE = 0.04  # Per MB/s-month above the included throughput
+GP3_INCLUDED_THROUGHPUT = 125
+CLOUDTRAIL_LOOKBACK_DAYS = 90  # CloudTrail event history only goes back 90 days
+VOLUMES_PAGE_SIZE = 500
+
+
+def estimate_monthly_cost(volume):
+    volume_type = volume["VolumeType"]
+    cost = volume["Size"] * VOLUME_GB_PRICES.get(volume_type, VOLUME_GB_PRICES["gp2"])
+    if volume_type in ("io1", "io2"):
+        cost += volume.get("Iops", 0) * PROVISIONED_IOPS_PRICE
+    elif volume_type == "gp3":
+        cost += max(volume.get("Iops", 0) - GP3_INCLUDED_IOPS, 0) * GP3_IOPS_PRICE
+        cost += max(volume.get("Throughput", 0) - GP3_INCLUDED_THROUGHPUT, 0) * GP3_THROUGHPUT_PRICE
+    return cost
+
+
+def lookup_volume_events(cloudtrail, event_name, lookback_start):
+    """Return a dict of volume ID to the time of its latest event_name event (e.g. DetachVolume) since the start."""
+    event_times = {}
+    paginator = cloudtrail.get_paginator("lookup_events")
+    pages = paginator.paginate(
+        LookupAttributes=[{"AttributeKey": "EventName", "AttributeValue": event_name}], StartTime=lookback_start
+    )
+    for page in pages:
+        for event in page["Events"]:
+            for resource in event.get("Resources", []):
+                if resource.get("ResourceType") == "AWS::EC2::Volume":
+                    volume_id = resource["ResourceName"]
+                    event_times[volume_id] = max(event["EventTime"], event_times.get(volume_id, event["EventTime"]))
+    return event_times
+
+
+def lookup_never_attached(cloudtrail, lookback_start, volume_ids):
+    """
+    Return the IDs of the volumes in volume_ids that were created with CreateVolume since lookback_start and
+    never attached. Volumes created by RunInstances have no CreateVolume event and are left out: they were
+    attached to their instance, and terminating it doesn't log a DetachVolume event.
+    """
+    created = lookup_volume_events(cloudtrail, "CreateVolume", lookback_start)
+    attached = lookup_volume_events(cloudtrail, "AttachVolume", lookback_start)
+    return {volume_id for volume_id in volume_ids if volume_id in created and volume_id not in attached}
+
+
+def collect_region(ec2conn, runner, now):
+    """Return the available volumes of a region, with their idle days (None when unknown) and monthly cost."""
+    volumes = []
+    paginator = ec2conn.get_paginator("describe_volumes")
+    pages = paginator.paginate(
+        Filters=[{"Name": "status", "Values": ["available"]}], PaginationConfig={"PageSize": VOLUMES_PAGE_SIZE}
+    )
+    for page in pages:
+        volumes.extend(page["Volumes"])
+    if not volumes:
+        return []
+
+    region = ec2conn.meta.region_name
+    lookback_start = now - timedelta(days=CLOUDTRAIL_LOOKBACK_DAYS)
+    cloudtrail = runner.client_for(region, "cloudtrail")
+    detach_times, never_attached = {}, set()
     try:
-        ec2conn = boto3.resource("ec2", region_name=region_name)
-        unattached_volumes = [
-            volume for volume in ec2conn.volumes.all() if not volume.attachments
-        ]
-        for volume in unattached_volumes:
-            count += 1
-            volume.delete()
-            print(f"Deleted unattached volume {volume.id} in region {region_name}")
-    except Exception as e:
-        print(f"No access to region {region_name}: {e}")
-
-if count > 0:
-    print(f"Deleted {count} unattached volumes")
+        detach_times = lookup_volume_events(cloudtrail, "DetachVolume", lookback_start)
+        undetached = [volume["VolumeId"] for volume in volumes if volume["VolumeId"] not in detach_times]
+        if undetached:
+            never_attached = lookup_never_attached(cloudtrail, lookback_start, undetached)
+    except ClientError as e:
+        print(f"Can't look up when the volumes in region {region} were detached: {e}")
+
+    for volume in volumes:
+        volume["MonthlyCost"] = estimate_monthly_cost(volume)
+        volume["IdleDays"] = None
+        detached_at = detach_times.get(volume["VolumeId"])
+        if detached_at:
+            volume["IdleDays"] = (now - detached_at).days
+        elif volume["VolumeId"] in never_attached:
+            volume["IdleDays"] = (now - volume["CreateTime"]).days
+        # Otherwise the idle time is unknown: the volume may have been detached before the lookback period, or
+        # left behind by a terminated instance yesterday, which doesn't log a DetachVolume event
+    return volumes
+
+
+def delete_region(ec2conn, executors, volumes_by_region):
+    """Delete the volumes of a region in parallel and return the DeleteResults."""
+    region = ec2conn.meta.region_name
+    executor = executors[region]
+    volume_ids = (volume["VolumeId"] for volume in volumes_by_region[region])
+
+    def delete_volume(volume_id):
+        executor.call("delete_volume", already_deleted_code="InvalidVolume.NotFound", VolumeId=volume_id)
+
+    return list(executor.run(delete_volume, volume_ids))
+
+
+def print_report(volumes_by_region, min_idle_days):
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for region, volumes in volumes_by_region.items():
+        for volume in volumes:
+            idle_days = "unknown" if volume["IdleDays"] is None else volume["IdleDays"]
+            print(
+                f"{volume['VolumeId']} in region {region}: {volume['VolumeType']}, {volume['Size']} GB, "
+                f"idle for {idle_days} days, ${volume['MonthlyCost']:.2f} per month"
+            )
+            totals[region][0] += 1
+            totals[region][1] += volume["Size"]
+            totals[region][2] += volume["MonthlyCost"]
+
+    for region, (count, size, cost) in sorted(totals.items()):
+        print(f"Region {region}: {count} unattached volumes, {size} GB, ${cost:.2f} per month")
+    count = sum(total[0] for total in totals.values())
+    size = sum(total[1] for total in totals.values())
+    cost = sum(total[2] for total in totals.values())
+    idle_filter = f" idle for at least {min_idle_days} days" if min_idle_days else ""
+    print(f"Total of {count} unattached volumes{idle_filter}: {size} GB, ${cost:.2f} per month")
+
+
+def main(
+    dry_run=False,
+    min_idle_days=None,
+    regions=None,
+    delete_workers=DEFAULT_DELETE_WORKERS,
+    rate=MUTATING_REFILL_RATE,
+):
+    now = datetime.now(timezone.utc)
+    runner = RegionRunner(regions=regions)
+
+    # Stage 1: collect the available volumes of every region, with their idle time and cost
+    results = runner.run(collect_region, runner, now)
+    volumes_by_region = {}
+    for result in results:
+        if result.status != STATUS_OK or not result.result:
+            continue
+        volumes = result.result
+        if min_idle_days:
+            # Volumes with an unknown idle time are left alone
+            for volume in volumes:
+                if volume["IdleDays"] is None:
+                    print(f"Keeping volume {volume['VolumeId']} in region {result.region}: idle time unknown")
+            volumes = [
+                volume for volume in volumes if volume["IdleDays"] is not None and volume["IdleDays"] >= min_idle_days
+            ]
+        if volumes:
+            volumes_by_region[result.region] = volumes
+
+    # Stage 2: report what deleting them would save
+    print_report(volumes_by_region, min_idle_days)
+    print_region_results(results)
+    if dry_run or not volumes_by_region:
+        return
+
+    # Stage 3: delete in parallel, with a rate limited executor per region since EC2 rate limits are regional
+    executors = {
+        region: DeleteExecutor(runner.session, region, max_workers=delete_workers, rate=rate)
+        for region in volumes_by_region
+    }
+    delete_runner = RegionRunner(runner.session, regions=sorted(volumes_by_region))
+    count = 0
+    for result in delete_runner.run(delete_region, executors, volumes_by_region):
+        if result.status != STATUS_OK:
+            print(f"Failed to delete the volumes in region {result.region}: {result.error}")
+            continue
+        for delete_result in result.result:
+            if delete_result.error_code:
+                print(
+                    f"Failed to delete volume {delete_result.resource_id} in region {result.region}: "
+                    f"{delete_result.error_code}: {delete_result.error_message}"
+                )
+            else:
+                count += 1
+                print(f"Deleted unattached volume {delete_result.resource_id} in region {result.region}")
+        print(f"Region {result.region}: {executors[result.region].summary()}")
+
+    if count > 0:
+        print(f"Deleted {count} unattached volumes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete unattached EBS volumes in all regions")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the volumes that would be deleted")
+    parser.add_argument(
+        "--min-idle-days",
+        type=int,
+        help=f"Only delete volumes that have been detached for at least this many days "
+        f"(at most {CLOUDTRAIL_LOOKBACK_DAYS}, the CloudTrail event history)",
+    )
+    parser.add_argument("--regions", nargs="+", help="Regions to run in (default: all enabled regions)")
+    add_delete_executor_arguments(parser)
+    args = parser.parse_args()
+
+    main(
+        dry_run=args.dry_run,
+        min_idle_days=args.min_idle_days,
+        regions=args.regions,
+        delete_workers=args.delete_workers,
+        rate=args.rate,
+    )
@@ -1,8 +1,9 @@
 """
 Description: This script identifies and optionally deletes unused AMIs (Amazon Machine Images) in an AWS account.
 It fetches all AMIs owned by the account, determines which ones are currently used by EC2 instances,
-and identifies the unused AMIs. The script can perform a dry run to show which AMIs would be deleted
-without actually deleting them. It also supports a retention period to keep AMIs for a specified number of days.
+launch template versions, launch configurations or Auto Scaling groups, and identifies the unused AMIs.
+The script can perform a dry run to show which AMIs would be deleted without actually deleting them.
+It also supports a retention period to keep AMIs for a specified number of days.
 
 Key features:
 - Automatically uses the region specified in the AWS CLI profile
@@ -11,10 +12,14 @@ Key features:
 - Uses boto3 to interact with AWS EC2 service
 - Implements error handling for robustness
 - Allows setting a retention period for AMIs
-- Deletes associated snapshots when deleting AMIs
+- Deletes associated snapshots when deleting AMIs, taken from the cached AMI records (no describe per AMI)
+- Builds the index of used AMIs from instances, launch templates, launch configurations and Auto Scaling
+  groups concurrently, and doesn't delete anything when one of them can't be read
+- Deletes AMIs in parallel within the EC2 API rate limits (ec2_delete_executor.py)
 
 Usage:
 python ec2_delete_unused_amis.py [--dry-run] [--retention-days DAYS] [--profile PROFILE_NAME]
+                                 [--delete-workers N] [--rate CALLS_PER_SECOND]
 
 Author: [Your Name]
 License: MIT
@@ -22,10 +27,22 @@ License: MIT
 
 import argparse
 import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from ec2_delete_executor import (
+    DEFAULT_DELETE_WORKERS,
+    MUTATING_REFILL_RATE,
+    DeleteExecutor,
+    add_delete_executor_arguments,
+)
+
+REFERENCE_WORKERS = 8  # Parallel launch template version lookups
 
 
 def setup_logging():
@@ -35,12 +52,21 @@ def setup_logging():
 
 def get_ec2_client():
     try:
-        return boto3.client("ec2")
+        # Room for the launch template version lookups, the owned AMIs and the other concurrent inventories
+        return boto3.client("ec2", config=Config(max_pool_connections=REFERENCE_WORKERS + 5))
     except ClientError as e:
         logger.error(f"Failed to create EC2 client: {e}")
         raise
 
 
+def get_autoscaling_client():
+    try:
+        return boto3.client("autoscaling")
+    except ClientError as e:
+        logger.error(f"Failed to create Auto Scaling client: {e}")
+        raise
+
+
 def get_owned_amis(ec2_client):
     try:
         owned_amis = []
@@ -54,64 +80,172 @@ def get_owned_amis(ec2_client):
         return []
 
 
-def get_used_amis(ec2_client):
-    try:
-        used_amis = set()
-        paginator = ec2_client.get_paginator("describe_instances")
-        for page in paginator.paginate():
-            for reservation in page["Reservations"]:
-                for instance in reservation["Instances"]:
-                    if "ImageId" in instance:
-                        used_amis.add(instance["ImageId"])
-        logger.info(f"Used AMIs: {len(used_amis)} : {used_amis}")
-        return used_amis
-    except ClientError as e:
-        logger.error(f"Failed to retrieve used AMIs: {e}")
-        return set()
+def get_instance_references(ec2_client):
+    references = defaultdict(list)
+    paginator = ec2_client.get_paginator("describe_instances")
+    states = ["pending", "running", "shutting-down", "stopping", "stopped"]
+    for page in paginator.paginate(Filters=[{"Name": "instance-state-name", "Values": states}]):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                if "ImageId" in instance:
+                    references[instance["ImageId"]].append(f"instance {instance['InstanceId']}")
+    return references
 
 
-def delete_ami_and_snapshot(ec2_client, ami_id, dry_run=False):
-    try:
-        # Get snapshot IDs associated with the AMI
-        image = ec2_client.describe_images(ImageIds=[ami_id])["Images"][0]
-        snapshot_ids = [
-            block_device["Ebs"]["SnapshotId"]
-            for block_device in image.get("BlockDeviceMappings", [])
-            if "Ebs" in block_device
-        ]
+def get_launch_template_versions(ec2_client, launch_template):
+    """Return a dict of version ("1", "2", ..., "$Default" and "$Latest") to the AMI ID of one launch template."""
+    images = {}
+    paginator = ec2_client.get_paginator("describe_launch_template_versions")
+    for page in paginator.paginate(LaunchTemplateId=launch_template["LaunchTemplateId"]):
+        for version in page["LaunchTemplateVersions"]:
+            images[str(version["VersionNumber"])] = version["LaunchTemplateData"].get("ImageId")
+    images["$Default"] = images.get(str(launch_template["DefaultVersionNumber"]))
+    images["$Latest"] = images.get(str(launch_template["LatestVersionNumber"]))
+    return images
 
-        if not dry_run:
-            # Deregister the AMI
-            ec2_client.deregister_image(ImageId=ami_id)
-            logger.info(f"Deregistered AMI: {ami_id}")
 
-            # Delete associated snapshots
-            for snapshot_id in snapshot_ids:
-                ec2_client.delete_snapshot(SnapshotId=snapshot_id)
-                logger.info(f"Deleted snapshot: {snapshot_id}")
-        else:
-            logger.info(f"Would deregister AMI: {ami_id}")
-            for snapshot_id in snapshot_ids:
-                logger.info(f"Would delete snapshot: {snapshot_id}")
-        return True
-    except ClientError as e:
-        logger.error(f"Failed to delete AMI {ami_id} or its snapshots: {e}")
-        return False
+def get_launch_template_images(ec2_client):
+    """
+    Return a dict of (launch template ID, version) to AMI ID for every version of every launch template, and a
+    dict of launch template name to ID. The versions of the templates are fetched concurrently.
+    """
+    launch_templates = []
+    paginator = ec2_client.get_paginator("describe_launch_templates")
+    for page in paginator.paginate():
+        launch_templates.extend(page["LaunchTemplates"])
+
+    images = {}
+    with ThreadPoolExecutor(max_workers=REFERENCE_WORKERS) as executor:
+        futures = {
+            executor.submit(get_launch_template_versions, ec2_client, launch_template): launch_template
+            for launch_template in launch_templates
+        }
+        for future, launch_template in futures.items():
+            for version, image_id in future.result().items():
+                images[launch_template["LaunchTemplateId"], version] = image_id
+    template_ids = {template["LaunchTemplateName"]: template["LaunchTemplateId"] for template in launch_templates}
+    return images, template_ids
+
 
+def get_launch_configuration_images(autoscaling_client):
+    paginator = autoscaling_client.get_paginator("describe_launch_configurations")
+    return {
+        launch_configuration["LaunchConfigurationName"]: launch_configuration["ImageId"]
+        for page in paginator.paginate()
+        for launch_configuration in page["LaunchConfigurations"]
+    }
 
-def delete_unused_amis(ec2_client, unused_amis, dry_run=False):
+
+def get_auto_scaling_groups(autoscaling_client):
+    paginator = autoscaling_client.get_paginator("describe_auto_scaling_groups")
+    return [group for page in paginator.paginate() for group in page["AutoScalingGroups"]]
+
+
+def get_group_launch_templates(group):
+    """Yield every launch template specification of an Auto Scaling group, including mixed instances overrides."""
+    if "LaunchTemplate" in group:
+        yield group["LaunchTemplate"]
+    policy_template = group.get("MixedInstancesPolicy", {}).get("LaunchTemplate", {})
+    if "LaunchTemplateSpecification" in policy_template:
+        yield policy_template["LaunchTemplateSpecification"]
+    for override in policy_template.get("Overrides", []):
+        if "LaunchTemplateSpecification" in override:
+            yield override["LaunchTemplateSpecification"]
+
+
+def build_reference_index(ec2_client, autoscaling_client):
+    """
+    Return a dict of AMI ID to the list of things that use it: instances, launch template versions, launch
+    configurations and Auto Scaling groups. The four inventories are fetched concurrently. Errors are raised, a
+    partial index would make used AMIs look unused.
+    """
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        instances = executor.submit(get_instance_references, ec2_client)
+        launch_templates = executor.submit(get_launch_template_images, ec2_client)
+        launch_configurations = executor.submit(get_launch_configuration_images, autoscaling_client)
+        auto_scaling_groups = executor.submit(get_auto_scaling_groups, autoscaling_client)
+
+        references = instances.result()
+        launch_template_images, template_ids = launch_templates.result()
+        launch_configuration_images = launch_configurations.result()
+        groups = auto_scaling_groups.result()
+
+    version_count = 0
+    for (template_id, version), image_id in launch_template_images.items():
+        # $Default and $Latest are aliases of numbered versions, only used to resolve Auto Scaling groups
+        if not version.startswith("$"):
+            version_count += 1
+            if image_id:
+                references[image_id].append(f"launch template {template_id} version {version}")
+    for name, image_id in launch_configuration_images.items():
+        references[image_id].append(f"launch configuration {name}")
+    for group in groups:
+        group_name = group["AutoScalingGroupName"]
+        if "LaunchConfigurationName" in group:
+            image_id = launch_configuration_images.get(group["LaunchConfigurationName"])
+            if image_id:
+                references[image_id].append(f"auto scaling group {group_name}")
+        for specification in get_group_launch_templates(group):
+            template_id = specification.get("LaunchTemplateId") or template_ids.get(
+                specification.get("LaunchTemplateName")
+            )
+            image_id = launch_template_images.get((template_id, specification.get("Version", "$Default")))
+            if image_id:
+                references[image_id].append(f"auto scaling group {group_name}")
+
+    logger.info(
+        f"Used AMIs: {len(references)}, from instances, {version_count} launch template versions, "
+        f"{len(launch_configuration_images)} launch configurations and {len(groups)} Auto Scaling groups"
+    )
+    return references
+
+
+def delete_ami_and_snapshot(executor, image):
+    # The snapshot IDs come from the cached describe_images record of get_owned_amis
+    ami_id = image["ImageId"]
+    snapshot_ids = [
+        block_device["Ebs"]["SnapshotId"]
+        for block_device in image.get("BlockDeviceMappings", [])
+        if "SnapshotId" in block_device.get("Ebs", {})
+    ]
+
+    # Deregister the AMI before deleting its snapshots, EC2 refuses to delete snapshots of registered AMIs
+    # An AMI that is already deregistered still gets its snapshots deleted
+    executor.call("deregister_image", already_deleted_code="InvalidAMIID.NotFound", ImageId=ami_id)
+    logger.info(f"Deregistered AMI: {ami_id}")
+    for snapshot_id in snapshot_ids:
+        executor.call("delete_snapshot", already_deleted_code="InvalidSnapshot.NotFound", SnapshotId=snapshot_id)
+        logger.info(f"Deleted snapshot: {snapshot_id}")
+
+
+def delete_unused_amis(executor, unused_amis):
     deleted_count = 0
-    for ami in unused_amis:
-        if delete_ami_and_snapshot(ec2_client, ami["ImageId"], dry_run):
+    images = {ami["ImageId"]: ami for ami in unused_amis}
+    for result in executor.run(lambda ami_id: delete_ami_and_snapshot(executor, images[ami_id]), images):
+        if result.error_code:
+            logger.error(
+                f"Failed to delete AMI {result.resource_id} or its snapshots: {result.error_code}: "
+                f"{result.error_message}"
+            )
+        else:
             deleted_count += 1
+    logger.info(f"Delete calls: {executor.summary()}")
     return deleted_count
 
 
-def main(dry_run=False, retention_days=None):
+def main(dry_run=False, retention_days=None, delete_workers=DEFAULT_DELETE_WORKERS, rate=MUTATING_REFILL_RATE):
     ec2_client = get_ec2_client()
+    autoscaling_client = get_autoscaling_client()
 
-    owned_amis = get_owned_amis(ec2_client)
-    used_amis = get_used_amis(ec2_client)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        owned_amis_future = executor.submit(get_owned_amis, ec2_client)
+        used_amis_future = executor.submit(build_reference_index, ec2_client, autoscaling_client)
+        owned_amis = owned_amis_future.result()
+        try:
+            used_amis = used_amis_future.result()
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Failed to build the AMI reference index, not deleting any AMIs: {e}")
+            return
 
     # Find unused AMIs
     unused_amis = [ami for ami in owned_amis if ami["ImageId"] not in used_amis]
@@ -134,7 +268,8 @@ def main(dry_run=False, retention_days=None):
     if dry_run:
         logger.info(f"Dry run: Would delete {len(unused_amis)} unused AMI(s) and their associated snapshots.")
     else:
-        deleted_count = delete_unused_amis(ec2_client, unused_amis, dry_run)
+        executor = DeleteExecutor(max_workers=delete_workers, rate=rate)
+        deleted_count = delete_unused_amis(executor, unused_amis)
         logger.info(f"Deleted {deleted_count} unused AMI(s) and their associated snapshots.")
 
     # Summary
@@ -150,6 +285,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Delete unused EC2 AMIs")
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without actually deleting AMIs")
     parser.add_argument("--retention-days", type=int, help="Number of days to retain AMIs before deletion")
+    add_delete_executor_arguments(parser)
     args = parser.parse_args()
 
-    main(dry_run=args.dry_run, retention_days=args.retention_days)
+    main(
+        dry_run=args.dry_run,
+        retention_days=args.retention_days,
+        delete_workers=args.delete_workers,
+        rate=args.rate,
+    )
@@ -2,26 +2,26 @@
 #
 #  License: MIT
 #
-# This script finds and deletes all unused Elastic IPs in all AWS Regions
+# This script finds and deletes all unused Elastic IPs in all AWS Regions. The regions are swept concurrently
+# with one shared session, regions that aren't enabled are reported separately from real failures.
 
-import boto3
+from ec2_region_runner import RegionRunner, print_region_results
 
-ec2 = boto3.resource("ec2")
 
-unused_ips = {}
+def release_unused_eips(ec2conn):
+    region_name = ec2conn.meta.region_name
+    addresses = ec2conn.describe_addresses(Filters=[{"Name": "domain", "Values": ["vpc"]}])["Addresses"]
+    for address in addresses:
+        if "AssociationId" not in address:
+            ec2conn.release_address(AllocationId=address["AllocationId"])
+            print(f"Deleted unused Elastic IP {address['PublicIp']} in region {region_name}")
+            # Yielded right away, so the releases before a failure in this region are still reported
+            yield address["AllocationId"]
 
-for region in ec2.meta.client.describe_regions()["Regions"]:
-    region_name = region["RegionName"]
-    try:
-        ec2conn = boto3.client("ec2", region_name=region_name)
-        addresses = ec2conn.describe_addresses(Filters=[{"Name": "domain", "Values": ["vpc"]}])["Addresses"]
-        for address in addresses:
-            if "AssociationId" not in address and address["AllocationId"] not in unused_ips:
-                unused_ips[address["AllocationId"]] = region_name
-                ec2conn.release_address(AllocationId=address["AllocationId"])
-                print(f"Deleted unused Elastic IP {address['PublicIp']} in region {region_name}")
-    except Exception as e:
-        print(f"No access to region {region_name}: {e}")
 
-print(f"Found and deleted {len(unused_ips)} unused Elastic IPs across all regions:")
+results = RegionRunner().run(release_unused_eips)
+print_region_results(results)
+
+unused_ips = {result.region: result.result for result in results if result.result}
+print(f"Found and deleted {sum(map(len, unused_ips.values()))} unused Elastic IPs across all regions:")
 print(unused_ips)
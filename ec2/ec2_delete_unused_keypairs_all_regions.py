@@ -2,29 +2,32 @@
 #
 #  License: MIT
 #
-# This script finds and deletes all unused EC2 keypairs in all AWS Regions
+# This script finds and deletes all unused EC2 keypairs in all AWS Regions. The regions are swept concurrently
+# with one shared session, regions that aren't enabled are reported separately from real failures.
 
-import boto3
+from ec2_region_runner import RegionRunner, print_region_results
 
-ec2 = boto3.resource("ec2")
 
-unused_keys = {}
+def delete_unused_key_pairs(ec2conn):
+    region_name = ec2conn.meta.region_name
+    used_keys = set()
+    paginator = ec2conn.get_paginator("describe_instances")
+    for page in paginator.paginate():
+        for reservation in page["Reservations"]:
+            used_keys.update(instance["KeyName"] for instance in reservation["Instances"] if "KeyName" in instance)
 
-for region in ec2.meta.client.describe_regions()["Regions"]:
-    region_name = region["RegionName"]
-    try:
-        ec2conn = boto3.resource("ec2", region_name=region_name)
-        key_pairs = ec2conn.key_pairs.all()
-        used_keys = set([instance.key_name for instance in ec2conn.instances.all()])
-        for key_pair in key_pairs:
-            if key_pair.name not in used_keys:
-                unused_keys[key_pair.name] = region_name
-                key_pair.delete()
-                print(
-                    f"Deleted unused key pair {key_pair.name} in region {region_name}"
-                )
-    except Exception as e:
-        print(f"No access to region {region_name}: {e}")
+    for key_pair in ec2conn.describe_key_pairs()["KeyPairs"]:
+        if key_pair["KeyName"] not in used_keys:
+            ec2conn.delete_key_pair(KeyName=key_pair["KeyName"])
+            print(f"Deleted unused key pair {key_pair['KeyName']} in region {region_name}")
+            # Yielded right away, so the deletes before a failure in this region are still reported
+            yield key_pair["KeyName"]
 
-print(f"Found and deleted {len(unused_keys)} unused key pairs across all regions:")
+
+results = RegionRunner().run(delete_unused_key_pairs)
+print_region_results(results)
+
+# Key pair names are only unique per region
+unused_keys = {result.region: result.result for result in results if result.result}
+print(f"Found and deleted {sum(map(len, unused_keys.values()))} unused key pairs across all regions:")
 print(unused_keys)
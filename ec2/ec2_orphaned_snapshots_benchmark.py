@@ -0,0 +1,164 @@
+"""
+Description: This script benchmarks the orphaned snapshot detection of ec2_delete_orphaned_snapshots.py against
+the previous approach of one describe_volumes call per snapshot. It runs against a stubbed EC2 client with a
+synthetic inventory and a simulated per-call latency, so no AWS account is needed.
+
+Key features:
+- Synthetic snapshots, volumes and AMIs, with a configurable share of deleted volumes
+- Counts the API calls of both approaches per operation
+- Verifies both approaches find the same orphaned snapshots and reports the speedup
+
+Usage:
+python ec2_orphaned_snapshots_benchmark.py [--snapshots N] [--orphaned-ratio RATIO] [--latency MS]
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import argparse
+import logging
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+import ec2_delete_orphaned_snapshots
+from ec2_delete_orphaned_snapshots import find_orphaned_snapshots, get_inventories
+
+# Default page sizes of the EC2 describe APIs
+PAGE_SIZES = {"describe_snapshots": 1000, "describe_images": 1000, "describe_volumes": 500}
+
+
+def setup_logging():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    return logging.getLogger(__name__)
+
+
+class StubPaginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get("PageSize") or PAGE_SIZES[self.operation]
+        result_key, items = self.client.inventory[self.operation]
+        for start in range(0, max(len(items), 1), page_size):
+            self.client.record(self.operation)
+            yield {result_key: items[start : start + page_size]}
+
+
+class StubEC2Client:
+    """Answers the describe calls of the orphaned snapshot detection from a synthetic inventory."""
+
+    def __init__(self, snapshot_count, orphaned_ratio, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+        live_count = int(snapshot_count * (1 - orphaned_ratio))
+        snapshots = [
+            {"SnapshotId": f"snap-{i:017x}", "VolumeId": f"vol-{i:017x}", "StartTime": None}
+            for i in range(snapshot_count)
+        ]
+        volumes = [{"VolumeId": f"vol-{i:017x}"} for i in range(live_count)]
+        # Every tenth snapshot of a deleted volume still backs an AMI
+        images = [
+            {"ImageId": f"ami-{i:017x}", "BlockDeviceMappings": [{"Ebs": {"SnapshotId": f"snap-{i:017x}"}}]}
+            for i in range(live_count, snapshot_count, 10)
+        ]
+        self.volume_ids = {volume["VolumeId"] for volume in volumes}
+        self.inventory = {
+            "describe_snapshots": ("Snapshots", snapshots),
+            "describe_images": ("Images", images),
+            "describe_volumes": ("Volumes", volumes),
+        }
+
+    def record(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+        time.sleep(self.latency)
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+    def describe_volumes(self, VolumeIds):
+        self.record("describe_volumes")
+        if VolumeIds[0] not in self.volume_ids:
+            raise ClientError({"Error": {"Code": "InvalidVolume.NotFound"}}, "DescribeVolumes")
+        return {"Volumes": [{"VolumeId": VolumeIds[0]}]}
+
+
+def is_volume_exists(ec2_client, volume_id):
+    """The previous per-snapshot volume check."""
+    try:
+        ec2_client.describe_volumes(VolumeIds=[volume_id])
+        return True
+    except ClientError as e:
+        return e.response["Error"]["Code"] != "InvalidVolume.NotFound"
+
+
+def find_orphaned_per_snapshot(ec2_client):
+    owned_snapshots = ec2_delete_orphaned_snapshots.get_owned_snapshots(ec2_client)
+    snapshots_used_by_amis = ec2_delete_orphaned_snapshots.get_snapshots_used_by_amis(ec2_client)
+    return [
+        snapshot
+        for snapshot in owned_snapshots
+        if not is_volume_exists(ec2_client, snapshot["VolumeId"])
+        and snapshot["SnapshotId"] not in snapshots_used_by_amis
+    ]
+
+
+def find_orphaned_bulk(ec2_client):
+    return find_orphaned_snapshots(*get_inventories(ec2_client))
+
+
+def run_benchmark(name, find_orphaned, ec2_client):
+    start_time = time.monotonic()
+    snapshot_ids = {snapshot["SnapshotId"] for snapshot in find_orphaned(ec2_client)}
+    elapsed = time.monotonic() - start_time
+    calls = ", ".join(f"{operation}: {count}" for operation, count in sorted(ec2_client.calls.items()))
+    logger.info(
+        f"{name}: {len(snapshot_ids)} orphaned snapshots in {elapsed:.2f}s, "
+        f"{sum(ec2_client.calls.values())} API calls ({calls})"
+    )
+    return snapshot_ids, elapsed
+
+
+def main(snapshot_count=60000, orphaned_ratio=0.2, latency=0.002):
+    # The detection functions log at INFO, keep the benchmark output readable
+    logging.getLogger(ec2_delete_orphaned_snapshots.__name__).setLevel(logging.WARNING)
+
+    per_snapshot_ids, per_snapshot_elapsed = run_benchmark(
+        "Per-snapshot lookup",
+        find_orphaned_per_snapshot,
+        StubEC2Client(snapshot_count, orphaned_ratio, latency),
+    )
+    bulk_ids, bulk_elapsed = run_benchmark(
+        "Bulk volume sweep", find_orphaned_bulk, StubEC2Client(snapshot_count, orphaned_ratio, latency)
+    )
+
+    if per_snapshot_ids != bulk_ids:
+        logger.error(
+            f"Results differ: {len(per_snapshot_ids - bulk_ids)} snapshots missing, "
+            f"{len(bulk_ids - per_snapshot_ids)} unexpected snapshots in the bulk sweep"
+        )
+    else:
+        logger.info(f"Speedup: {per_snapshot_elapsed / max(bulk_elapsed, 1e-6):.1f}x")
+
+
+if __name__ == "__main__":
+    logger = setup_logging()
+
+    parser = argparse.ArgumentParser(description="Benchmark bulk against per-snapshot orphaned snapshot detection")
+    parser.add_argument("--snapshots", type=int, default=60000, help="Number of synthetic snapshots (default: 60000)")
+    parser.add_argument(
+        "--orphaned-ratio",
+        type=float,
+        default=0.2,
+        help="Share of snapshots whose volume no longer exists (default: 0.2)",
+    )
+    parser.add_argument("--latency", type=float, default=2, help="Simulated latency per API call in ms (default: 2)")
+    args = parser.parse_args()
+
+    main(args.snapshots, args.orphaned_ratio, args.latency / 1000)
@@ -0,0 +1,117 @@
+"""
+Description: Shared region fan-out for the all-regions EC2 scripts in this folder. Instead of walking the regions
+one at a time, an operation is run in every region concurrently, so a sweep takes about as long as the slowest
+region. One session is shared by all regions and one client is built per region. Regions that are not enabled
+for the account (opt-in regions that were never opted into, according to describe_regions) are reported as
+skipped instead of being mixed up with real failures.
+
+Key features:
+- Runs in every enabled region, or a given list of regions, concurrently
+- One session, clients are created once per region and reused
+- Skips regions that aren't opted into, based on the OptInStatus of describe_regions
+- One RegionResult per region with its status (ok, skipped or failed), result and error, a failing region
+  never affects the others
+- Operations that yield their results (e.g. every deleted resource) keep what they yielded before a failure
+
+Usage (from another script in this folder):
+    from ec2_region_runner import RegionRunner, print_region_results
+
+    results = RegionRunner().run(release_unused_eips)
+    for result in results:
+        print(result.region, result.status, result.result, result.error)
+    print_region_results(results)
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import threading
+import types
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_REGION_WORKERS = 32
+CLIENT_WORKERS = 10  # Connection pool size of each region client
+STATUS_OK = "ok"
+STATUS_SKIPPED = "skipped"
+STATUS_FAILED = "failed"
+
+RegionResult = namedtuple("RegionResult", ["region", "status", "result", "error"])
+
+
+class RegionRunner:
+    """Runs an operation in every region concurrently, with one shared session."""
+
+    def __init__(self, session=None, regions=None, service_name="ec2", max_workers=DEFAULT_REGION_WORKERS):
+        self.session = session or boto3.Session()
+        self.service_name = service_name
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.regions, self.skipped_regions = self._resolve_regions(regions)
+
+    def _resolve_regions(self, regions):
+        """Return the regions to run in and the regions to skip because they aren't opted into."""
+        ec2_client = self.session.client("ec2")
+        all_regions = ec2_client.describe_regions(AllRegions=True)["Regions"]
+        enabled = {region["RegionName"] for region in all_regions if region.get("OptInStatus") != "not-opted-in"}
+        regions = regions or sorted(region["RegionName"] for region in all_regions)
+        skipped = [region for region in regions if region not in enabled]
+        return [region for region in regions if region in enabled], skipped
+
+    def client_for(self, region, service_name=None):
+        """Return the client of a region (for the runner's service by default), created on first use."""
+        service_name = service_name or self.service_name
+        with self.lock:
+            # Creating clients from one session isn't thread-safe, using them is
+            if (service_name, region) not in self.clients:
+                config = Config(max_pool_connections=CLIENT_WORKERS, retries={"max_attempts": 10, "mode": "adaptive"})
+                self.clients[service_name, region] = self.session.client(
+                    service_name, region_name=region, config=config
+                )
+            return self.clients[service_name, region]
+
+    def _run_region(self, operation, region, args, kwargs):
+        partial = None
+        try:
+            result = operation(self.client_for(region), *args, **kwargs)
+            if isinstance(result, types.GeneratorType):
+                # Collected one item at a time, so the items yielded before a failure are kept
+                partial = []
+                for item in result:
+                    partial.append(item)
+                result = partial
+            return RegionResult(region, STATUS_OK, result, None)
+        except Exception as e:
+            # Whether a region is enabled comes from describe_regions only, every error here is a real failure
+            return RegionResult(region, STATUS_FAILED, partial, f"{type(e).__name__}: {e}")
+
+    def run(self, operation, *args, **kwargs):
+        """
+        Call operation(client, *args, **kwargs) in every region and return a list of RegionResult sorted by
+        region, including the skipped regions. When the operation is a generator its result is the list of
+        yielded items, a failed region then still has the items yielded before the failure. Other failed
+        regions have no result, so operations that delete as they go should yield every deletion.
+        """
+        results = [
+            RegionResult(region, STATUS_SKIPPED, None, "Region is not opted into") for region in self.skipped_regions
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._run_region, operation, region, args, kwargs) for region in self.regions]
+            results.extend(future.result() for future in futures)
+        return sorted(results, key=lambda result: result.region)
+
+
+def print_region_results(results):
+    """Print the regions that were skipped or failed."""
+    skipped = [result.region for result in results if result.status == STATUS_SKIPPED]
+    failed = [result for result in results if result.status == STATUS_FAILED]
+    if skipped:
+        print(f"Skipped {len(skipped)} region(s) that are not enabled: {', '.join(skipped)}")
+    if failed:
+        print(f"Failed in {len(failed)} region(s):")
+        for result in failed:
+            print(f"  {result.region}: {result.error}")
@@ -0,0 +1,186 @@
+"""
+Description: Shared bucket size estimation for the S3 scripts in this folder. It supports two sources:
+the daily BucketSizeBytes / NumberOfObjects CloudWatch storage metrics (a couple of API calls, regardless of
+bucket size) and an exact mode that lists the bucket with the sharded parallel listing engine. Results are
+cached per bucket on disk with a TTL, so repeated runs don't pay for them again.
+
+Key features:
+- CloudWatch source sums BucketSizeBytes over every storage type reported for the bucket, which always
+  includes noncurrent versions
+- Exact source optionally includes noncurrent versions
+- Reports an unknown size instead of listing the whole bucket when CloudWatch has no datapoints yet
+- JSON cache in ~/.cache/aws-toolbox with a configurable TTL
+
+Usage (from another script in this folder):
+    from s3_bucket_size import get_bucket_size
+
+    size_bytes, object_count = get_bucket_size(s3_client, "my-bucket", source="cloudwatch")
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_listing import list_object_versions, list_objects
+
+SIZE_SOURCES = ["cloudwatch", "exact"]
+DEFAULT_CACHE_TTL = 3600  # Seconds, the CloudWatch storage metrics are only updated once a day anyway
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "aws-toolbox", "s3-bucket-size.json")
+
+logger = logging.getLogger(__name__)
+
+
+def _load_cache():
+    try:
+        with open(CACHE_PATH) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        tmp_path = f"{CACHE_PATH}.tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"Failed to write bucket size cache {CACHE_PATH}: {e}")
+
+
+def get_bucket_region(s3_client, bucket_name):
+    location = s3_client.get_bucket_location(Bucket=bucket_name).get("LocationConstraint")
+    # Buckets in us-east-1 have no location constraint, very old EU buckets report "EU"
+    return {None: "us-east-1", "": "us-east-1", "EU": "eu-west-1"}.get(location, location)
+
+
+def get_bucket_size_from_cloudwatch(s3_client, bucket_name):
+    """
+    Return (size_bytes, object_count) from the daily S3 storage metrics, or None when there are no datapoints.
+
+    BucketSizeBytes includes noncurrent versions, NumberOfObjects counts every version and delete marker.
+    """
+    cloudwatch = boto3.client("cloudwatch", region_name=get_bucket_region(s3_client, bucket_name))
+
+    storage_types = set()
+    paginator = cloudwatch.get_paginator("list_metrics")
+    for page in paginator.paginate(
+        Namespace="AWS/S3", MetricName="BucketSizeBytes", Dimensions=[{"Name": "BucketName", "Value": bucket_name}]
+    ):
+        for metric in page["Metrics"]:
+            for dimension in metric["Dimensions"]:
+                if dimension["Name"] == "StorageType":
+                    storage_types.add(dimension["Value"])
+
+    queries = [
+        {
+            "Id": f"size{index}",
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "AWS/S3",
+                    "MetricName": "BucketSizeBytes",
+                    "Dimensions": [
+                        {"Name": "BucketName", "Value": bucket_name},
+                        {"Name": "StorageType", "Value": storage_type},
+                    ],
+                },
+                "Period": 86400,
+                "Stat": "Average",
+            },
+        }
+        for index, storage_type in enumerate(sorted(storage_types))
+    ]
+    queries.append(
+        {
+            "Id": "objects",
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "AWS/S3",
+                    "MetricName": "NumberOfObjects",
+                    "Dimensions": [
+                        {"Name": "BucketName", "Value": bucket_name},
+                        {"Name": "StorageType", "Value": "AllStorageTypes"},
+                    ],
+                },
+                "Period": 86400,
+                "Stat": "Average",
+            },
+        }
+    )
+
+    end_time = datetime.now(timezone.utc)
+    response = cloudwatch.get_metric_data(
+        MetricDataQueries=queries,
+        StartTime=end_time - timedelta(days=3),
+        EndTime=end_time,
+        ScanBy="TimestampDescending",
+    )
+
+    # Only use the newest datapoint of each metric
+    latest = {result["Id"]: result["Values"][0] for result in response["MetricDataResults"] if result["Values"]}
+    if "objects" not in latest:
+        return None
+
+    object_count = int(latest.pop("objects"))
+    return int(sum(latest.values())), object_count
+
+
+def get_bucket_size_exact(s3_client, bucket_name, include_versions=False):
+    """Return (size_bytes, object_count) by listing the whole bucket with the sharded listing engine."""
+    size_bytes = 0
+    object_count = 0
+    if include_versions:
+        listing = (version for version in list_object_versions(s3_client, bucket_name) if "Size" in version)
+    else:
+        listing = list_objects(s3_client, bucket_name)
+
+    for obj in listing:
+        size_bytes += obj["Size"]
+        object_count += 1
+    return size_bytes, object_count
+
+
+def get_bucket_size(s3_client, bucket_name, source="cloudwatch", include_versions=False, cache_ttl=DEFAULT_CACHE_TTL):
+    """
+    Return (size_bytes, object_count) for a bucket, using the cache when it is younger than cache_ttl seconds.
+
+    include_versions only applies to the exact source, the CloudWatch BucketSizeBytes metric always includes
+    noncurrent versions. Returns None when the size can't be determined, e.g. when CloudWatch has no
+    datapoints for the bucket yet. The bucket isn't listed in full then, since that can take long for large
+    buckets, use the exact source for that.
+    """
+    if source == "cloudwatch":
+        cache_key = f"{bucket_name}:cloudwatch"
+    else:
+        cache_key = f"{bucket_name}:{source}:{'versions' if include_versions else 'current'}"
+    cache = _load_cache()
+    cached = cache.get(cache_key)
+    if cached and time.time() - cached["timestamp"] < cache_ttl:
+        logger.info(f"Using cached bucket size for {bucket_name} ({int(time.time() - cached['timestamp'])}s old)")
+        return cached["size_bytes"], cached["object_count"]
+
+    try:
+        if source == "cloudwatch":
+            result = get_bucket_size_from_cloudwatch(s3_client, bucket_name)
+            if result is None:
+                logger.info(f"No CloudWatch storage metrics for {bucket_name} yet, use the exact source instead")
+                return None
+        else:
+            result = get_bucket_size_exact(s3_client, bucket_name, include_versions)
+    except (ClientError, BotoCoreError) as e:
+        logger.error(f"Failed to get bucket size for {bucket_name}: {e}")
+        return None
+
+    size_bytes, object_count = result
+    cache[cache_key] = {"size_bytes": size_bytes, "object_count": object_count, "timestamp": time.time()}
+    _save_cache(cache)
+    return size_bytes, object_count
@@ -2,38 +2,235 @@
 #
 # This script allows you to create tar file creation.
 #
+# The archive is streamed: object bodies are read with get_object and piped straight into a tarfile stream,
+# which is uploaded as a multipart upload with a bounded number of part buffers in memory. Nothing is written
+# to /tmp, so the archive size isn't capped by Lambda's ephemeral storage. Small upcoming objects are fetched
+# concurrently while the current one is written, larger ones are only opened when they are written so no
+# connection sits idle. The archive can optionally be compressed with gzip or zstd (requires the zstandard
+# package).
+#
+# The handler reads its settings from the event, all keys are optional:
+#   {"bucket": "...", "prefix": "", "suffix": ".js", "target_key": "example.tar", "compression": "gz"}
+#
 # Reference question : https://stackoverflow.com/questions/64341192/how-to-create-a-tar-file-containing-all-the-files-in-a-directory/64341789#64341789
 
 import boto3
 import tarfile
-import os.path
+import threading
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PART_SIZE = 16 * 1024 * 1024  # Multipart upload part size, at least 5 MB
+MAX_PARTS_IN_FLIGHT = 4  # Part buffers held in memory while they upload
+PREFETCH_DEPTH = 8  # Number of upcoming objects fetched ahead of the tar writer
+PREFETCH_MAX_BYTES = 8 * 1024 * 1024  # Objects up to this size are prefetched into memory, larger ones stream
+COMPRESSION_EXTENSIONS = {"none": "", "gz": ".gz", "zst": ".zst"}
+
+# One connection per prefetch and part upload, plus one for the large object that is being written
+s3Client = boto3.client("s3", config=Config(max_pool_connections=PREFETCH_DEPTH + MAX_PARTS_IN_FLIGHT + 1))
+
+
+class MultipartUploadWriter:
+    """Write-only file object that uploads everything written to it as an S3 multipart upload."""
+
+    def __init__(self, client, bucket, key, part_size=PART_SIZE, max_in_flight=MAX_PARTS_IN_FLIGHT):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self.buffer = bytearray()
+        self.part_number = 0
+        self.futures = []
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, body):
+        # Fail fast instead of streaming the rest of the archive when a part upload already failed
+        for future in self.futures:
+            if future.done() and future.exception():
+                raise future.exception()
+
+        # Blocks the writer while MAX_PARTS_IN_FLIGHT parts are uploading, which bounds memory usage
+        self.slots.acquire()
+        self.part_number += 1
+        part_number = self.part_number
+
+        def upload():
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body
+                )
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            finally:
+                self.slots.release()
+
+        self.futures.append(self.executor.submit(upload))
+
+    def complete(self):
+        if self.buffer or not self.futures:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        parts = [future.result() for future in self.futures]
+        self.executor.shutdown()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts}
+        )
+
+    def abort(self):
+        self.executor.shutdown()
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def fetch_object(bucket, obj):
+    """
+    Fetch a listed object, small objects are read into memory right away so the tar writer never waits on them.
+    Larger objects only get a head_object here and are opened when they are written, an open body waiting in
+    the prefetch queue could hit the S3 idle timeout.
+    """
+    key = obj["Key"]
+    if obj["Size"] <= PREFETCH_MAX_BYTES:
+        response = s3Client.get_object(Bucket=bucket, Key=key)
+        body = BytesReader(response["Body"].read())
+    else:
+        response = s3Client.head_object(Bucket=bucket, Key=key)
+        body = LazyObjectReader(bucket, key, response["ETag"])
+    return key, response["ContentLength"], response["LastModified"], body
+
+
+class BytesReader:
+    """Minimal file object over prefetched bytes, tarfile only needs read()."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size is None or size < 0 else self.offset + size
+        chunk = self.data[self.offset : end].tobytes()
+        self.offset += len(chunk)
+        return chunk
 
-s3Client = boto3.client("s3")
-s3object = boto3.resource("s3")
+    def close(self):
+        self.data.release()
+
+
+class LazyObjectReader:
+    """File object that only opens the object on the first read, IfMatch makes sure it's the same version."""
+
+    def __init__(self, bucket, key, etag):
+        self.bucket = bucket
+        self.key = key
+        self.etag = etag
+        self.body = None
+
+    def read(self, size=-1):
+        if self.body is None:
+            self.body = s3Client.get_object(Bucket=self.bucket, Key=self.key, IfMatch=self.etag)["Body"]
+        return self.body.read(None if size is None or size < 0 else size)
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+
+
+def prefetch_objects(bucket, objects, depth=PREFETCH_DEPTH):
+    """Yield fetched objects in order, keeping up to depth fetches running ahead."""
+    pending = []
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        for obj in objects:
+            pending.append(executor.submit(fetch_object, bucket, obj))
+            if len(pending) > depth:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def create_tar_stream(bucket, objects, target_bucket, target_key, compression="none"):
+    """
+    Stream the given objects (list_objects_v2 entries with a Key and Size) into a tar archive uploaded to
+    s3://target_bucket/target_key.
+    """
+    if compression == "zst" and zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package: pip install zstandard")
+
+    writer = MultipartUploadWriter(s3Client, target_bucket, target_key)
+    try:
+        if compression == "zst":
+            output = zstandard.ZstdCompressor().stream_writer(writer, closefd=False)
+            tar = tarfile.open(fileobj=output, mode="w|")
+        else:
+            output = None
+            tar = tarfile.open(fileobj=writer, mode="w|gz" if compression == "gz" else "w|")
+
+        count = 0
+        with tar:
+            for key, size, last_modified, body in prefetch_objects(bucket, objects):
+                print(key)
+                info = tarfile.TarInfo(name=key)
+                info.size = size
+                info.mtime = last_modified.timestamp()
+                tar.addfile(info, fileobj=body)
+                body.close()
+                count += 1
+
+        if output is not None:
+            output.close()
+        writer.complete()
+    except BaseException:
+        writer.abort()
+        raise
+
+    return count
 
 
 def lambda_handler(event, context):
-    agtBucket = "angularbuildbucket"
-    key = ""
-    tar = tarfile.open("/tmp/example.tar", "w")
-    source_dir = "/tmp/"
-    for fname in get_matching_s3_keys(bucket=agtBucket, prefix=key, suffix=".js"):
-        print(fname)
-        # file_obj = s3object.Object(agtBucket, fname)
-        # file_content = file_obj.get()['Body'].read()
-        # tar.add(file_content)
-        s3object.Bucket(agtBucket).download_file(fname, "/tmp/" + fname)
-        tar.add(source_dir, arcname=os.path.basename(source_dir))
-    tar.close()
-    s3object.meta.client.upload_file(
-        source_dir + "example.tar", agtBucket, "example.tar"
-    )
+    agtBucket = event.get("bucket", "angularbuildbucket")
+    key = event.get("prefix", "")
+    suffix = event.get("suffix", ".js")
+    compression = event.get("compression", "none")
+    if compression not in COMPRESSION_EXTENSIONS:
+        supported = ", ".join(COMPRESSION_EXTENSIONS)
+        return {"statusCode": 400, "body": f"Unsupported compression {compression!r}, use one of: {supported}"}
+    target_key = event.get("target_key", "example.tar" + COMPRESSION_EXTENSIONS[compression])
+
+    objects = get_matching_s3_objects(bucket=agtBucket, prefix=key, suffix=suffix)
+    count = create_tar_stream(agtBucket, objects, agtBucket, target_key, compression)
+    print(f"Archived {count} objects to s3://{agtBucket}/{target_key}")
+    return {"statusCode": 200, "body": f"Archived {count} objects to s3://{agtBucket}/{target_key}"}
 
 
 def get_matching_s3_keys(bucket, prefix="", suffix=""):
     """
     Generate the keys in an S3 bucket.
 
+    :param bucket: Name of the S3 bucket.
+    :param prefix: Only fetch keys that start with this prefix (optional).
+    :param suffix: Only fetch keys that end with this suffix (optional).
+    """
+    for obj in get_matching_s3_objects(bucket, prefix, suffix):
+        yield obj["Key"]
+
+
+def get_matching_s3_objects(bucket, prefix="", suffix=""):
+    """
+    Generate the list_objects_v2 entries in an S3 bucket, their size decides how they are fetched.
+
     :param bucket: Name of the S3 bucket.
     :param prefix: Only fetch keys that start with this prefix (optional).
     :param suffix: Only fetch keys that end with this suffix (optional).
@@ -41,10 +238,9 @@ def get_matching_s3_keys(bucket, prefix="", suffix=""):
     kwargs = {"Bucket": bucket, "Prefix": prefix}
     while True:
         resp = s3Client.list_objects_v2(**kwargs)
-        for obj in resp["Contents"]:
-            key = obj["Key"]
-            if key.endswith(suffix):
-                yield key
+        for obj in resp.get("Contents", []):
+            if obj["Key"].endswith(suffix):
+                yield obj
 
         try:
             kwargs["ContinuationToken"] = resp["NextContinuationToken"]
@@ -1,6 +1,13 @@
 """
-This script searches for empty S3 buckets without versioning enabled and optionally deletes them.
-It includes a dry run mode for safe testing.
+This script searches for empty S3 buckets and optionally deletes them. A versioned bucket counts as empty when it
+holds no object versions and no delete markers.
+It includes a dry run mode for safe testing. Buckets can optionally be checked against their S3 Inventory report
+instead of a live listing. An inventory is a snapshot, S3 still refuses to delete a bucket that isn't empty.
+
+Buckets are triaged concurrently: they're first grouped by region (get_bucket_location), then checked through
+one region-pinned client per region so no request pays for a cross-region redirect. The script also finds
+buckets with versioning enabled that only have delete markers left. Those are reported separately and only
+deleted (delete markers first) with --include-versioned.
 
 Author: Danny Steenman
 Original source: https://github.com/dannysteenman/aws-toolbox
@@ -9,75 +16,208 @@ License: MIT
 
 import argparse
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_bucket_size import get_bucket_region
+from s3_inventory import list_inventory_objects
+
+DEFAULT_CONCURRENCY = 32
+EMPTY = "empty"
+DELETE_MARKERS_ONLY = "delete-markers-only"
 
 
 def parse_arguments():
     """Parse command line arguments."""
-    parser = argparse.ArgumentParser(description="Delete empty S3 buckets without versioning.")
+    parser = argparse.ArgumentParser(description="Delete empty S3 buckets.")
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without deleting buckets")
+    parser.add_argument(
+        "--inventory",
+        action="append",
+        default=[],
+        metavar="BUCKET=MANIFEST",
+        help="Check a bucket for objects in its S3 Inventory manifest.json instead of listing it (repeatable)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Maximum number of buckets checked in parallel (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--include-versioned",
+        action="store_true",
+        help="Also delete versioned buckets that only have delete markers left (the delete markers are removed first)",
+    )
     return parser.parse_args()
 
 
-def is_bucket_empty_and_unversioned(s3_client, bucket_name):
-    """Check if a bucket is empty and has versioning disabled."""
+def parse_inventories(values):
+    """Turn BUCKET=MANIFEST arguments into a dict."""
+    inventories = {}
+    for value in values:
+        bucket_name, separator, manifest = value.partition("=")
+        if not separator or not manifest:
+            sys.exit(f"Invalid --inventory value '{value}', expected BUCKET=MANIFEST")
+        inventories[bucket_name] = manifest
+    return inventories
+
+
+def get_regional_clients(regions, concurrency):
+    """Create one S3 client per region, sized for the concurrency limit."""
+    config = Config(max_pool_connections=concurrency, retries={"max_attempts": 10, "mode": "adaptive"})
+    return {region: boto3.client("s3", region_name=region, config=config) for region in regions}
+
+
+def group_buckets_by_region(s3_client, bucket_names, concurrency=DEFAULT_CONCURRENCY):
+    """Return a dict of region to bucket names, looking up the bucket locations concurrently."""
+    buckets_by_region = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        future_to_bucket = {
+            executor.submit(get_bucket_region, s3_client, bucket_name): bucket_name for bucket_name in bucket_names
+        }
+        for future in as_completed(future_to_bucket):
+            bucket_name = future_to_bucket[future]
+            try:
+                buckets_by_region[future.result()].append(bucket_name)
+            except (ClientError, BotoCoreError) as e:
+                print(f"Error getting the location of bucket {bucket_name}: {e}", file=sys.stderr)
+    return buckets_by_region
+
+
+def triage_bucket(s3_client, bucket_name, inventory=None):
+    """
+    Return EMPTY for an empty bucket (for a versioned bucket: no object versions and no delete markers),
+    DELETE_MARKERS_ONLY for a versioned bucket that only has delete markers left and None when the bucket still
+    holds objects.
+    """
     try:
+        versioning = s3_client.get_bucket_versioning(Bucket=bucket_name).get("Status")
+
         # Check if bucket is empty
-        result = s3_client.list_objects_v2(Bucket=bucket_name, MaxKeys=1)
-        if result.get("Contents"):
-            return False
-
-        # Check if versioning is disabled
-        versioning = s3_client.get_bucket_versioning(Bucket=bucket_name)
-        return versioning.get("Status") != "Enabled"
-    except ClientError as e:
+        if inventory:
+            if next(list_inventory_objects(s3_client, inventory), None) is not None:
+                return None
+            if versioning is None:
+                return EMPTY
+        elif versioning is None:
+            # Versioning was never enabled, so a single key is enough to tell
+            result = s3_client.list_objects_v2(Bucket=bucket_name, MaxKeys=1)
+            return None if result.get("Contents") else EMPTY
+
+        # Versioning is (or was) enabled, noncurrent versions and delete markers also keep the bucket from being deleted
+        has_delete_markers = False
+        paginator = s3_client.get_paginator("list_object_versions")
+        for page in paginator.paginate(Bucket=bucket_name):
+            if page.get("Versions"):
+                return None
+            has_delete_markers = has_delete_markers or bool(page.get("DeleteMarkers"))
+
+        return DELETE_MARKERS_ONLY if has_delete_markers else EMPTY
+    except (ClientError, BotoCoreError) as e:
         print(f"Error checking bucket {bucket_name}: {e}", file=sys.stderr)
-        return False
+        return None
 
 
-def get_empty_unversioned_buckets(s3_client):
-    """Return a list of empty buckets with versioning disabled."""
+def triage_buckets(s3_client, inventories=None, concurrency=DEFAULT_CONCURRENCY):
+    """Return a dict of bucket name to (region, triage result) for every bucket that can be deleted."""
     try:
         response = s3_client.list_buckets()
-        buckets = response["Buckets"]
-    except ClientError as e:
+        bucket_names = [bucket["Name"] for bucket in response["Buckets"]]
+    except (ClientError, BotoCoreError) as e:
         print(f"Error listing buckets: {e}", file=sys.stderr)
-        return []
-
-    return [bucket["Name"] for bucket in buckets if is_bucket_empty_and_unversioned(s3_client, bucket["Name"])]
-
-
-def delete_buckets(s3_resource, bucket_names, dry_run=False):
-    """Delete the specified buckets."""
-    for bucket_name in bucket_names:
-        try:
-            if dry_run:
-                print(f"[Dry Run] Would delete bucket: {bucket_name}")
-            else:
-                s3_resource.Bucket(bucket_name).delete()
-                print(f"Deleted bucket: {bucket_name}")
-        except ClientError as e:
-            print(f"Error deleting bucket {bucket_name}: {e}", file=sys.stderr)
+        return {}
+
+    inventories = inventories or {}
+    buckets_by_region = group_buckets_by_region(s3_client, bucket_names, concurrency)
+    clients = get_regional_clients(buckets_by_region, concurrency)
+    print(f"Checking {len(bucket_names)} bucket(s) across {len(buckets_by_region)} region(s)", file=sys.stderr)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        future_to_bucket = {
+            executor.submit(triage_bucket, clients[region], bucket_name, inventories.get(bucket_name)): (
+                bucket_name,
+                region,
+            )
+            for region, region_buckets in buckets_by_region.items()
+            for bucket_name in region_buckets
+        }
+        for future in as_completed(future_to_bucket):
+            bucket_name, region = future_to_bucket[future]
+            status = future.result()
+            if status:
+                results[bucket_name] = (region, status)
+    return results
+
+
+def delete_delete_markers(s3_client, bucket_name):
+    """Remove every delete marker from a bucket that has no object versions left."""
+    paginator = s3_client.get_paginator("list_object_versions")
+    for page in paginator.paginate(Bucket=bucket_name):
+        markers = [{"Key": marker["Key"], "VersionId": marker["VersionId"]} for marker in page.get("DeleteMarkers", [])]
+        if markers:
+            s3_client.delete_objects(Bucket=bucket_name, Delete={"Objects": markers, "Quiet": True})
+
+
+def delete_bucket(s3_client, bucket_name, status, dry_run=False):
+    try:
+        if dry_run:
+            print(f"[Dry Run] Would delete bucket: {bucket_name}")
+            return
+        if status == DELETE_MARKERS_ONLY:
+            delete_delete_markers(s3_client, bucket_name)
+        s3_client.delete_bucket(Bucket=bucket_name)
+        print(f"Deleted bucket: {bucket_name}")
+    except (ClientError, BotoCoreError) as e:
+        print(f"Error deleting bucket {bucket_name}: {e}", file=sys.stderr)
+
+
+def delete_buckets(buckets, dry_run=False, concurrency=DEFAULT_CONCURRENCY):
+    """Delete the specified buckets, given as a dict of bucket name to (region, triage result)."""
+    clients = get_regional_clients({region for region, _ in buckets.values()}, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        future_to_bucket = {
+            executor.submit(delete_bucket, clients[region], bucket_name, status, dry_run): bucket_name
+            for bucket_name, (region, status) in buckets.items()
+        }
+        for future in as_completed(future_to_bucket):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error deleting bucket {future_to_bucket[future]}: {e}", file=sys.stderr)
 
 
 def main():
     """Main function to run the script."""
     args = parse_arguments()
 
-    s3_client = boto3.client("s3")
-    s3_resource = boto3.resource("s3")
+    s3_client = boto3.client("s3", config=Config(max_pool_connections=args.concurrency))
+
+    triaged_buckets = triage_buckets(s3_client, parse_inventories(args.inventory), args.concurrency)
+    empty_buckets = {name: result for name, result in triaged_buckets.items() if result[1] == EMPTY}
+    marker_buckets = {name: result for name, result in triaged_buckets.items() if result[1] == DELETE_MARKERS_ONLY}
 
-    empty_buckets = get_empty_unversioned_buckets(s3_client)
+    if marker_buckets:
+        print(f"Found {len(marker_buckets)} versioned bucket(s) with only delete markers left:")
+        for bucket, (region, _) in sorted(marker_buckets.items()):
+            print(f"- {bucket} ({region})")
+        if args.include_versioned:
+            empty_buckets.update(marker_buckets)
+        else:
+            print("Use --include-versioned to delete these buckets as well.\n")
 
     if not empty_buckets:
-        print("No empty, unversioned buckets found.")
+        print("No empty buckets found.")
         return
 
-    print(f"Found {len(empty_buckets)} empty, unversioned bucket(s):")
-    for bucket in empty_buckets:
-        print(f"- {bucket}")
+    print(f"Found {len(empty_buckets)} empty bucket(s) to delete:")
+    for bucket, (region, _) in sorted(empty_buckets.items()):
+        print(f"- {bucket} ({region})")
 
     if args.dry_run:
         print("\nDry run mode. No buckets will be deleted.")
@@ -87,7 +227,7 @@ def main():
             print("Operation cancelled.")
             return
 
-    delete_buckets(s3_resource, empty_buckets, args.dry_run)
+    delete_buckets(empty_buckets, args.dry_run, args.concurrency)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+"""
+Description: Shared S3 Inventory reader for the S3 scripts in this folder. It streams the objects listed in an
+S3 Inventory report instead of listing the bucket through the API, which is the cheapest and fastest way to
+enumerate very large buckets. Entries are yielded as the same dictionaries as s3_listing.py returns, so the
+scripts can switch between live listing and inventory reports without other changes.
+
+Key features:
+- Reads manifest.json from a local path or an s3:// URL
+- Supports CSV (gzip) inventory files out of the box, ORC and Parquet when pyarrow is installed
+- Streams one data file at a time, so memory stays flat regardless of the inventory size
+- Maps the inventory fields to the list_objects_v2 / list_object_versions field names
+
+Usage (from another script in this folder):
+    from s3_inventory import list_inventory_objects
+
+    for obj in list_inventory_objects(s3_client, "s3://inventory-bucket/.../manifest.json"):
+        print(obj["Key"], obj["Size"])
+
+Note: an inventory is a daily or weekly snapshot, objects changed after it was generated are not included.
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus, urlparse
+
+# pyarrow.orc isn't available on every platform, so a missing ORC reader doesn't rule out Parquet
+try:
+    from pyarrow import orc
+except ImportError:
+    orc = None
+
+try:
+    from pyarrow import parquet
+except ImportError:
+    parquet = None
+
+# Inventory field names (CSV schema and ORC/Parquet column names) mapped to the listing API field names
+FIELD_NAMES = {
+    "Bucket": "Bucket",
+    "bucket": "Bucket",
+    "Key": "Key",
+    "key": "Key",
+    "VersionId": "VersionId",
+    "version_id": "VersionId",
+    "IsLatest": "IsLatest",
+    "is_latest": "IsLatest",
+    "IsDeleteMarker": "IsDeleteMarker",
+    "is_delete_marker": "IsDeleteMarker",
+    "Size": "Size",
+    "size": "Size",
+    "LastModifiedDate": "LastModified",
+    "last_modified_date": "LastModified",
+    "ETag": "ETag",
+    "e_tag": "ETag",
+    "StorageClass": "StorageClass",
+    "storage_class": "StorageClass",
+}
+# Listing API field names mapped back to the names of the fields in the inventory configuration
+INVENTORY_FIELD_NAMES = {api_name: field for field, api_name in FIELD_NAMES.items() if field[0].isupper()}
+
+
+def _parse_s3_url(url):
+    parsed = urlparse(url)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def load_manifest(s3_client, manifest_path):
+    """Load manifest.json from a local path or an s3:// URL."""
+    if manifest_path.startswith("s3://"):
+        bucket, key = _parse_s3_url(manifest_path)
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def check_inventory_fields(manifest, fields):
+    """
+    Raise a ValueError when the inventory doesn't include all of the given listing API fields (e.g. Size or
+    LastModified), which are optional in an inventory configuration. Works for the CSV, ORC and Parquet schemas.
+    """
+    schema_fields = {
+        FIELD_NAMES[name] for name in re.findall(r"\w+", manifest.get("fileSchema", "")) if name in FIELD_NAMES
+    }
+    missing = [INVENTORY_FIELD_NAMES.get(field, field) for field in fields if field not in schema_fields]
+    if missing:
+        raise ValueError(
+            f"The inventory of {manifest.get('sourceBucket', 'the bucket')} doesn't include the field(s) "
+            f"{', '.join(missing)}, add them to the inventory configuration and wait for the next report"
+        )
+
+
+def _resolve_local_file(manifest_path, key):
+    """Find a data file of a locally downloaded inventory, either at its full key or next to the manifest."""
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    candidates = [
+        os.path.join(manifest_dir, key),
+        os.path.join(manifest_dir, "data", os.path.basename(key)),
+        os.path.join(manifest_dir, os.path.basename(key)),
+    ]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f"Inventory data file {key} not found next to {manifest_path}")
+
+
+def _open_data_file(s3_client, manifest_path, manifest, key):
+    """Return a binary file object for an inventory data file."""
+    if manifest_path.startswith("s3://"):
+        bucket = manifest["destinationBucket"].split(":::")[-1]
+        return s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    return open(_resolve_local_file(manifest_path, key), "rb")
+
+
+def _convert(record):
+    """Convert a raw inventory record to the field names and types of the listing API."""
+    entry = {FIELD_NAMES[field]: value for field, value in record.items() if field in FIELD_NAMES}
+    if entry.get("Size") not in (None, ""):
+        entry["Size"] = int(entry["Size"])
+    else:
+        entry.pop("Size", None)
+    last_modified = entry.get("LastModified")
+    if isinstance(last_modified, str):
+        entry["LastModified"] = datetime.fromisoformat(last_modified.replace("Z", "+00:00"))
+    elif isinstance(last_modified, datetime) and last_modified.tzinfo is None:
+        entry["LastModified"] = last_modified.replace(tzinfo=timezone.utc)
+    for flag in ("IsLatest", "IsDeleteMarker"):
+        if isinstance(entry.get(flag), str):
+            entry[flag] = entry[flag].lower() == "true"
+    if entry.get("ETag") and not entry["ETag"].startswith('"'):
+        # The listing API returns quoted ETags
+        entry["ETag"] = f'"{entry["ETag"]}"'
+    return entry
+
+
+def _read_csv(data_file, schema):
+    with gzip.open(data_file, "rt", newline="") as text_file:
+        for row in csv.reader(text_file):
+            record = dict(zip(schema, row))
+            # Keys in CSV inventories are URL encoded
+            record["Key"] = unquote_plus(record["Key"])
+            yield record
+
+
+def _read_columnar(data_file, file_format):
+    if (parquet if file_format == "Parquet" else orc) is None:
+        raise RuntimeError(f"Reading {file_format} inventories requires pyarrow: pip install pyarrow")
+
+    # pyarrow needs a seekable file, spool S3 bodies to a temporary file first
+    with tempfile.TemporaryFile() as local_file:
+        shutil.copyfileobj(data_file, local_file)
+        local_file.seek(0)
+        if file_format == "Parquet":
+            batches = parquet.ParquetFile(local_file).iter_batches()
+        else:
+            orc_file = orc.ORCFile(local_file)
+            batches = (orc_file.read_stripe(stripe) for stripe in range(orc_file.nstripes))
+        for batch in batches:
+            yield from batch.to_pylist()
+
+
+def iter_inventory(s3_client, manifest_path, prefix=""):
+    """Yield every raw entry of the inventory (current objects, versions and delete markers) under prefix."""
+    manifest = load_manifest(s3_client, manifest_path)
+    file_format = manifest["fileFormat"]
+    schema = [field.strip() for field in manifest.get("fileSchema", "").split(",")]
+
+    for data_file_info in manifest["files"]:
+        data_file = _open_data_file(s3_client, manifest_path, manifest, data_file_info["key"])
+        try:
+            if file_format == "CSV":
+                records = _read_csv(data_file, schema)
+            elif file_format in ("ORC", "Parquet"):
+                records = _read_columnar(data_file, file_format)
+            else:
+                raise ValueError(f"Unsupported inventory format: {file_format}")
+
+            for record in records:
+                entry = _convert(record)
+                if entry["Key"].startswith(prefix):
+                    yield entry
+        finally:
+            data_file.close()
+
+
+def list_inventory_objects(s3_client, manifest_path, prefix="", **kwargs):
+    """Yield the current objects in the inventory, like s3_listing.list_objects."""
+    for entry in iter_inventory(s3_client, manifest_path, prefix):
+        if entry.get("IsLatest", True) and not entry.get("IsDeleteMarker", False):
+            yield entry
+
+
+def list_inventory_versions(s3_client, manifest_path, prefix="", **kwargs):
+    """Yield every version and delete marker in the inventory, like s3_listing.list_object_versions."""
+    return iter_inventory(s3_client, manifest_path, prefix)
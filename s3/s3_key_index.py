@@ -0,0 +1,210 @@
+"""
+Description: Shared on-disk key index for the S3 search scripts in this folder. It stores every key of a bucket
+in a local SQLite database (one per bucket), built from one full listing with the sharded parallel listing
+engine or from an S3 Inventory report. Repeated lookups are answered from the index in milliseconds instead of
+hitting S3 again, until the index is older than its TTL.
+
+Key features:
+- Exact, prefix (range scan on the primary key) and substring queries, plus the matchers from s3_search.py
+- In-place refresh: every refresh lists the bucket (or a single prefix) again, upserts the keys and removes
+  the keys that are gone, instead of recreating the database
+- Inventory refresh that only reads a report when it's newer than the one that was applied last
+- Configurable staleness TTL, stored per bucket in ~/.cache/aws-toolbox/s3-key-index
+
+Usage (from another script in this folder):
+    from s3_key_index import KeyIndex
+
+    index = KeyIndex("my-bucket", ttl=3600)
+    index.refresh(s3_client)
+    print(index.exists("path/to/my-file.txt"))
+    for key in index.iter_prefix("logs/2024/"):
+        print(key)
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+from s3_inventory import list_inventory_objects, load_manifest
+from s3_listing import list_objects
+from s3_search import SubstringMatcher
+
+DEFAULT_INDEX_TTL = 3600  # Seconds before the index is refreshed from S3 again
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "aws-toolbox", "s3-key-index")
+WRITE_BATCH_SIZE = 10000
+EXISTS_BATCH_SIZE = 500  # Stays below the SQLite limit of bound parameters per statement
+
+logger = logging.getLogger(__name__)
+
+
+def _prefix_upper_bound(prefix):
+    """Return the smallest string greater than every string that starts with prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class KeyIndex:
+    """SQLite index of the keys in one bucket."""
+
+    def __init__(self, bucket_name, path=None, ttl=DEFAULT_INDEX_TTL):
+        self.bucket_name = bucket_name
+        self.ttl = ttl
+        self.path = path or os.path.join(INDEX_DIR, f"{bucket_name}.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, etag TEXT, size INTEGER, "
+            "last_modified REAL, generation INTEGER NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);"
+        )
+        self.connection.commit()
+
+    def _get_meta(self, name, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, name, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def age(self):
+        """Return the seconds since the last refresh, or None when the index was never built."""
+        refreshed_at = self._get_meta("refreshed_at")
+        return time.time() - float(refreshed_at) if refreshed_at else None
+
+    def is_stale(self):
+        age = self.age()
+        return age is None or age > self.ttl
+
+    def _apply(self, objects, prefix="", snapshot_time=None):
+        """
+        Upsert the objects into the index and remove the keys under prefix that weren't seen. snapshot_time is
+        when the objects were taken from the bucket (e.g. the creation time of an inventory report), it
+        defaults to the start of the listing.
+        """
+        generation = int(self._get_meta("generation", 0)) + 1
+        previous_refresh = float(self._get_meta("refreshed_at", 0))
+        started_at = time.time()
+        seen = changed = 0
+
+        def flush(rows):
+            # Every key seen gets the new generation, keys left on an older generation no longer exist
+            self.connection.executemany(
+                "INSERT INTO keys (key, etag, size, last_modified, generation) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET etag = excluded.etag, size = excluded.size, "
+                "last_modified = excluded.last_modified, generation = excluded.generation",
+                rows,
+            )
+
+        rows = []
+        for obj in objects:
+            last_modified = obj["LastModified"].timestamp() if obj.get("LastModified") else None
+            rows.append((obj["Key"], obj.get("ETag"), obj.get("Size"), last_modified, generation))
+            seen += 1
+            if last_modified is None or last_modified > previous_refresh:
+                changed += 1
+            if len(rows) >= WRITE_BATCH_SIZE:
+                flush(rows)
+                rows = []
+        if rows:
+            flush(rows)
+
+        if prefix:
+            removed = self.connection.execute(
+                "DELETE FROM keys WHERE key >= ? AND key < ? AND generation < ?",
+                (prefix, _prefix_upper_bound(prefix), generation),
+            ).rowcount
+        else:
+            removed = self.connection.execute("DELETE FROM keys WHERE generation < ?", (generation,)).rowcount
+
+        self._set_meta("generation", generation)
+        if not prefix:
+            # A partial refresh doesn't make the rest of the index any fresher
+            self._set_meta("refreshed_at", started_at if snapshot_time is None else snapshot_time)
+        self.connection.commit()
+        logger.info(
+            f"Indexed {seen} keys of {self.bucket_name} ({changed} new or modified since the last refresh, "
+            f"{removed} removed) in {time.time() - started_at:.1f}s"
+        )
+
+    def refresh(self, s3_client, prefix="", inventory=None, force=False):
+        """
+        Bring the index up to date when it's older than the TTL (or always with force).
+
+        Every refresh lists the whole bucket again, with a prefix only the keys under that prefix. With an
+        inventory manifest the index is refreshed from the report instead of a listing, but only when the report
+        is newer than the last one. The age of the index is then the age of the report, not of the refresh.
+        """
+        if inventory:
+            manifest = load_manifest(s3_client, inventory)
+            # creationTimestamp is in milliseconds since the epoch
+            creation_timestamp = int(manifest.get("creationTimestamp", 0))
+            if not force and creation_timestamp <= int(self._get_meta("inventory_timestamp", -1)):
+                logger.info(f"The index of {self.bucket_name} is already up to date with this inventory")
+                return
+            self._apply(list_inventory_objects(s3_client, inventory, prefix), prefix, creation_timestamp / 1000)
+            self._set_meta("inventory_timestamp", creation_timestamp)
+            self.connection.commit()
+            return
+
+        if not force and not self.is_stale():
+            return
+        self._apply(list_objects(s3_client, self.bucket_name, prefix), prefix)
+
+    def exists(self, key):
+        return self.connection.execute("SELECT 1 FROM keys WHERE key = ?", (key,)).fetchone() is not None
+
+    def iter_exists(self, keys):
+        """Yield (key, exists) for every unique key."""
+        keys = list(set(keys))
+        for start in range(0, len(keys), EXISTS_BATCH_SIZE):
+            batch = keys[start : start + EXISTS_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            existing_keys = {
+                row[0] for row in self.connection.execute(f"SELECT key FROM keys WHERE key IN ({placeholders})", batch)
+            }
+            for key in batch:
+                yield key, key in existing_keys
+
+    def iter_prefix(self, prefix=""):
+        """Yield the keys under prefix in lexicographic order."""
+        if not prefix:
+            rows = self.connection.execute("SELECT key FROM keys ORDER BY key")
+        else:
+            rows = self.connection.execute(
+                "SELECT key FROM keys WHERE key >= ? AND key < ? ORDER BY key", (prefix, _prefix_upper_bound(prefix))
+            )
+        for (key,) in rows:
+            yield key
+
+    def iter_substring(self, substring, prefix=""):
+        """Yield the keys under prefix that contain substring."""
+        if not prefix:
+            rows = self.connection.execute("SELECT key FROM keys WHERE instr(key, ?) > 0 ORDER BY key", (substring,))
+        else:
+            rows = self.connection.execute(
+                "SELECT key FROM keys WHERE key >= ? AND key < ? AND instr(key, ?) > 0 ORDER BY key",
+                (prefix, _prefix_upper_bound(prefix), substring),
+            )
+        for (key,) in rows:
+            yield key
+
+    def search(self, matcher, prefix=""):
+        """Yield the keys under prefix that match a matcher from s3_search.py, like s3_search.search_keys."""
+        start_prefix = matcher.start_prefix()
+        if start_prefix.startswith(prefix):
+            prefix = start_prefix
+        elif not prefix.startswith(start_prefix):
+            return
+
+        if isinstance(matcher, SubstringMatcher):
+            yield from self.iter_substring(matcher.pattern, prefix)
+            return
+        for key in self.iter_prefix(prefix):
+            if matcher.matches(key):
+                yield key
+
+    def close(self):
+        self.connection.close()
@@ -2,25 +2,178 @@
 #
 # This script allows you to list all files older than N numbers of days.
 #
+# It prints an age report per prefix: a histogram of object counts and bytes per age bucket. The bucket is
+# listed with the sharded parallel listing engine from s3_listing.py and processed in fixed-size chunks of
+# compact columnar arrays (timestamps, sizes and prefix ids), so memory stays bounded even for buckets with
+# billions of objects. When numpy is installed the age classification of each chunk is vectorized.
+# Optionally the keys older than --older-than days are written to a deletion candidate list.
+# With --inventory the objects are read from an S3 Inventory report (s3_inventory.py) instead.
+#
+# Usage: python s3_list_old_files.py <bucket> [--older-than DAYS] [--age-buckets 7,30,90,180,365]
+#                                     [--prefix-depth N] [--candidates-file FILE] [--inventory MANIFEST]
+#
 # Reference question : https://stackoverflow.com/questions/67616761/how-to-use-python-boto3-to-get-count-of-files-object-in-s3-bucket-older-than-60/67617160#67617160
 
+import argparse
+import time
+from array import array
+from bisect import bisect_right
+
 import boto3
-import datetime
-from time import mktime
 
+from s3_inventory import check_inventory_fields, list_inventory_objects, load_manifest
+from s3_listing import list_objects
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHUNK_SIZE = 100000
+SECONDS_PER_DAY = 86400
+
+
+def prefix_of(key, depth):
+    """Return the first depth path components of key, e.g. 'logs/2024/' for depth 2."""
+    parts = key.split("/", depth)
+    if len(parts) <= depth:
+        return "/".join(parts[:-1]) + "/" if len(parts) > 1 else "/"
+    return "/".join(parts[:depth]) + "/"
+
+
+class AgeReport:
+    """Per-prefix histograms of object counts and bytes per age bucket."""
+
+    def __init__(self, age_buckets, now=None):
+        self.now = now or time.time()
+        # Objects with a LastModified after these cutoffs are younger than the matching age bucket boundary
+        self.cutoffs = sorted(self.now - days * SECONDS_PER_DAY for days in age_buckets)
+        self.age_buckets = sorted(age_buckets)
+        self.prefixes = {}
+        self.counts = []
+        self.bytes = []
+
+    def prefix_id(self, prefix):
+        if prefix not in self.prefixes:
+            self.prefixes[prefix] = len(self.prefixes)
+            self.counts.append([0] * (len(self.cutoffs) + 1))
+            self.bytes.append([0] * (len(self.cutoffs) + 1))
+        return self.prefixes[prefix]
+
+    def add_chunk(self, prefix_ids, timestamps, sizes):
+        """Aggregate one chunk of columns, bucket index 0 is the oldest age bucket."""
+        if numpy is not None:
+            prefix_column = numpy.frombuffer(prefix_ids, dtype=numpy.int64)
+            bucket_column = numpy.searchsorted(
+                numpy.array(self.cutoffs), numpy.frombuffer(timestamps, dtype=numpy.float64), side="right"
+            )
+            cell_column = prefix_column * (len(self.cutoffs) + 1) + bucket_column
+            cells = len(self.prefixes) * (len(self.cutoffs) + 1)
+            counts = numpy.bincount(cell_column, minlength=cells)
+            byte_counts = numpy.bincount(
+                cell_column, weights=numpy.frombuffer(sizes, dtype=numpy.int64), minlength=cells
+            )
+            for cell in numpy.flatnonzero(counts):
+                prefix_id, bucket = divmod(int(cell), len(self.cutoffs) + 1)
+                self.counts[prefix_id][bucket] += int(counts[cell])
+                self.bytes[prefix_id][bucket] += int(byte_counts[cell])
+        else:
+            for prefix_id, timestamp, size in zip(prefix_ids, timestamps, sizes):
+                bucket = bisect_right(self.cutoffs, timestamp)
+                self.counts[prefix_id][bucket] += 1
+                self.bytes[prefix_id][bucket] += size
+
+    def bucket_labels(self):
+        # Bucket 0 holds the oldest objects, the last bucket the youngest
+        boundaries = list(reversed(self.age_buckets))
+        labels = [f">{boundaries[0]}d"]
+        labels += [f"{younger}-{older}d" for older, younger in zip(boundaries, boundaries[1:])]
+        labels.append(f"<{boundaries[-1]}d")
+        return labels
+
+    def print(self):
+        labels = self.bucket_labels()
+        print(f"{'Prefix':<40} " + " ".join(f"{label:>22}" for label in labels))
+        for prefix, prefix_id in sorted(self.prefixes.items()):
+            cells = [
+                f"{count} ({size / (1024**3):.2f} GB)"
+                for count, size in zip(self.counts[prefix_id], self.bytes[prefix_id])
+            ]
+            print(f"{prefix:<40} " + " ".join(f"{cell:>22}" for cell in cells))
+
+        totals = [sum(counts[bucket] for counts in self.counts) for bucket in range(len(labels))]
+        total_bytes = [sum(sizes[bucket] for sizes in self.bytes) for bucket in range(len(labels))]
+        cells = [f"{count} ({size / (1024**3):.2f} GB)" for count, size in zip(totals, total_bytes)]
+        print(f"{'Total':<40} " + " ".join(f"{cell:>22}" for cell in cells))
+
+
+def scan_bucket(objects, report, prefix_depth=1, older_than=None, candidates_file=None):
+    """Feed the listing into the report in columnar chunks and write deletion candidates on the way."""
+    candidate_cutoff = report.now - older_than * SECONDS_PER_DAY if older_than is not None else None
+    candidate_count = 0
+
+    prefix_ids, timestamps, sizes = array("q"), array("d"), array("q")
+    for obj in objects:
+        timestamp = obj["LastModified"].timestamp()
+        prefix_ids.append(report.prefix_id(prefix_of(obj["Key"], prefix_depth)))
+        timestamps.append(timestamp)
+        sizes.append(obj["Size"])
+
+        if candidates_file and candidate_cutoff is not None and timestamp < candidate_cutoff:
+            candidates_file.write(obj["Key"] + "\n")
+            candidate_count += 1
+
+        if len(prefix_ids) >= CHUNK_SIZE:
+            report.add_chunk(prefix_ids, timestamps, sizes)
+            prefix_ids, timestamps, sizes = array("q"), array("d"), array("q")
+
+    if prefix_ids:
+        report.add_chunk(prefix_ids, timestamps, sizes)
+    return candidate_count
+
+
+def parse_age_buckets(value):
+    try:
+        return sorted({int(days) for days in value.split(",")})
+    except ValueError:
+        raise argparse.ArgumentTypeError("Age buckets must be a comma separated list of days, e.g. 7,30,90")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report object ages per prefix in an S3 bucket")
+    parser.add_argument("bucket", help="Name of the bucket to scan")
+    parser.add_argument("--prefix", default="", help="Only scan keys under this prefix")
+    parser.add_argument("--older-than", type=int, default=60, help="Age in days for deletion candidates (default: 60)")
+    parser.add_argument(
+        "--age-buckets",
+        type=parse_age_buckets,
+        default=[7, 30, 90, 180, 365],
+        help="Comma separated age bucket boundaries in days (default: 7,30,90,180,365)",
+    )
+    parser.add_argument("--prefix-depth", type=int, default=1, help="Number of path components per prefix")
+    parser.add_argument("--candidates-file", help="Write the keys older than --older-than days to this file")
+    parser.add_argument(
+        "--inventory", help="Scan an S3 Inventory manifest.json (local path or s3:// URL) instead of listing the bucket"
+    )
+    args = parser.parse_args()
 
-client = boto3.client("s3")
-response = client.list_objects(Bucket="angularbuildbucket")
-print(response)
-today_date_time = datetime.datetime.now().replace(tzinfo=None)
-print(today_date_time)
+    client = boto3.client("s3")
+    report = AgeReport(args.age_buckets)
+    if args.inventory:
+        try:
+            # The age report needs the optional Size and LastModifiedDate inventory fields
+            check_inventory_fields(load_manifest(client, args.inventory), ["Size", "LastModified"])
+        except ValueError as e:
+            raise SystemExit(str(e))
+        objects = list_inventory_objects(client, args.inventory, args.prefix)
+    else:
+        objects = list_objects(client, args.bucket, args.prefix)
 
-for file in response.get("Contents"):
-    file_name = file.get("Key")
-    modified_time = file.get("LastModified").replace(tzinfo=None)
+    if args.candidates_file:
+        with open(args.candidates_file, "w") as candidates_file:
+            candidate_count = scan_bucket(objects, report, args.prefix_depth, args.older_than, candidates_file)
+        print(f"Wrote {candidate_count} keys older than {args.older_than} days to {args.candidates_file}")
+    else:
+        scan_bucket(objects, report, args.prefix_depth)
 
-    difference_days_delta = today_date_time - modified_time
-    difference_days = difference_days_delta.days
-    print("difference_days---", difference_days)
-    if difference_days > 60:
-        print("file more than 60 days older : - ", file_name)
+    report.print()
@@ -0,0 +1,214 @@
+"""
+Description: Shared listing engine for the S3 scripts in this folder. Instead of walking a bucket through a
+single list_objects_v2 cursor, it probes the key space with Delimiter requests to find prefix boundaries,
+lists the resulting shards in parallel threads and yields one merged stream of objects (or versions).
+
+Key features:
+- Discovers shards with single-page Delimiter probes, so probing never turns into a full serial listing
+- Lists shards concurrently while the consumer already processes the first results
+- Bounded result queue, so memory stays flat no matter how large the bucket is
+- Same dictionaries as the Contents / Versions entries returned by the S3 API
+- Works for both list_objects_v2 and list_object_versions
+
+Usage (from another script in this folder):
+    from s3_listing import list_objects
+
+    for obj in list_objects(s3_client, "my-bucket"):
+        print(obj["Key"], obj["Size"])
+
+Note: the merged stream is not sorted by key, shards are interleaved as they are listed.
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_LIST_WORKERS = 16
+DEFAULT_TARGET_SHARDS = 64
+DEFAULT_MAX_DEPTH = 3
+RESULT_QUEUE_SIZE = 64  # Pages of up to 1000 entries each
+
+_DONE = object()
+
+
+def _page_items(page, operation):
+    """Return the entries of a single listing page."""
+    if operation == "list_object_versions":
+        delete_markers = [{**marker, "IsDeleteMarker": True} for marker in page.get("DeleteMarkers", [])]
+        return page.get("Versions", []) + delete_markers
+    return page.get("Contents", [])
+
+
+def _probe(s3_client, operation, bucket_name, prefix, delimiter):
+    """
+    Fetch one Delimiter page under prefix.
+
+    Returns a tuple of (items, child_prefixes, complete). When the level doesn't fit in a single page,
+    complete is False and the prefix should be listed as one shard instead of being split.
+    """
+    page = getattr(s3_client, operation)(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter)
+    child_prefixes = [common_prefix["Prefix"] for common_prefix in page.get("CommonPrefixes", [])]
+    return _page_items(page, operation), child_prefixes, not page.get("IsTruncated", False)
+
+
+def discover_shards(
+    s3_client,
+    bucket_name,
+    prefix="",
+    operation="list_objects_v2",
+    delimiter="/",
+    target_shards=DEFAULT_TARGET_SHARDS,
+    max_depth=DEFAULT_MAX_DEPTH,
+    max_workers=DEFAULT_LIST_WORKERS,
+):
+    """
+    Split the key space under prefix into shards using Delimiter probes.
+
+    Returns a tuple of (items, shards): items are the entries found directly on the probed levels,
+    shards are the prefixes that still need a full (non-delimited) listing.
+    """
+    items, frontier, complete = _probe(s3_client, operation, bucket_name, prefix, delimiter)
+    if not complete:
+        # Too many entries on the first level to split safely, list everything as a single shard
+        return [], [prefix]
+
+    # Shards with too many entries to probe in one page are resolved, they are listed in full and never probed again
+    resolved = []
+    depth = 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while frontier and len(resolved) + len(frontier) < target_shards and depth < max_depth:
+            probes = executor.map(
+                lambda shard: _probe(s3_client, operation, bucket_name, shard, delimiter),
+                frontier,
+            )
+            next_frontier = []
+            for shard, (shard_items, child_prefixes, shard_complete) in zip(frontier, probes):
+                if shard_complete:
+                    items.extend(shard_items)
+                    next_frontier.extend(child_prefixes)
+                else:
+                    resolved.append(shard)
+            frontier = next_frontier
+            depth += 1
+
+    return items, resolved + frontier
+
+
+def _list_shard(s3_client, operation, bucket_name, shard, results, stop_event):
+    paginator = s3_client.get_paginator(operation)
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=shard):
+        page_items = _page_items(page, operation)
+        if not page_items:
+            continue
+        while not stop_event.is_set():
+            try:
+                results.put(page_items, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        if stop_event.is_set():
+            return
+
+
+def iter_listing(
+    s3_client,
+    bucket_name,
+    prefix="",
+    operation="list_objects_v2",
+    max_workers=DEFAULT_LIST_WORKERS,
+    target_shards=DEFAULT_TARGET_SHARDS,
+    max_depth=DEFAULT_MAX_DEPTH,
+):
+    """
+    Yield every entry under prefix, listing the discovered shards in parallel.
+
+    Exceptions raised while listing a shard are re-raised in the consuming thread.
+    """
+    items, shards = discover_shards(
+        s3_client,
+        bucket_name,
+        prefix,
+        operation=operation,
+        target_shards=target_shards,
+        max_depth=max_depth,
+        max_workers=max_workers,
+    )
+    yield from items
+
+    if not shards:
+        return
+
+    results = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+    stop_event = threading.Event()
+    shard_queue = queue.Queue()
+    for shard in shards:
+        shard_queue.put(shard)
+
+    def worker():
+        try:
+            while not stop_event.is_set():
+                try:
+                    shard = shard_queue.get_nowait()
+                except queue.Empty:
+                    break
+                _list_shard(s3_client, operation, bucket_name, shard, results, stop_event)
+        except Exception as e:
+            stop_event.set()
+            results.put(e)
+        finally:
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(max_workers, len(shards)))]
+    for thread in threads:
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < len(threads):
+            page_items = results.get()
+            if page_items is _DONE:
+                finished += 1
+            elif isinstance(page_items, Exception):
+                raise page_items
+            else:
+                yield from page_items
+    finally:
+        # Unblock the workers when the consumer stops early or a shard failed
+        stop_event.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def list_objects(s3_client, bucket_name, prefix="", **kwargs):
+    """Yield the Contents entries of every object under prefix."""
+    return iter_listing(s3_client, bucket_name, prefix, operation="list_objects_v2", **kwargs)
+
+
+def list_object_versions(s3_client, bucket_name, prefix="", **kwargs):
+    """Yield every version and delete marker under prefix. Delete markers have IsDeleteMarker set to True."""
+    return iter_listing(s3_client, bucket_name, prefix, operation="list_object_versions", **kwargs)
+
+
+def iter_ordered_versions(s3_client, bucket_name, prefix=""):
+    """
+    Yield every version and delete marker under prefix sorted by key, newest version first.
+
+    Unlike list_object_versions this is a single serial listing, for consumers that need all versions
+    of a key next to each other.
+    """
+    paginator = s3_client.get_paginator("list_object_versions")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        delete_markers = [{**marker, "IsDeleteMarker": True} for marker in page.get("DeleteMarkers", [])]
+        # Both lists are sorted by key and newest first, merge them back into the order S3 paginates in
+        yield from heapq.merge(
+            page.get("Versions", []),
+            delete_markers,
+            key=lambda entry: (entry["Key"], not entry["IsLatest"], -entry["LastModified"].timestamp()),
+        )
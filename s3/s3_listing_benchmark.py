@@ -0,0 +1,106 @@
+"""
+Description: This script benchmarks the sharded parallel listing engine (s3_listing.py) against a plain serial
+list_objects_v2 paginator. It is meant to run against a local S3 stand-in such as MinIO or a moto server,
+but works against any S3 compatible endpoint.
+
+Key features:
+- Optionally populates the bucket with a synthetic, prefix-structured key space
+- Runs both listing strategies and verifies they return the same set of keys
+- Reports elapsed time, keys/sec and the speedup of the sharded listing
+
+Usage:
+python s3_listing_benchmark.py <bucket-name> [--endpoint-url URL] [--populate N] [--prefixes N] [--workers N]
+
+Example with a local moto server:
+moto_server -p 5000 &
+python s3_listing_benchmark.py bench-bucket --endpoint-url http://localhost:5000 --populate 50000
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+from s3_listing import DEFAULT_LIST_WORKERS, list_objects
+
+
+def setup_logging():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    return logging.getLogger(__name__)
+
+
+def get_s3_client(endpoint_url=None):
+    config = Config(max_pool_connections=50, retries={"max_attempts": 10, "mode": "adaptive"})
+    return boto3.client("s3", endpoint_url=endpoint_url, config=config)
+
+
+def populate_bucket(s3_client, bucket_name, object_count, prefix_count):
+    try:
+        s3_client.create_bucket(Bucket=bucket_name)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    keys = [f"prefix-{i % prefix_count:04d}/sub-{i % 7}/object-{i:09d}.txt" for i in range(object_count)]
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(lambda key: s3_client.put_object(Bucket=bucket_name, Key=key, Body=b"x"), keys))
+    logger.info(f"Populated {bucket_name} with {object_count} objects across {prefix_count} prefixes")
+
+
+def list_serial(s3_client, bucket_name):
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for obj in page.get("Contents", []):
+            yield obj
+
+
+def run_benchmark(name, listing):
+    start_time = time.monotonic()
+    keys = {obj["Key"] for obj in listing}
+    elapsed = time.monotonic() - start_time
+    logger.info(f"{name}: {len(keys)} keys in {elapsed:.2f}s ({len(keys) / max(elapsed, 1e-6):.0f} keys/sec)")
+    return keys, elapsed
+
+
+def main(bucket_name, endpoint_url=None, populate=0, prefixes=64, workers=DEFAULT_LIST_WORKERS):
+    s3_client = get_s3_client(endpoint_url)
+
+    if populate:
+        populate_bucket(s3_client, bucket_name, populate, prefixes)
+
+    serial_keys, serial_elapsed = run_benchmark("Serial listing", list_serial(s3_client, bucket_name))
+    sharded_keys, sharded_elapsed = run_benchmark(
+        "Sharded listing", list_objects(s3_client, bucket_name, max_workers=workers)
+    )
+
+    if serial_keys != sharded_keys:
+        logger.error(
+            f"Listings differ: {len(serial_keys - sharded_keys)} keys missing, "
+            f"{len(sharded_keys - serial_keys)} unexpected keys in the sharded listing"
+        )
+    else:
+        logger.info(f"Speedup: {serial_elapsed / max(sharded_elapsed, 1e-6):.1f}x")
+
+
+if __name__ == "__main__":
+    logger = setup_logging()
+
+    parser = argparse.ArgumentParser(description="Benchmark sharded S3 listing against serial listing")
+    parser.add_argument("bucket_name", help="Name of the bucket to list")
+    parser.add_argument("--endpoint-url", help="S3 endpoint URL, e.g. http://localhost:5000 for a moto server")
+    parser.add_argument("--populate", type=int, default=0, help="Number of synthetic objects to create first")
+    parser.add_argument("--prefixes", type=int, default=64, help="Number of top-level prefixes when populating")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_LIST_WORKERS,
+        help=f"Number of parallel listing threads (default: {DEFAULT_LIST_WORKERS})",
+    )
+    args = parser.parse_args()
+
+    main(args.bucket_name, args.endpoint_url, args.populate, args.prefixes, args.workers)
@@ -0,0 +1,209 @@
+"""
+Description: Shared key search engine for the S3 search scripts in this folder. It walks the bucket level by
+level with Delimiter listings (fully paginated), traverses the prefixes concurrently and prunes every prefix
+that can't contain a match for the pattern. Matches are yielded as soon as they're found.
+
+Key features:
+- Substring, glob and regex matchers
+- Glob patterns are matched per path segment: * and ? don't cross a "/", ** matches any number of segments
+- Starts at the longest literal prefix of the pattern and skips prefixes that can't match
+- Concurrent per-prefix traversal with a bounded result queue, so memory stays flat
+
+Usage (from another script in this folder):
+    from s3_search import GlobMatcher, search_keys
+
+    for key in search_keys(s3_client, "my-bucket", GlobMatcher("logs/*/processed/**/*.gz")):
+        print(key)
+
+Author: Danny Steenman
+License: MIT
+"""
+
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SEARCH_WORKERS = 16
+RESULT_QUEUE_SIZE = 64
+MATCH_TYPES = ["substring", "glob", "regex"]
+
+_REGEX_SPECIAL_CHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+class SubstringMatcher:
+    """Matches keys that contain the pattern anywhere, which can't prune any prefix."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def matches(self, key):
+        return self.pattern in key
+
+    def start_prefix(self):
+        return ""
+
+    def may_contain(self, prefix):
+        return True
+
+
+def _glob_segment_to_regex(segment):
+    regex = ""
+    index = 0
+    while index < len(segment):
+        character = segment[index]
+        if character == "*":
+            regex += "[^/]*"
+        elif character == "?":
+            regex += "[^/]"
+        elif character == "[":
+            end = segment.find("]", index + 1)
+            if end == -1:
+                regex += re.escape(character)
+            else:
+                content = segment[index + 1 : end].replace("\\", "\\\\")
+                # Only a leading "!" negates the set, a leading "^" is a literal character like in fnmatch
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                elif content.startswith("^"):
+                    content = "\\" + content
+                regex += "[" + content + "]"
+                index = end
+        else:
+            regex += re.escape(character)
+        index += 1
+    return regex
+
+
+class GlobMatcher:
+    """Matches the whole key against a glob pattern, evaluated per "/" separated segment."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.segments = pattern.split("/")
+        self.segment_regexes = [
+            None if segment == "**" else re.compile(_glob_segment_to_regex(segment)) for segment in self.segments
+        ]
+        regex = "/".join(".*" if segment == "**" else _glob_segment_to_regex(segment) for segment in self.segments)
+        self.regex = re.compile(regex.replace(".*/", "(?:.*/)?"))
+
+    def matches(self, key):
+        return self.regex.fullmatch(key) is not None
+
+    def start_prefix(self):
+        literal_segments = []
+        for segment in self.segments[:-1]:
+            if any(character in segment for character in "*?["):
+                break
+            literal_segments.append(segment)
+        return "/".join(literal_segments) + "/" if literal_segments else ""
+
+    def may_contain(self, prefix):
+        """Check the complete segments of a prefix (ending with "/") against the pattern segments."""
+        prefix_segments = prefix.split("/")[:-1]
+        for index, segment in enumerate(prefix_segments):
+            if index < len(self.segment_regexes) and self.segment_regexes[index] is None:
+                # ** can match any number of segments, nothing below it can be pruned
+                return True
+            if index >= len(self.segment_regexes) - 1:
+                # The pattern ends before this prefix does
+                return False
+            if not self.segment_regexes[index].fullmatch(segment):
+                return False
+        return True
+
+
+class RegexMatcher:
+    """Matches keys with re.search, prefixes are only pruned for patterns anchored with ^."""
+
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern)
+        self.literal_prefix = ""
+        # Top-level alternations like ^a|b aren't anchored as a whole, so only prune simple anchored patterns
+        if pattern.startswith("^") and "|" not in pattern:
+            for character in pattern[1:]:
+                if character in _REGEX_SPECIAL_CHARACTERS:
+                    break
+                self.literal_prefix += character
+            # A quantifier after the literal part may apply to its last character, e.g. ^logs?/
+            if len(pattern) > len(self.literal_prefix) + 1 and pattern[len(self.literal_prefix) + 1] in "*?{":
+                self.literal_prefix = self.literal_prefix[:-1]
+
+    def matches(self, key):
+        return self.regex.search(key) is not None
+
+    def start_prefix(self):
+        return self.literal_prefix[: self.literal_prefix.rfind("/") + 1]
+
+    def may_contain(self, prefix):
+        return prefix.startswith(self.literal_prefix) or self.literal_prefix.startswith(prefix)
+
+
+def create_matcher(pattern, match_type="substring"):
+    return {"substring": SubstringMatcher, "glob": GlobMatcher, "regex": RegexMatcher}[match_type](pattern)
+
+
+def _search_level(s3_client, bucket_name, prefix, matcher, results, stop_event):
+    """List one level under prefix, send the matching keys and return the child prefixes worth descending into."""
+    child_prefixes = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
+        if stop_event.is_set():
+            break
+        child_prefixes.extend(
+            common_prefix["Prefix"]
+            for common_prefix in page.get("CommonPrefixes", [])
+            if matcher.may_contain(common_prefix["Prefix"])
+        )
+        matches = [obj["Key"] for obj in page.get("Contents", []) if matcher.matches(obj["Key"])]
+        while matches and not stop_event.is_set():
+            try:
+                results.put(matches, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+    return child_prefixes
+
+
+def search_keys(s3_client, bucket_name, matcher, prefix="", max_workers=DEFAULT_SEARCH_WORKERS):
+    """Yield every key under prefix that matches, traversing the prefixes concurrently."""
+    start_prefix = matcher.start_prefix()
+    if start_prefix.startswith(prefix):
+        prefix = start_prefix
+    elif not prefix.startswith(start_prefix):
+        return
+
+    results = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+    stop_event = threading.Event()
+
+    def search_level(level_prefix):
+        try:
+            child_prefixes = _search_level(s3_client, bucket_name, level_prefix, matcher, results, stop_event)
+            results.put(("done", child_prefixes))
+        except Exception as e:
+            results.put(("error", e))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        executor.submit(search_level, prefix)
+        running = 1
+        try:
+            while running:
+                message = results.get()
+                if isinstance(message, list):
+                    yield from message
+                    continue
+
+                status, payload = message
+                running -= 1
+                if status == "error":
+                    raise payload
+                for child_prefix in payload:
+                    executor.submit(search_level, child_prefix)
+                    running += 1
+        finally:
+            stop_event.set()
+            # Drain the queue so no worker stays blocked on a full queue during shutdown
+            while running:
+                message = results.get()
+                if isinstance(message, tuple):
+                    running -= 1
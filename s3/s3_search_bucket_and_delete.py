@@ -6,12 +6,21 @@ about the storage used in the bucket.
 Key features:
 - Supports dry run mode for safe execution
 - Provides detailed logging of all operations
-- Shows total storage used in the bucket
+- Shows total storage used in the bucket, from CloudWatch storage metrics or an exact listing (cached per bucket)
 - Handles both versioned and non-versioned buckets
 - Implements error handling for robustness
+- Lists the bucket with the sharded parallel listing engine (s3_listing.py)
+- Optionally reads the keys from an S3 Inventory report (s3_inventory.py) instead of listing the bucket
+- Lists and deletes in a pipeline with a bounded pool of parallel delete workers
+- Reports per-key delete errors and keys/sec throughput
+- Cleanup mode for versioned buckets that only removes noncurrent versions (older than N days or beyond the
+  newest K per key) and dangling delete markers, and reports the bytes reclaimed
 
 Usage:
-python s3_search_bucket_and_delete.py <bucket-name> [--dry-run]
+python s3_search_bucket_and_delete.py <bucket-name> [--dry-run] [--workers N] [--size-source {cloudwatch,exact}] [--include-versions]
+       [--inventory <manifest.json>]
+python s3_search_bucket_and_delete.py <bucket-name> --cleanup-versions [--noncurrent-days N] [--keep-versions K]
+       [--delete-markers] [--dry-run] [--workers N]
 
 Author: Danny Steenman
 License: MIT
@@ -20,10 +29,24 @@ License: MIT
 import argparse
 import logging
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 
 import boto3
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_bucket_size import SIZE_SOURCES, get_bucket_size
+from s3_inventory import list_inventory_objects, list_inventory_versions, load_manifest
+from s3_listing import iter_ordered_versions, list_object_versions, list_objects
+
+DELETE_BATCH_SIZE = 1000  # S3 delete_objects limit
+DEFAULT_DELETE_WORKERS = 16
+PROGRESS_LOG_INTERVAL = 100000
+SECONDS_PER_DAY = 86400
 
 
 def setup_logging():
@@ -39,78 +62,259 @@ def get_s3_client():
         sys.exit(1)
 
 
-def get_bucket_size(s3_client, bucket_name):
+def get_pipeline_client():
+    """Return a client configured for more concurrency, shared by the listing producer and all delete workers."""
+    config = Config(
+        max_pool_connections=50,  # Increase concurrent connections
+        retries={"max_attempts": 10, "mode": "adaptive"},  # Add retry logic
+    )
+    return boto3.client("s3", config=config), config.max_pool_connections
+
+
+def iter_delete_batches(s3_client, bucket_name, is_versioned, inventory=None):
+    """
+    Stream batches of at most DELETE_BATCH_SIZE keys (and version ids) ready for delete_objects.
+
+    When an inventory manifest is given the keys are read from the S3 Inventory report instead of a live listing.
+    """
+    if is_versioned:
+        listing = list_inventory_versions if inventory else list_object_versions
+        entries = (
+            {"Key": version["Key"], "VersionId": version["VersionId"]}
+            for version in listing(s3_client, inventory or bucket_name)
+            # Inventories of current versions only have no version ids, the live listing sweep picks those up
+            if version.get("VersionId")
+        )
+    else:
+        listing = list_inventory_objects if inventory else list_objects
+        entries = ({"Key": obj["Key"]} for obj in listing(s3_client, inventory or bucket_name))
+
+    return batched(entries)
+
+
+def batched(entries):
+    """Group a stream of delete entries into batches of at most DELETE_BATCH_SIZE."""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= DELETE_BATCH_SIZE:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def delete_batch(s3_client, bucket_name, batch):
+    """Delete a single batch and return the per-key errors reported by S3, with the Size of the entry if it had one."""
+    objects = [{name: entry[name] for name in ("Key", "VersionId") if name in entry} for entry in batch]
     try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        total_size = sum(obj["Size"] for obj in response.get("Contents", []))
-        return total_size
+        response = s3_client.delete_objects(Bucket=bucket_name, Delete={"Objects": objects, "Quiet": True})
+        errors = response.get("Errors", [])
+        if errors and any("Size" in entry for entry in batch):
+            sizes = {(entry["Key"], entry.get("VersionId")): entry.get("Size", 0) for entry in batch}
+            errors = [{**error, "Size": sizes.get((error["Key"], error.get("VersionId")), 0)} for error in errors]
+        return errors
     except ClientError as e:
-        logger.error(f"Failed to get bucket size for {bucket_name}: {e}")
-        return 0
+        # The whole request failed, so every key in the batch counts as an error
+        code = e.response["Error"]["Code"]
+        message = e.response["Error"]["Message"]
+        return [{**entry, "Code": code, "Message": message} for entry in batch]
+    except BotoCoreError as e:
+        return [{**entry, "Code": type(e).__name__, "Message": str(e)} for entry in batch]
+
+
+def iter_cleanup_entries(versions, noncurrent_days=None, keep_versions=None, delete_markers=False, stats=None):
+    """
+    Pick the entries to delete from a stream of versions sorted by key, newest first (iter_ordered_versions).
+
+    A noncurrent version is picked when it became noncurrent (its newer version was created) more than
+    noncurrent_days ago, or when it's beyond the newest keep_versions noncurrent versions of its key. With
+    delete_markers, noncurrent delete markers and latest delete markers without any versions left are picked.
+    Only a few counters are kept per key, so keys with millions of versions don't grow memory.
+    """
+    cutoff = time.time() - noncurrent_days * SECONDS_PER_DAY if noncurrent_days is not None else None
+    stats = stats if stats is not None else {}
+    stats.setdefault("pending_markers", 0)
+
+    for _, entries in groupby(versions, key=itemgetter("Key")):
+        latest_marker = None
+        noncurrent_count = 0
+        picked_versions = 0
+        kept_versions = 0
+        newer_created = None  # The moment the entry being looked at became noncurrent
+
+        for entry in entries:
+            is_latest = entry.get("IsLatest")
+            if entry.get("IsDeleteMarker"):
+                if is_latest:
+                    latest_marker = entry
+                elif delete_markers:
+                    # A noncurrent delete marker doesn't hide anything
+                    yield entry
+            elif not is_latest:
+                noncurrent_count += 1
+                expired = cutoff is not None and newer_created is not None and newer_created.timestamp() < cutoff
+                excess = keep_versions is not None and noncurrent_count > keep_versions
+                if expired or excess:
+                    picked_versions += 1
+                    yield entry
+                else:
+                    kept_versions += 1
+            newer_created = entry["LastModified"]
+
+        if delete_markers and latest_marker and not kept_versions:
+            if picked_versions:
+                # Removing the marker before its versions are gone would restore the newest one, the next run
+                # finds it dangling
+                stats["pending_markers"] += 1
+            else:
+                yield latest_marker
 
 
-def delete_bucket_contents(s3_client, bucket_name, dry_run=False):
-    try:
-        versioning = s3_client.get_bucket_versioning(Bucket=bucket_name)
-        is_versioned = versioning.get("Status") == "Enabled"
+def run_delete_pipeline(s3_client, bucket_name, batches, max_workers=DEFAULT_DELETE_WORKERS, dry_run=False):
+    """
+    Delete the batches yielded by a producer using a bounded pool of workers.
+
+    The producer is paused once max_workers * 2 batches are in flight, so listing never runs
+    far ahead of deleting. Entries may carry a Size, which is summed up for the deleted keys.
+    Returns a tuple of (processed_keys, failed_keys, deleted_bytes).
+    """
+    in_flight = threading.BoundedSemaphore(max_workers * 2)
+    lock = threading.Lock()
+    stats = {"processed": 0, "failed": 0, "bytes": 0, "last_logged": 0}
+    start_time = time.monotonic()
 
-        # Configure the client for more concurrency
-        config = Config(
-            max_pool_connections=50,  # Increase concurrent connections
-            retries={"max_attempts": 10, "mode": "adaptive"},  # Add retry logic
+    def log_throughput(prefix):
+        elapsed = max(time.monotonic() - start_time, 1e-6)
+        logger.info(
+            f"{prefix}: {stats['processed']} keys ({stats['failed']} failed) in {elapsed:.1f}s "
+            f"- {stats['processed'] / elapsed:.0f} keys/sec"
         )
-        s3_resource = boto3.resource("s3", config=config)
-        bucket = s3_resource.Bucket(bucket_name)
 
-        def delete_objects(object_versions):
-            if not dry_run:
-                try:
-                    bucket.delete_objects(Delete={"Objects": object_versions})
-                except ClientError as e:
-                    logger.error(f"Error deleting objects: {e}")
+    def on_done(future, batch_size, batch_bytes):
+        in_flight.release()
+        try:
+            errors = future.result()
+        except Exception as e:
+            # The whole batch failed, e.g. the retries of delete_objects ran out
+            logger.error(f"Failed to delete a batch of {batch_size} keys: {e}")
+            with lock:
+                stats["processed"] += batch_size
+                stats["failed"] += batch_size
+            return
+        with lock:
+            stats["processed"] += batch_size
+            stats["failed"] += len(errors)
+            stats["bytes"] += batch_bytes - sum(error.get("Size", 0) for error in errors)
+            for error in errors:
+                logger.error(
+                    f"Failed to delete {error.get('Key')}"
+                    f"{' (version ' + error['VersionId'] + ')' if error.get('VersionId') else ''}: "
+                    f"{error.get('Code')} - {error.get('Message')}"
+                )
+            if stats["processed"] - stats["last_logged"] >= PROGRESS_LOG_INTERVAL:
+                stats["last_logged"] = stats["processed"]
+                log_throughput("Progress")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in batches:
+            batch_bytes = sum(entry.get("Size", 0) for entry in batch)
+            if dry_run:
+                logger.info(f"Would delete {len(batch)} keys")
+                stats["processed"] += len(batch)
+                stats["bytes"] += batch_bytes
+                continue
 
-        object_versions = []
-        count = 0
+            # Blocks the producer until a worker frees up a slot (backpressure)
+            in_flight.acquire()
+            future = executor.submit(delete_batch, s3_client, bucket_name, batch)
+            future.add_done_callback(lambda f, size=len(batch), size_bytes=batch_bytes: on_done(f, size, size_bytes))
 
-        if is_versioned:
-            iterator = bucket.object_versions.iterator()
-        else:
-            iterator = bucket.objects.iterator()
+    log_throughput("Finished")
+    return stats["processed"], stats["failed"], stats["bytes"]
 
-        for obj in iterator:
-            if is_versioned:
-                object_versions.append({"Key": obj.object_key, "VersionId": obj.id})
-            else:
-                object_versions.append({"Key": obj.key})
-            count += 1
 
-            # Process in batches of 1000 (S3 delete_objects limit)
-            if len(object_versions) >= 1000:
-                if dry_run:
-                    logger.info(f"Would delete {len(object_versions)} {'versions' if is_versioned else 'objects'}")
-                else:
-                    delete_objects(object_versions)
-                object_versions = []
+def delete_bucket_contents(s3_client, bucket_name, dry_run=False, max_workers=DEFAULT_DELETE_WORKERS, inventory=None):
+    try:
+        versioning = s3_client.get_bucket_versioning(Bucket=bucket_name)
+        is_versioned = versioning.get("Status") == "Enabled"
 
-            # Log progress every 10000 objects
-            if count % 10000 == 0:
-                logger.info(f"Processed {count} {'versions' if is_versioned else 'objects'}")
+        pipeline_client, max_pool_connections = get_pipeline_client()
+        max_workers = min(max_workers, max_pool_connections)
+        processed, failed = 0, 0
 
-        # Delete any remaining objects
-        if object_versions:
-            if dry_run:
-                logger.info(f"Would delete {len(object_versions)} {'versions' if is_versioned else 'objects'}")
-            else:
-                delete_objects(object_versions)
+        if inventory and load_manifest(s3_client, inventory).get("sourceBucket") != bucket_name:
+            logger.warning(f"Inventory {inventory} doesn't belong to {bucket_name}, using a live listing instead")
+            inventory = None
+
+        if inventory:
+            # Delete the bulk from the inventory report, the live listing below then only finds newer objects
+            logger.info(f"Deleting the objects listed in inventory {inventory}")
+            batches = iter_delete_batches(pipeline_client, bucket_name, is_versioned, inventory)
+            processed, failed, _ = run_delete_pipeline(pipeline_client, bucket_name, batches, max_workers, dry_run)
+            logger.info("Sweeping the objects created after the inventory was generated")
+
+        batches = iter_delete_batches(pipeline_client, bucket_name, is_versioned)
+        sweep_processed, sweep_failed, _ = run_delete_pipeline(
+            pipeline_client, bucket_name, batches, max_workers, dry_run
+        )
+        processed += sweep_processed
+        failed += sweep_failed
 
         logger.info(
-            f"{'Would delete' if dry_run else 'Deleted'} a total of {count} {'versions' if is_versioned else 'objects'} from {bucket_name}"
+            f"{'Would delete' if dry_run else 'Deleted'} a total of {processed - failed} "
+            f"{'versions' if is_versioned else 'objects'} from {bucket_name}"
         )
+        if failed:
+            logger.error(f"Failed to delete {failed} {'versions' if is_versioned else 'objects'} from {bucket_name}")
 
     except ClientError as e:
         logger.error(f"Failed to delete contents of bucket {bucket_name}: {e}")
 
 
+def cleanup_versions(
+    s3_client,
+    bucket_name,
+    noncurrent_days=None,
+    keep_versions=None,
+    delete_markers=False,
+    dry_run=False,
+    max_workers=DEFAULT_DELETE_WORKERS,
+):
+    """Delete the noncurrent versions and dangling delete markers picked by iter_cleanup_entries."""
+    try:
+        if s3_client.get_bucket_versioning(Bucket=bucket_name).get("Status") is None:
+            logger.info(f"Versioning was never enabled on {bucket_name}, nothing to clean up")
+            return
+
+        pipeline_client, max_pool_connections = get_pipeline_client()
+        stats = {}
+        entries = iter_cleanup_entries(
+            iter_ordered_versions(pipeline_client, bucket_name), noncurrent_days, keep_versions, delete_markers, stats
+        )
+        batches = batched(
+            {name: entry[name] for name in ("Key", "VersionId", "Size") if name in entry} for entry in entries
+        )
+
+        processed, failed, reclaimed = run_delete_pipeline(
+            pipeline_client, bucket_name, batches, min(max_workers, max_pool_connections), dry_run
+        )
+        logger.info(
+            f"{'Would delete' if dry_run else 'Deleted'} {processed - failed} noncurrent versions and delete markers "
+            f"from {bucket_name}, reclaiming {reclaimed / (1024**3):.2f} GB"
+        )
+        if failed:
+            logger.error(f"Failed to delete {failed} versions from {bucket_name}")
+        if stats["pending_markers"]:
+            logger.info(
+                f"{stats['pending_markers']} delete markers are dangling once their versions are deleted, "
+                "run the cleanup again to remove them"
+            )
+    except ClientError as e:
+        logger.error(f"Failed to clean up versions of bucket {bucket_name}: {e}")
+
+
 def delete_bucket(s3_client, bucket_name, dry_run=False):
     try:
         if dry_run:
@@ -122,7 +326,15 @@ def delete_bucket(s3_client, bucket_name, dry_run=False):
         logger.error(f"Failed to delete bucket {bucket_name}: {e}")
 
 
-def main(target_bucket_name, dry_run=False):
+def main(
+    target_bucket_name,
+    dry_run=False,
+    max_workers=DEFAULT_DELETE_WORKERS,
+    size_source="cloudwatch",
+    include_versions=False,
+    inventory=None,
+    cleanup=None,
+):
     s3_client = get_s3_client()
 
     try:
@@ -143,14 +355,20 @@ def main(target_bucket_name, dry_run=False):
 
     for bucket_name in found_buckets:
         logger.info(f"Found bucket: {bucket_name}")
-        size_bytes = get_bucket_size(s3_client, bucket_name)
-        size_gb = size_bytes / (1024**3)  # Convert bytes to gigabytes
-        logger.info(f"Bucket size: {size_gb:.2f} GB")
+        bucket_size = get_bucket_size(s3_client, bucket_name, size_source, include_versions)
+        if bucket_size is None:
+            logger.info(f"Bucket size: unknown (source: {size_source})")
+        else:
+            size_bytes, object_count = bucket_size
+            size_gb = size_bytes / (1024**3)  # Convert bytes to gigabytes
+            logger.info(f"Bucket size: {size_gb:.2f} GB ({object_count} objects, source: {size_source})")
 
-        if dry_run:
+        if cleanup is not None:
+            cleanup_versions(s3_client, bucket_name, dry_run=dry_run, max_workers=max_workers, **cleanup)
+        elif dry_run:
             logger.info(f"Dry run: Would delete all contents and the bucket itself: {bucket_name}")
         else:
-            delete_bucket_contents(s3_client, bucket_name, dry_run)
+            delete_bucket_contents(s3_client, bucket_name, dry_run, max_workers, inventory)
             delete_bucket(s3_client, bucket_name, dry_run)
 
     logger.info("Operation completed.")
@@ -162,6 +380,58 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Delete S3 bucket and its contents")
     parser.add_argument("bucket_name", help="Name of the bucket to search for and delete")
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without actually deleting anything")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_DELETE_WORKERS,
+        help=f"Number of concurrent delete_objects workers (default: {DEFAULT_DELETE_WORKERS}, max: 50)",
+    )
+    parser.add_argument(
+        "--size-source",
+        choices=SIZE_SOURCES,
+        default="cloudwatch",
+        help="Source of the reported bucket size: daily CloudWatch storage metrics or an exact listing (default: cloudwatch)",
+    )
+    parser.add_argument(
+        "--include-versions",
+        action="store_true",
+        help="Include noncurrent versions in an exact bucket size (CloudWatch sizes always include them)",
+    )
+    parser.add_argument(
+        "--inventory", help="S3 Inventory manifest.json (local path or s3:// URL) to read the keys to delete from"
+    )
+    parser.add_argument(
+        "--cleanup-versions",
+        action="store_true",
+        help="Only delete noncurrent versions and delete markers, keeping the current objects and the bucket",
+    )
+    parser.add_argument(
+        "--noncurrent-days", type=int, help="Cleanup: delete versions that have been noncurrent for more than N days"
+    )
+    parser.add_argument(
+        "--keep-versions", type=int, help="Cleanup: delete the versions beyond the newest K noncurrent versions per key"
+    )
+    parser.add_argument(
+        "--delete-markers", action="store_true", help="Cleanup: delete noncurrent and dangling delete markers"
+    )
     args = parser.parse_args()
 
-    main(args.bucket_name, args.dry_run)
+    cleanup = None
+    if args.cleanup_versions:
+        if args.noncurrent_days is None and args.keep_versions is None and not args.delete_markers:
+            parser.error("--cleanup-versions needs --noncurrent-days, --keep-versions and/or --delete-markers")
+        cleanup = {
+            "noncurrent_days": args.noncurrent_days,
+            "keep_versions": args.keep_versions,
+            "delete_markers": args.delete_markers,
+        }
+
+    main(
+        args.bucket_name,
+        args.dry_run,
+        args.workers,
+        args.size_source,
+        args.include_versions,
+        args.inventory,
+        cleanup,
+    )
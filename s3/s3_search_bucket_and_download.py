@@ -7,11 +7,19 @@ Key features:
 - Provides detailed logging of all operations
 - Maintains the original folder structure when downloading
 - Implements error handling for robustness
-- Shows progress of downloads
+- Shows progress of downloads (objects, bytes and pending downloads)
+- Lists the bucket once and streams it into a bounded work queue, so memory stays flat
+- Lists the bucket with the sharded parallel listing engine (s3_listing.py)
+- Shows the bucket size from CloudWatch storage metrics or an exact listing (cached per bucket)
 - Allows specifying a custom target path for each bucket's contents
+- Splits large objects into concurrent byte-range GETs and batches small objects, sharing one concurrency
+  and bandwidth budget
+- Sync mode that only downloads new or changed objects and resumes interrupted runs
 
 Usage:
-python s3_search_bucket_and_download.py <bucket-name> [--dry-run] [--output-dir <path>] [--target-path <path>]
+python s3_search_bucket_and_download.py <bucket-name> [--dry-run] [--output-dir <path>] [--target-path <path>] [--workers N] [--sync]
+       [--multipart-threshold MB] [--multipart-chunksize MB] [--max-bandwidth MB/s]
+       [--size-source {cloudwatch,exact}] [--include-versions]
 
 Author: Danny Steenman
 License: MIT
@@ -20,12 +28,27 @@ License: MIT
 import argparse
 import logging
 import os
+import sqlite3
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_bucket_size import SIZE_SOURCES, get_bucket_size
+from s3_listing import list_objects
+
+DEFAULT_DOWNLOAD_WORKERS = 10
+PROGRESS_LOG_INTERVAL = 100
+MANIFEST_FILENAME = ".s3-sync-manifest.sqlite"
+CHECKPOINT_INTERVAL = 500  # Manifest commits, an interrupted run resumes from the last one
+SMALL_BATCH_MAX_OBJECTS = 16  # Small objects downloaded back to back in one task
+READ_CHUNK_SIZE = 1024 * 1024
+RANGE_MAX_ATTEMPTS = 3  # Ranges are read from raw GETs, so streaming read errors are retried here
 
 
 def setup_logging():
@@ -45,61 +68,279 @@ def get_s3_client():
         sys.exit(1)
 
 
-def get_bucket_size(s3_client, bucket_name):
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        total_size = sum(obj["Size"] for obj in response.get("Contents", []))
-        return total_size
-    except ClientError as e:
-        logger.error(f"Failed to get bucket size for {bucket_name}: {e}")
-        return 0
+class SyncManifest:
+    """
+    Local SQLite manifest of the objects that were downloaded, used by --sync to skip unchanged objects.
 
+    Every successful download is recorded right away and committed every CHECKPOINT_INTERVAL downloads,
+    so an interrupted run resumes from its last checkpoint instead of starting over.
+    """
 
-def download_object(s3_client, bucket_name, obj_key, output_dir, dry_run=False):
+    def __init__(self, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS objects "
+            "(key TEXT PRIMARY KEY, etag TEXT NOT NULL, size INTEGER NOT NULL, last_modified TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    def is_current(self, obj, local_path):
+        """Return True when the object was already downloaded with the same ETag, size and LastModified."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT etag, size, last_modified FROM objects WHERE key = ?", (obj["Key"],)
+            ).fetchone()
+        if row is None or row != (obj["ETag"], obj["Size"], obj["LastModified"].isoformat()):
+            return False
+        # Re-download files that were removed or truncated locally
+        return os.path.isfile(local_path) and os.path.getsize(local_path) == obj["Size"]
+
+    def record(self, obj):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO objects (key, etag, size, last_modified) VALUES (?, ?, ?, ?)",
+                (obj["Key"], obj["ETag"], obj["Size"], obj["LastModified"].isoformat()),
+            )
+            self.pending_writes += 1
+            if self.pending_writes >= CHECKPOINT_INTERVAL:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class BandwidthLimiter:
+    """Token bucket shared by every download, limits the combined throughput to max_bytes_per_second."""
+
+    def __init__(self, max_bytes_per_second=None):
+        self.rate = max_bytes_per_second
+        self.tokens = max_bytes_per_second or 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def write_body(body, local_file, limiter):
+    for chunk in body.iter_chunks(READ_CHUNK_SIZE):
+        limiter.consume(len(chunk))
+        local_file.write(chunk)
+
+
+def download_object(s3_client, bucket_name, obj_key, output_dir, limiter, dry_run=False):
+    """Download a single object with one GET request and return True when it succeeded."""
     local_path = os.path.join(output_dir, obj_key)
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
 
     if dry_run:
         logger.info(f"Would download: s3://{bucket_name}/{obj_key} to {local_path}")
-    else:
-        try:
-            s3_client.download_file(bucket_name, obj_key, local_path)
-            logger.info(f"Downloaded: s3://{bucket_name}/{obj_key} to {local_path}")
-        except ClientError as e:
-            logger.error(f"Failed to download s3://{bucket_name}/{obj_key}: {e}")
+        return True
 
+    if obj_key.endswith("/"):
+        # Folder placeholder objects only need the directory
+        return True
 
-def download_bucket_contents(s3_client, bucket_name, output_dir, dry_run=False):
     try:
-        paginator = s3_client.get_paginator("list_objects_v2")
-        total_objects = 0
-        downloaded_objects = 0
+        response = s3_client.get_object(Bucket=bucket_name, Key=obj_key)
+        with open(local_path, "wb") as local_file:
+            write_body(response["Body"], local_file, limiter)
+        logger.info(f"Downloaded: s3://{bucket_name}/{obj_key} to {local_path}")
+        return True
+    except (ClientError, BotoCoreError, OSError) as e:
+        logger.error(f"Failed to download s3://{bucket_name}/{obj_key}: {e}")
+        return False
+
+
+def download_small_objects(s3_client, bucket_name, objects, output_dir, limiter, dry_run=False):
+    """Download a batch of small objects in one task and return a list of (object, succeeded)."""
+    return [(obj, download_object(s3_client, bucket_name, obj["Key"], output_dir, limiter, dry_run)) for obj in objects]
 
-        # Count total objects
-        for page in paginator.paginate(Bucket=bucket_name):
-            total_objects += len(page.get("Contents", []))
 
-        logger.info(f"Total objects to download: {total_objects}")
+def download_range(s3_client, bucket_name, obj, part_path, start, end, limiter):
+    """Download bytes start-end (inclusive) of a large object into its place in the partial file."""
+    for attempt in range(1, RANGE_MAX_ATTEMPTS + 1):
+        try:
+            # IfMatch makes sure all ranges come from the same version of the object
+            response = s3_client.get_object(
+                Bucket=bucket_name, Key=obj["Key"], Range=f"bytes={start}-{end}", IfMatch=obj["ETag"]
+            )
+            with open(part_path, "r+b") as local_file:
+                local_file.seek(start)
+                write_body(response["Body"], local_file, limiter)
+            return True
+        except BotoCoreError as e:
+            # Connection and streaming read errors while reading the body aren't retried by botocore
+            if attempt < RANGE_MAX_ATTEMPTS:
+                logger.warning(f"Retrying bytes {start}-{end} of s3://{bucket_name}/{obj['Key']}: {e}")
+                time.sleep(attempt)
+                continue
+            logger.error(f"Failed to download bytes {start}-{end} of s3://{bucket_name}/{obj['Key']}: {e}")
+        except (ClientError, OSError) as e:
+            logger.error(f"Failed to download bytes {start}-{end} of s3://{bucket_name}/{obj['Key']}: {e}")
+        return False
+
+
+def download_bucket_contents(s3_client, bucket_name, output_dir, dry_run=False, transfer_config=None, sync=False):
+    """
+    Download the bucket in a single listing pass.
+
+    Listed objects feed a bounded work window: the listing pauses while max_concurrency * 4 tasks are
+    in flight, so memory stays flat no matter how many objects the bucket holds. With sync enabled only
+    objects that are new or changed since the previous run are downloaded.
+
+    Objects below the multipart threshold are downloaded with a single GET and batched together in tasks,
+    larger objects are split into concurrent byte-range GETs of multipart_chunksize. Both kinds share the
+    same worker pool (max_concurrency) and bandwidth budget (max_bandwidth) of the TransferConfig.
+    """
+    transfer_config = transfer_config or TransferConfig(max_concurrency=DEFAULT_DOWNLOAD_WORKERS)
+    max_workers = transfer_config.max_concurrency
+    chunk_size = transfer_config.multipart_chunksize
+    limiter = BandwidthLimiter(transfer_config.max_bandwidth)
+    manifest = SyncManifest(output_dir) if sync else None
+    in_flight = threading.BoundedSemaphore(max_workers * 4)
+    lock = threading.Lock()
+    stats = {"listed": 0, "downloaded": 0, "failed": 0, "bytes": 0, "skipped": 0}
+
+    def log_progress(prefix):
+        pending = stats["listed"] - stats["downloaded"] - stats["failed"]
+        logger.info(
+            f"{prefix}: {stats['downloaded']} objects ({stats['bytes'] / (1024**2):.1f} MB) downloaded, "
+            f"{stats['failed']} failed, {stats['skipped']} unchanged, {pending} pending"
+        )
+
+    def finish(obj, succeeded):
+        with lock:
+            if succeeded and manifest and not dry_run:
+                manifest.record(obj)
+            if succeeded:
+                stats["downloaded"] += 1
+                stats["bytes"] += obj["Size"]
+            else:
+                stats["failed"] += 1
+            if (stats["downloaded"] + stats["failed"]) % PROGRESS_LOG_INTERVAL == 0:
+                log_progress("Progress")
+
+    def submit(on_result, func, *args):
+        # Blocks the listing until a slot in the work window frees up
+        in_flight.acquire()
+
+        def on_done(future):
+            in_flight.release()
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Unexpected error while downloading: {e}")
+                result = None
+            on_result(result)
+
+        executor.submit(func, *args).add_done_callback(on_done)
+
+    def submit_small_batch(batch):
+        def on_result(results):
+            for obj, succeeded in results or [(obj, False) for obj in batch]:
+                finish(obj, succeeded)
+
+        submit(on_result, download_small_objects, s3_client, bucket_name, batch, output_dir, limiter, dry_run)
+
+    def submit_large(obj):
+        local_path = os.path.join(output_dir, obj["Key"])
+        part_path = f"{local_path}.part"
+        try:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(part_path, "wb") as part_file:
+                part_file.truncate(obj["Size"])
+        except OSError as e:
+            logger.error(f"Failed to create {part_path} for s3://{bucket_name}/{obj['Key']}: {e}")
+            finish(obj, False)
+            return
+
+        ranges = [(start, min(start + chunk_size, obj["Size"]) - 1) for start in range(0, obj["Size"], chunk_size)]
+        state = {"remaining": len(ranges), "failed": False}
+
+        def on_range(succeeded):
+            with lock:
+                state["remaining"] -= 1
+                state["failed"] = state["failed"] or not succeeded
+                completed = state["remaining"] == 0
+            if not completed:
+                return
+            succeeded = not state["failed"]
+            try:
+                if succeeded:
+                    os.replace(part_path, local_path)
+                    logger.info(f"Downloaded: s3://{bucket_name}/{obj['Key']} to {local_path} ({len(ranges)} ranges)")
+                else:
+                    os.remove(part_path)
+            except OSError as e:
+                logger.error(f"Failed to finish {local_path}: {e}")
+                succeeded = False
+            finally:
+                finish(obj, succeeded)
+
+        for start, end in ranges:
+            submit(on_range, download_range, s3_client, bucket_name, obj, part_path, start, end, limiter)
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
-            for page in paginator.paginate(Bucket=bucket_name):
-                for obj in page.get("Contents", []):
-                    future = executor.submit(download_object, s3_client, bucket_name, obj["Key"], output_dir, dry_run)
-                    futures.append(future)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batch, batch_bytes = [], 0
+            for obj in list_objects(s3_client, bucket_name):
+                if manifest and manifest.is_current(obj, os.path.join(output_dir, obj["Key"])):
+                    stats["skipped"] += 1
+                    continue
 
-            for future in as_completed(futures):
-                downloaded_objects += 1
-                if downloaded_objects % 100 == 0 or downloaded_objects == total_objects:
-                    logger.info(f"Progress: {downloaded_objects}/{total_objects} objects downloaded")
+                with lock:
+                    stats["listed"] += 1
 
-        logger.info(f"{'Would download' if dry_run else 'Downloaded'} {total_objects} objects from {bucket_name}")
+                if obj["Size"] >= transfer_config.multipart_threshold and not dry_run:
+                    submit_large(obj)
+                    continue
 
-    except ClientError as e:
-        logger.error(f"Failed to download contents of bucket {bucket_name}: {e}")
+                batch.append(obj)
+                batch_bytes += obj["Size"]
+                if len(batch) >= SMALL_BATCH_MAX_OBJECTS or batch_bytes >= chunk_size:
+                    submit_small_batch(batch)
+                    batch, batch_bytes = [], 0
 
+            if batch:
+                submit_small_batch(batch)
 
-def main(target_bucket_name, output_dir, target_path, dry_run=False):
+    except ClientError as e:
+        logger.error(f"Failed to download contents of bucket {bucket_name}: {e}")
+    finally:
+        if manifest:
+            manifest.close()
+
+    log_progress("Finished")
+    logger.info(f"{'Would download' if dry_run else 'Downloaded'} {stats['downloaded']} objects from {bucket_name}")
+
+
+def main(
+    target_bucket_name,
+    output_dir,
+    target_path,
+    dry_run=False,
+    transfer_config=None,
+    sync=False,
+    size_source="cloudwatch",
+    include_versions=False,
+):
     s3_client = get_s3_client()
 
     try:
@@ -116,9 +357,13 @@ def main(target_bucket_name, output_dir, target_path, dry_run=False):
 
     for bucket_name in found_buckets:
         logger.info(f"Found bucket: {bucket_name}")
-        size_bytes = get_bucket_size(s3_client, bucket_name)
-        size_gb = size_bytes / (1024**3)  # Convert bytes to gigabytes
-        logger.info(f"Bucket size: {size_gb:.2f} GB")
+        bucket_size = get_bucket_size(s3_client, bucket_name, size_source, include_versions)
+        if bucket_size is None:
+            logger.info(f"Bucket size: unknown (source: {size_source})")
+        else:
+            size_bytes, object_count = bucket_size
+            size_gb = size_bytes / (1024**3)  # Convert bytes to gigabytes
+            logger.info(f"Bucket size: {size_gb:.2f} GB ({object_count} objects, source: {size_source})")
 
         if target_path:
             bucket_output_dir = os.path.join(output_dir, target_path)
@@ -128,7 +373,7 @@ def main(target_bucket_name, output_dir, target_path, dry_run=False):
         if dry_run:
             logger.info(f"Dry run: Would download all contents from {bucket_name} to {bucket_output_dir}")
         else:
-            download_bucket_contents(s3_client, bucket_name, bucket_output_dir, dry_run)
+            download_bucket_contents(s3_client, bucket_name, bucket_output_dir, dry_run, transfer_config, sync)
 
     logger.info("Operation completed.")
 
@@ -147,6 +392,52 @@ if __name__ == "__main__":
     parser.add_argument(
         "--target-path", help="Specific target path within the output directory to store bucket contents"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_DOWNLOAD_WORKERS,
+        help=f"Number of concurrent GET requests, shared by small objects and ranges (default: {DEFAULT_DOWNLOAD_WORKERS})",
+    )
+    parser.add_argument(
+        "--multipart-threshold",
+        type=int,
+        default=64,
+        help="Objects of at least this many MB are downloaded as concurrent byte ranges (default: 64)",
+    )
+    parser.add_argument(
+        "--multipart-chunksize", type=int, default=16, help="Size in MB of each byte-range GET (default: 16)"
+    )
+    parser.add_argument("--max-bandwidth", type=float, help="Combined download bandwidth limit in MB/s")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help=f"Only download new or changed objects, tracked in a local manifest ({MANIFEST_FILENAME})",
+    )
+    parser.add_argument(
+        "--size-source",
+        choices=SIZE_SOURCES,
+        default="cloudwatch",
+        help="Source of the reported bucket size: daily CloudWatch storage metrics or an exact listing (default: cloudwatch)",
+    )
+    parser.add_argument(
+        "--include-versions",
+        action="store_true",
+        help="Include noncurrent versions in an exact bucket size (CloudWatch sizes always include them)",
+    )
     args = parser.parse_args()
 
-    main(args.bucket_name, args.output_dir, args.target_path, args.dry_run)
+    main(
+        args.bucket_name,
+        args.output_dir,
+        args.target_path,
+        args.dry_run,
+        TransferConfig(
+            multipart_threshold=args.multipart_threshold * 1024**2,
+            multipart_chunksize=args.multipart_chunksize * 1024**2,
+            max_concurrency=args.workers,
+            max_bandwidth=int(args.max_bandwidth * 1024**2) if args.max_bandwidth else None,
+        ),
+        args.sync,
+        args.size_source,
+        args.include_versions,
+    )
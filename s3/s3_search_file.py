@@ -1,30 +1,41 @@
 #  Author : Avinash Dalvi
 #
 # This script allows you to search file in S3 bucket.
+# The search uses the search engine from s3_search.py: the bucket is traversed prefix by prefix with fully
+# paginated listings, concurrently, and prefixes that can't match the pattern are skipped. Set match_type to
+# "glob" (e.g. "*/processed/files/*.csv") or "regex" for more precise patterns. Matches are printed as soon
+# as they're found.
+# Set use_index to search the local key index (s3_key_index.py) instead, which is only refreshed from S3 when
+# it's older than index_ttl seconds.
 
 import boto3
 
+from s3_key_index import KeyIndex
+from s3_search import create_matcher, search_keys
+
 client = boto3.client("s3")
 bucket_name = "bucket_name"
 prefix = ""
-
-s3 = boto3.client("s3")
+pattern = "processed/files"
+# One of "substring", "glob" or "regex"
+match_type = "substring"
+use_index = False
+index_ttl = 3600
 
 
-def ListFiles(client, bucket_name, prefix):
-    _BUCKET_NAME = bucket_name
-    _PREFIX = prefix
-    """List files in specific S3 URL"""
-    response = client.list_objects(Bucket=_BUCKET_NAME, Prefix=_PREFIX)
+def ListFiles(client, bucket_name, prefix, matcher, use_index=False):
+    """List the files matching the pattern in specific S3 URL"""
+    if not use_index:
+        yield from search_keys(client, bucket_name, matcher, prefix)
+        return
 
-    for content in response.get("Contents", []):
-        yield content.get("Key")
+    index = KeyIndex(bucket_name, ttl=index_ttl)
+    try:
+        index.refresh(client)
+        yield from index.search(matcher, prefix)
+    finally:
+        index.close()
 
 
-result = client.list_objects(Bucket=bucket_name, Delimiter="/")
-for obj in result.get("CommonPrefixes"):
-    prefix = obj.get("Prefix")
-    file_list = ListFiles(client, bucket_name, prefix)
-    for file in file_list:
-        if "processed/files" in file:
-            print("Found", file)
+for file in ListFiles(client, bucket_name, prefix, create_matcher(pattern, match_type), use_index):
+    print("Found", file)
@@ -4,14 +4,30 @@
 #
 # This script searches for a single keys/object in an S3 bucket and let's you know wether it exists or not
 #
+# Set use_index to answer from the local key index (s3_key_index.py) instead of a head_object request. The index
+# is only refreshed from S3 when it's older than index_ttl seconds, which makes repeated lookups much faster.
+# Set inventory_manifest to an S3 Inventory manifest.json (local path or s3:// URL) to refresh the index from the
+# inventory report instead of listing the bucket.
+#
 # Usage: python search_key_bucket.py
 
 import boto3
 import botocore
 
+from s3_key_index import KeyIndex
+
 
-def key_exists(bucket, key):
+def key_exists(bucket, key, use_index=False, index_ttl=3600, inventory=None):
     s3 = boto3.client("s3")
+    if use_index:
+        index = KeyIndex(bucket, ttl=index_ttl)
+        try:
+            index.refresh(s3, inventory=inventory)
+            print(f"Key: '{key}' found!" if index.exists(key) else f"Key: '{key}' does not exist!")
+        finally:
+            index.close()
+        return
+
     try:
         s3.head_object(Bucket=bucket, Key=key)
         print(f"Key: '{key}' found!")
@@ -25,5 +41,8 @@ def key_exists(bucket, key):
 
 bucket = "my-bucket"
 key = "path/to/my-file.txt"
+use_index = False
+index_ttl = 3600
+inventory_manifest = None
 
-key_exists(bucket, key)
+key_exists(bucket, key, use_index, index_ttl, inventory_manifest)
@@ -4,26 +4,174 @@
 #
 # This script searches for multiple keys/objects in an S3 bucket and let's you know wether it exists or not
 #
-# Usage: python search_multiple_keys_bucket.py
+# Three strategies are available, by default the script picks the cheaper of list and head based on the number
+# of keys to check compared to the number of objects in the bucket (from the CloudWatch storage metrics):
+# - list: sort the keys, group them by their parent prefix and list only those prefixes (one request per
+#         1000 entries), cheap when many keys are checked against a relatively small bucket
+# - head: concurrent head_object requests through a shared connection pool, cheap for a few keys in a huge bucket
+# - index: answer from the local key index (s3_key_index.py), which is only refreshed from S3 when it's older
+#          than --index-ttl seconds, the fastest option when the same bucket is queried over and over. With
+#          --inventory the index is refreshed from an S3 Inventory report instead of a listing
+# Results are printed as soon as they are resolved.
+#
+# Usage: python s3_search_multiple_keys.py <bucket> [--keys-file FILE | --keys KEY [KEY ...]]
+#                                          [--strategy auto|list|head|index] [--index-ttl SECONDS]
+#                                          [--inventory MANIFEST]
+
+import argparse
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import groupby
 
 import boto3
+import botocore
+from botocore.config import Config
+
+from s3_bucket_size import get_bucket_size_from_cloudwatch
+from s3_key_index import DEFAULT_INDEX_TTL, KeyIndex
+
+DEFAULT_WORKERS = 32
+KEYS_PER_LIST_REQUEST = 1000
+
+
+def get_s3_client(max_workers=DEFAULT_WORKERS):
+    config = Config(max_pool_connections=max_workers, retries={"max_attempts": 10, "mode": "adaptive"})
+    return boto3.client("s3", config=config)
+
+
+def run_concurrently(func, items, max_workers=DEFAULT_WORKERS):
+    """Run func over items in a thread pool and yield the results as they complete, with a bounded backlog."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+
+
+def parent_prefix(key):
+    return key[: key.rfind("/") + 1]
+
+
+def check_prefix_group(s3, bucket, prefix, keys):
+    """List the direct children of prefix and return the existence of every key in the group."""
+    existing_keys = set()
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        existing_keys.update(item["Key"] for item in page.get("Contents", []))
+    return [(key, key in existing_keys) for key in keys]
+
+
+def iter_keys_exist_by_listing(s3, bucket, keys_to_check, max_workers=DEFAULT_WORKERS):
+    """Yield (key, exists) by listing only the prefixes the keys live in."""
+    sorted_keys = sorted(set(keys_to_check), key=lambda key: (parent_prefix(key), key))
+    groups = ((prefix, list(keys)) for prefix, keys in groupby(sorted_keys, key=parent_prefix))
+    for results in run_concurrently(lambda group: check_prefix_group(s3, bucket, *group), groups, max_workers):
+        yield from results
+
+
+def head_key(s3, bucket, key):
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return key, True
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return key, False
+        raise
+
+
+def iter_keys_exist_by_head(s3, bucket, keys_to_check, max_workers=DEFAULT_WORKERS):
+    """Yield (key, exists) using concurrent head_object requests."""
+    yield from run_concurrently(lambda key: head_key(s3, bucket, key), set(keys_to_check), max_workers)
+
+
+def choose_strategy(s3, bucket, keys_to_check):
+    """Prefer listing when listing the whole bucket would take fewer requests than one HEAD per key."""
+    try:
+        bucket_size = get_bucket_size_from_cloudwatch(s3, bucket)
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+        bucket_size = None
+
+    if bucket_size is None:
+        # Unknown bucket size, only list when the keys alone would fill a few list pages
+        return "list" if len(keys_to_check) >= KEYS_PER_LIST_REQUEST else "head"
+
+    _, object_count = bucket_size
+    return "list" if object_count / KEYS_PER_LIST_REQUEST <= len(keys_to_check) else "head"
+
+
+def iter_keys_exist_by_index(s3, bucket, keys_to_check, index_ttl=DEFAULT_INDEX_TTL, inventory=None):
+    """
+    Yield (key, exists) from the local key index, refreshing it first when it's stale, or from an inventory
+    manifest when it's newer than the report the index was last refreshed from.
+    """
+    index = KeyIndex(bucket, ttl=index_ttl)
+    try:
+        index.refresh(s3, inventory=inventory)
+        yield from index.iter_exists(keys_to_check)
+    finally:
+        index.close()
+
+
+def iter_keys_exist(
+    bucket, keys_to_check, strategy="auto", max_workers=DEFAULT_WORKERS, index_ttl=DEFAULT_INDEX_TTL, inventory=None
+):
+    """Yield (key, exists) for every unique key as soon as it is resolved."""
+    s3 = get_s3_client(max_workers)
+    if strategy == "index":
+        return iter_keys_exist_by_index(s3, bucket, keys_to_check, index_ttl, inventory)
+    if strategy == "auto":
+        strategy = choose_strategy(s3, bucket, keys_to_check)
+        print(f"Using the '{strategy}' strategy for {len(keys_to_check)} keys", file=sys.stderr)
+
+    if strategy == "list":
+        return iter_keys_exist_by_listing(s3, bucket, keys_to_check, max_workers)
+    return iter_keys_exist_by_head(s3, bucket, keys_to_check, max_workers)
+
 
+def check_keys_exist(
+    bucket, keys_to_check, strategy="auto", max_workers=DEFAULT_WORKERS, index_ttl=DEFAULT_INDEX_TTL, inventory=None
+):
+    return dict(iter_keys_exist(bucket, keys_to_check, strategy, max_workers, index_ttl, inventory))
 
-def check_keys_exist(bucket, keys_to_check):
-    s3 = boto3.client("s3")
-    response = s3.list_objects_v2(Bucket=bucket)
 
-    if "Contents" in response:
-        existing_keys = {item["Key"] for item in response["Contents"]}
-        return {key: key in existing_keys for key in keys_to_check}
-    else:
-        return {key: False for key in keys_to_check}
+def read_keys(keys_file):
+    with open(keys_file) as f:
+        # Only the line break is removed, leading and trailing spaces are valid parts of a key
+        return [line.rstrip("\n") for line in f if line.rstrip("\n")]
 
 
-bucket = "my-bucket"
-keys_to_check = ["path/to/file1.txt", "path/to/file2.txt", "path/to/file3.txt"]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check whether multiple keys exist in an S3 bucket")
+    parser.add_argument("bucket", help="Name of the bucket to search")
+    keys_group = parser.add_mutually_exclusive_group(required=True)
+    keys_group.add_argument("--keys-file", help="File with one key per line")
+    keys_group.add_argument("--keys", nargs="+", help="Keys to check")
+    parser.add_argument("--strategy", choices=["auto", "list", "head", "index"], default="auto", help="Lookup strategy")
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS, help=f"Concurrent requests (default: {DEFAULT_WORKERS})"
+    )
+    parser.add_argument(
+        "--index-ttl",
+        type=int,
+        default=DEFAULT_INDEX_TTL,
+        help=f"Refresh the local key index when it's older than this many seconds (default: {DEFAULT_INDEX_TTL})",
+    )
+    parser.add_argument(
+        "--inventory",
+        help="Refresh the key index from this S3 Inventory manifest.json (local path or s3:// URL), "
+        "requires --strategy index",
+    )
+    args = parser.parse_args()
+    if args.inventory and args.strategy != "index":
+        parser.error("--inventory requires --strategy index")
 
-result = check_keys_exist(bucket, keys_to_check)
+    keys_to_check = read_keys(args.keys_file) if args.keys_file else args.keys
 
-for key, exists in result.items():
-    print(f"Key {key} exists: {exists}")
+    results = iter_keys_exist(args.bucket, keys_to_check, args.strategy, args.workers, args.index_ttl, args.inventory)
+    for key, exists in results:
+        print(f"Key {key} exists: {exists}")
@@ -1,35 +1,38 @@
 #  Author : Avinash Dalvi
 #
 # This script allows you to search subdirectory under nested folder structure.
+# The search uses the search engine from s3_search.py: the bucket is traversed prefix by prefix with fully
+# paginated listings, concurrently, and prefixes that can't match the pattern are skipped. Set match_type to
+# "glob" (e.g. "**/processed/files/**") or "regex" for more precise patterns. Matches are printed as soon as
+# they're found. The keys can also be read from an S3 Inventory report instead.
 #
 # Reference question : https://stackoverflow.com/questions/62158664/search-in-each-of-the-s3-bucket-and-see-if-the-given-folder-exists/62160218#62160218
 
 
 import boto3
 
+from s3_inventory import list_inventory_objects
+from s3_search import create_matcher, search_keys
+
 client = boto3.client("s3")
 bucket_name = "bucket_name"
 prefix = ""
+pattern = "processed/files"
+# One of "substring", "glob" or "regex"
+match_type = "substring"
+# Set to an S3 Inventory manifest.json (local path or s3:// URL) to search the inventory instead of listing the bucket
+inventory_manifest = None
 
-s3 = boto3.client("s3")
-
-result = client.list_objects(Bucket=bucket_name, Delimiter="/")
-
-
-def ListFiles(client, bucket_name, prefix):
-    _BUCKET_NAME = bucket_name
-    _PREFIX = prefix
-    """List files in specific S3 URL"""
-    response = client.list_objects(Bucket=_BUCKET_NAME, Prefix=_PREFIX)
 
-    for content in response.get("Contents", []):
-        # print(content)
-        yield content.get("Key")
+def ListFiles(client, bucket_name, prefix, matcher):
+    """List the files matching the pattern in specific S3 URL"""
+    if inventory_manifest:
+        for content in list_inventory_objects(client, inventory_manifest, prefix):
+            if matcher.matches(content["Key"]):
+                yield content["Key"]
+    else:
+        yield from search_keys(client, bucket_name, matcher, prefix)
 
 
-for obj in result.get("CommonPrefixes"):
-    prefix = obj.get("Prefix")
-    file_list = ListFiles(client, bucket_name, prefix)
-    for file in file_list:
-        if "processed/files" in file:
-            print("Found", file)
+for file in ListFiles(client, bucket_name, prefix, create_matcher(pattern, match_type)):
+    print("Found", file)